@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .utils import topk_indices
+from .vectors import ROW_BLOCK, EmbeddingStore
+
+VECTOR_INDEXES = ("flat", "ivf")
+
+IVF_FILES = ("ivf.centroids.npy", "ivf.offsets.npy", "ivf.ids.npy")
+
+
+def default_num_lists(n_rows: int) -> int:
+    # ~4*sqrt(N) inverted lists, the usual IVF starting point
+    return max(1, min(n_rows, int(4 * np.sqrt(n_rows))))
+
+
+def _assign(embs: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # Nearest centroid (max inner product) per row, in row blocks so memmapped input stays paged
+    out = np.empty(embs.shape[0], dtype=np.int32)
+    for start in range(0, embs.shape[0], ROW_BLOCK):
+        block = np.asarray(embs[start:start + ROW_BLOCK], dtype=np.float32)
+        out[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return out
+
+
+def train_centroids(embs: np.ndarray, n_lists: int, n_iter: int = 10, max_train: int = 64, seed: int = 0) -> np.ndarray:
+    # Spherical k-means on a sample of at most max_train rows per list
+    rng = np.random.default_rng(seed)
+    n_rows = embs.shape[0]
+    n_sample = min(n_rows, n_lists * max_train)
+    sample_idx = np.sort(rng.choice(n_rows, n_sample, replace=False))
+    sample = np.asarray(embs[sample_idx], dtype=np.float32)
+    centroids = sample[rng.choice(n_sample, n_lists, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(assign, minlength=n_lists)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts[~empty])
+        if empty.any():
+            # Reseed empty lists with random sample points
+            sums[empty] = sample[rng.choice(n_sample, int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+class IVFIndex:
+    """Inverted-file ANN index: k-means centroids plus chunk ids grouped by nearest centroid."""
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+
+    @property
+    def n_lists(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(cls, embs: np.ndarray, n_lists: int = 0, n_iter: int = 10, seed: int = 0) -> "IVFIndex":
+        n_lists = min(n_lists or default_num_lists(embs.shape[0]), embs.shape[0])
+        centroids = train_centroids(embs, n_lists, n_iter=n_iter, seed=seed)
+        assign = _assign(embs, centroids)
+        ids = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=n_lists))
+        return cls(centroids, offsets, ids)
+
+    @classmethod
+    def load(cls, emb_dir: Path) -> Optional["IVFIndex"]:
+        if not all((emb_dir / name).exists() for name in IVF_FILES):
+            return None
+        return cls(*(np.load(emb_dir / name, mmap_mode="r") for name in IVF_FILES))
+
+    def expected_scan_rows(self, n_rows: int, nprobe: int) -> int:
+        # Rows a query scores on average: nprobe lists of the mean list size
+        return n_rows * max(1, min(nprobe, self.n_lists)) // self.n_lists
+
+    def save(self, emb_dir: Path) -> None:
+        for name, arr in zip(IVF_FILES, (self.centroids, self.offsets, self.ids)):
+            np.save(emb_dir / name, arr)
+
+    def search(
+        self,
+        store: EmbeddingStore,
+        query_embs: np.ndarray,
+        top_k: int,
+        nprobe: int = 8,
+        rescore_k: int = 0,
+        allowed: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # Scores only the rows in the nprobe lists nearest to each query (and in the boolean mask `allowed`,
+        # if given); higher nprobe = better recall, more latency. Rows are padded with -1 / -inf when the
+        # probed lists hold fewer than top_k (allowed) rows.
+        query_embs = np.asarray(query_embs, dtype=np.float32)
+        n_queries = query_embs.shape[0]
+        rescore = store.stored is not store.exact and rescore_k > top_k
+        k = rescore_k if rescore else top_k
+        nprobe = max(1, min(nprobe, self.n_lists))
+        lists = np.argsort(-(query_embs @ np.asarray(self.centroids).T), axis=1)[:, :nprobe]
+
+        out_idx = np.full((n_queries, top_k), -1, dtype=np.int64)
+        out_scores = np.full((n_queries, top_k), -np.inf)
+        for qi in range(n_queries):
+            cand = np.concatenate([self.ids[self.offsets[l]:self.offsets[l + 1]] for l in lists[qi]])
+            if allowed is not None:
+                cand = cand[allowed[cand]]
+            if len(cand) == 0:
+                continue
+            scores = store.score_ids(query_embs[qi], cand)
+            top = topk_indices(scores, min(k, len(cand)), largest=True)
+            idx, vals = cand[top][None, :], scores[top][None, :]
+            if rescore:
+                idx, vals = store.rescore(query_embs[qi:qi + 1], idx, top_k)
+            n = min(top_k, idx.shape[1])
+            out_idx[qi, :n] = idx[0, :n]
+            out_scores[qi, :n] = vals[0, :n]
+        return out_idx, out_scores
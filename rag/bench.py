@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import contextlib
+import io
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from dataclasses import replace
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from .config import RAGConfig
+from .utils import tokenize
+
+# End-to-end benchmark on synthetic corpora: build throughput, index load time and memory, and per-query
+# latency of each retrieval stage. Output is plain JSON so runs can be diffed across versions
+# (compare_reports flags regressions against a baseline file).
+
+CHUNKS_PER_DOC = 50
+STOPWORD_RANKS = 50  # the most frequent synthetic words are never used as query terms
+PERCENTILES = (50, 90, 95, 99)
+
+# Metrics compared by compare_reports: (section, key, True if higher is better)
+TRACKED = (
+    ("build", "chunks_per_sec", True),
+    ("load", "seconds", False),
+    ("load", "rss_after_queries_bytes", False),
+)
+
+
+def _vocabulary(size: int, rng: np.random.Generator) -> np.ndarray:
+    # Pronounceable pseudo-words (consonant-vowel syllables), unique, so BM25 sees a realistic term space
+    consonants, vowels = np.array(list("bcdfghjklmnprstvz")), np.array(list("aeiou"))
+    words: set = set()
+    while len(words) < size:
+        n = size - len(words)
+        syllables = rng.integers(2, 5, size=n)
+        for count in syllables:
+            words.add("".join(c + v for c, v in zip(rng.choice(consonants, count), rng.choice(vowels, count))))
+    return np.array(sorted(words))
+
+
+def _zipf_probs(size: int, exponent: float = 1.1) -> np.ndarray:
+    p = 1.0 / np.arange(1, size + 1) ** exponent
+    return p / p.sum()
+
+
+def synthetic_corpus(out_dir: Path, n_chunks: int, chunk_words: int, vocab_size: int = 50000, seed: int = 0) -> Dict:
+    """Write .txt documents of CHUNKS_PER_DOC chunks each (Zipf-distributed words) totalling n_chunks chunks.
+
+    Chunked with max_chunk_words=chunk_words and no overlap, the corpus yields exactly n_chunks chunks.
+    """
+    rng = np.random.default_rng(seed)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    vocab = _vocabulary(vocab_size, rng)
+    probs = _zipf_probs(vocab_size)
+    n_docs, n_bytes = 0, 0
+    for start in range(0, n_chunks, CHUNKS_PER_DOC):
+        words = vocab[rng.choice(vocab_size, size=min(CHUNKS_PER_DOC, n_chunks - start) * chunk_words, p=probs)]
+        lines = [" ".join(words[i:i + 20]) for i in range(0, len(words), 20)]
+        text = "\n".join(lines) + "\n"
+        path = out_dir / f"doc_{n_docs:07d}.txt"
+        path.write_text(text, encoding="utf-8")
+        n_docs += 1
+        n_bytes += len(text)
+    return {"documents": n_docs, "chunks": n_chunks, "bytes": n_bytes, "vocab_size": vocab_size}
+
+
+def synthetic_queries(n: int, vocab_size: int = 50000, seed: int = 0) -> List[str]:
+    # Same vocabulary and distribution as synthetic_corpus (same seed), minus the stopword-like head
+    rng = np.random.default_rng(seed)
+    vocab = _vocabulary(vocab_size, rng)
+    probs = _zipf_probs(vocab_size)[STOPWORD_RANKS:]
+    probs /= probs.sum()
+    query_rng = np.random.default_rng(seed + 1)
+    return [
+        " ".join(vocab[STOPWORD_RANKS + query_rng.choice(len(probs), size=query_rng.integers(2, 6), p=probs)])
+        for _ in range(n)
+    ]
+
+
+def _rss_bytes() -> int:
+    # Current resident set size; falls back to the peak where /proc is unavailable
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _dir_bytes(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    # Milliseconds, rounded so diffs between runs stay readable
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    summary = {f"p{p}": round(float(np.percentile(ms, p)), 4) for p in PERCENTILES}
+    summary.update(mean=round(float(ms.mean()), 4), max=round(float(ms.max()), 4), n=len(ms))
+    return summary
+
+
+def _time_each(fn: Callable[[str], object], queries: List[str]) -> Dict[str, float]:
+    seconds = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        seconds.append(time.perf_counter() - start)
+    return latency_summary(seconds)
+
+
+class _StubCompletions:
+    """Stands in for client.chat.completions: returns a canned answer without any network call."""
+
+    answer = "Synthetic answer citing the retrieved context [1].\n\nSources: [1]"
+
+    def create(self, **kwargs) -> SimpleNamespace:
+        message = SimpleNamespace(content=self.answer, role="assistant")
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")])
+
+
+def _bench_chatbot(config: RAGConfig, queries: List[str]) -> Dict[str, Dict]:
+    # retrieval_chatbot lives next to the rag package and needs openai; skipped when either is unavailable
+    try:
+        from retrieval_chatbot import WorkingRAGChatBot
+    except ImportError as e:
+        return {"skipped": str(e)}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        bot = WorkingRAGChatBot(str(config.index_dir), api_key="bench", config=config, answer_cache_size=0)
+        bot.client = SimpleNamespace(chat=SimpleNamespace(completions=_StubCompletions()))
+        contexts: List[List[Dict]] = []
+        out = {"retrieve_context": _time_each(lambda q: contexts.append(bot.retrieve_context(q)), queries)}
+        formatted = iter(contexts)
+        out["format_context_for_llm"] = _time_each(lambda q: bot.format_context_for_llm(next(formatted)), queries)
+        out["chat_stub_llm"] = _time_each(bot.chat, [f"{q} llm" for q in queries])
+    return out
+
+
+def bench_size(
+    n_chunks: int,
+    work_dir: Path,
+    config: RAGConfig,
+    n_queries: int,
+    seed: int = 0,
+    vocab_size: int = 50000,
+    chatbot: bool = True,
+) -> Dict:
+    """Build a synthetic index of n_chunks chunks under work_dir and measure build, load and query latency."""
+    from .embeddings import embed_queries, warm_up
+    from .index import build_index
+    from .retrieve import LoadedIndex, clear_index_registry, get_loaded_index, retrieve
+
+    corpus_dir, index_dir = work_dir / f"corpus_{n_chunks}", work_dir / f"index_{n_chunks}"
+    start = time.perf_counter()
+    corpus = synthetic_corpus(corpus_dir, n_chunks, config.max_chunk_words, vocab_size, seed)
+    corpus["seconds"] = round(time.perf_counter() - start, 4)
+
+    config = replace(config, index_dir=index_dir)
+    warm_up(config.embedding_model_name)
+    start = time.perf_counter()
+    stats = build_index(config, [corpus_dir])
+    seconds = time.perf_counter() - start
+    build = {
+        "seconds": round(seconds, 4),
+        "chunks": stats["chunks_total"],
+        "chunks_per_sec": round(stats["chunks_total"] / seconds, 2) if seconds else 0.0,
+        "embed_seconds": round(stats["embed_seconds"], 4),
+        "embed_texts_per_sec": round(stats["embed_texts_per_sec"], 2),
+        "index_bytes": _dir_bytes(index_dir),
+    }
+
+    # Load time and memory of a fresh LoadedIndex (artifacts are memory-mapped, so RSS grows as queries touch them)
+    clear_index_registry()
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    index = LoadedIndex(config)
+    load = {"seconds": round(time.perf_counter() - start, 4), "rss_bytes": _rss_bytes() - rss_before}
+    del index
+    index = get_loaded_index(config)
+
+    queries = synthetic_queries(n_queries, vocab_size, seed)
+    # Untimed pass so lazily built structures and first-touch page faults are not charged to the first query
+    retrieve(config, synthetic_queries(1, vocab_size, seed + 7)[0])
+
+    def bm25(q: str) -> None:
+        index.bm25.top_k_many([tokenize(q)], config.k_bm25, mode=config.bm25_search)
+
+    def vector(q: str) -> None:
+        embs = embed_queries([q], index.embedding_model_name)
+        if config.vector_index == "ivf" and index.ivf is not None:
+            index.ivf.search(index.vectors, embs, config.k_vector, nprobe=config.ivf_nprobe, rescore_k=config.vector_rescore_k)
+        else:
+            index.vectors.search(embs, config.k_vector, rescore_k=config.vector_rescore_k)
+
+    latency = {
+        "bm25": _time_each(bm25, queries),
+        "vector": _time_each(vector, [f"{q} v" for q in queries]),  # distinct strings: bypass the query-embedding cache
+        "fused": _time_each(lambda q: retrieve(config, q), [f"{q} f" for q in queries]),
+    }
+    load["rss_after_queries_bytes"] = _rss_bytes() - rss_before
+    if chatbot:
+        latency.update(_bench_chatbot(config, [f"{q} c" for q in queries]))
+    clear_index_registry()
+    return {"chunks": n_chunks, "corpus": corpus, "build": build, "load": load, "latency_ms": latency}
+
+
+def run_bench(
+    sizes: List[int],
+    config: RAGConfig,
+    n_queries: int = 200,
+    seed: int = 0,
+    work_dir: Optional[Path] = None,
+    chatbot: bool = True,
+) -> Dict:
+    """Benchmark every corpus size; synthetic corpora and indexes go to work_dir (a temp dir, removed, if None)."""
+    keep = work_dir is not None
+    work_dir = Path(work_dir) if keep else Path(tempfile.mkdtemp(prefix="rag-bench-"))
+    try:
+        runs = [bench_size(n, work_dir, config, n_queries, seed, chatbot=chatbot) for n in sizes]
+    finally:
+        if not keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {
+            "sizes": sizes,
+            "queries": n_queries,
+            "seed": seed,
+            "embedding_model_name": config.embedding_model_name,
+            "max_chunk_words": config.max_chunk_words,
+            "embedding_storage": config.embedding_storage,
+            "vector_index": config.vector_index,
+            "bm25_search": config.bm25_search,
+            "k_bm25": config.k_bm25,
+            "k_vector": config.k_vector,
+            "k_fused": config.k_fused,
+        },
+        "runs": runs,
+    }
+
+
+def compare_reports(baseline: Dict, current: Dict, tolerance: float = 0.2) -> List[Dict]:
+    """Metrics of current that are more than `tolerance` (relative) worse than baseline, matched by corpus size.
+
+    Latencies are compared on p50 and p95; build throughput and load time/memory as listed in TRACKED.
+    """
+    base_runs = {r["chunks"]: r for r in baseline.get("runs", [])}
+    regressions: List[Dict] = []
+
+    def check(chunks: int, metric: str, old, new, higher_is_better: bool) -> None:
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or old <= 0:
+            return
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append({"chunks": chunks, "metric": metric, "baseline": old, "current": new, "change": round(change, 4)})
+
+    for run in current.get("runs", []):
+        base = base_runs.get(run["chunks"])
+        if base is None:
+            continue
+        for section, key, higher in TRACKED:
+            check(run["chunks"], f"{section}.{key}", base.get(section, {}).get(key), run.get(section, {}).get(key), higher)
+        for stage, summary in run.get("latency_ms", {}).items():
+            for p in ("p50", "p95"):
+                old = base.get("latency_ms", {}).get(stage, {})
+                if isinstance(summary, dict) and isinstance(old, dict):
+                    check(run["chunks"], f"latency_ms.{stage}.{p}", old.get(p), summary.get(p), False)
+    return regressions
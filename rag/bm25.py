@@ -0,0 +1,437 @@
+from __future__ import annotations
+
+import math
+import mmap
+import os
+from array import array
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .utils import read_json, write_json
+
+# Okapi BM25 parameters (same defaults as rank_bm25.BM25Okapi)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25
+
+BM25_SEARCH_MODES = ("exhaustive", "maxscore")
+
+# Memory-mapped vocabulary: sorted terms as one UTF-8 blob plus int64 (n + 1) byte offsets
+VOCAB_FILES = ("vocab.bin", "vocab.offsets.npy")
+
+
+class MappedVocab(Sequence):
+    """Sorted vocabulary served from a memory-mapped blob; term ids are found by binary search.
+
+    Replaces the per-process term list and term -> id dict, so processes that map the same index
+    share its pages instead of each parsing vocab.json.
+    """
+
+    def __init__(self, blob, offsets: np.ndarray):
+        # blob: bytes-like (mmap.mmap when loaded); offsets are read through a memoryview, since each lookup
+        # touches ~log2(n) of them and numpy scalar access would dominate the search
+        self.blob = blob
+        self.offsets = offsets
+        self._offsets = memoryview(np.ascontiguousarray(offsets, dtype=np.int64)).cast("B").cast("q")
+
+    @classmethod
+    def load(cls, bm25_dir: Path) -> Optional["MappedVocab"]:
+        if not all((bm25_dir / name).exists() for name in VOCAB_FILES):
+            return None
+        with (bm25_dir / "vocab.bin").open("rb") as f:
+            # mmap cannot map an empty file
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+        return cls(blob, np.load(bm25_dir / "vocab.offsets.npy", mmap_mode="r"))
+
+    @staticmethod
+    def write(bm25_dir: Path, terms: Sequence[str]) -> bool:
+        # Binary search needs byte order; sorted str order is the same as UTF-8 byte order
+        encoded = [t.encode("utf-8") for t in terms]
+        if any(a >= b for a, b in zip(encoded, encoded[1:])):
+            return False
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(t) for t in encoded])
+        (bm25_dir / "vocab.bin").write_bytes(b"".join(encoded))
+        np.save(bm25_dir / "vocab.offsets.npy", offsets)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def _term_bytes(self, i: int) -> bytes:
+        return self.blob[self._offsets[i]:self._offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("term index out of range")
+        return self._term_bytes(i).decode("utf-8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self._term_bytes(i).decode("utf-8")
+
+    def find(self, term: str) -> Optional[int]:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self) and self._term_bytes(lo) == key else None
+
+
+class InvertedBM25:
+    """Okapi BM25 over an inverted index (term -> postings sorted by doc id).
+
+    Scores are identical to rank_bm25.BM25Okapi.get_scores, but a query only
+    touches the postings of its own terms.
+    """
+
+    def __init__(
+        self,
+        terms: Sequence[str],
+        offsets: np.ndarray,
+        doc_ids: np.ndarray,
+        tfs: np.ndarray,
+        doc_len: np.ndarray,
+        idf: np.ndarray,
+        params: Dict,
+        term_max: np.ndarray | None = None,
+    ):
+        self.terms = terms
+        # term -> id, or None for unknown terms
+        self.term_id = terms.find if isinstance(terms, MappedVocab) else {t: i for i, t in enumerate(terms)}.get
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.idf = idf
+        self.k1 = float(params["k1"])
+        self.b = float(params["b"])
+        self.epsilon = float(params["epsilon"])
+        self.avgdl = float(params["avgdl"])
+        self.n_docs = int(params["n_docs"])
+        # Per-term upper bound on the BM25 contribution, used by MaxScore pruning
+        self.term_max = term_max if term_max is not None else self._compute_term_max()
+
+    @classmethod
+    def from_tokenized(
+        cls,
+        corpus: List[List[str]],
+        k1: float = BM25_K1,
+        b: float = BM25_B,
+        epsilon: float = BM25_EPSILON,
+    ) -> "InvertedBM25":
+        builder = BM25Builder()
+        for tokens in corpus:
+            builder.add(tokens)
+        return builder.build(k1=k1, b=b, epsilon=epsilon)
+
+    @classmethod
+    def load(cls, bm25_dir: Path) -> "InvertedBM25":
+        term_max_path = bm25_dir / "term_max.npy"
+        return cls(
+            MappedVocab.load(bm25_dir) or read_json(bm25_dir / "vocab.json")["terms"],
+            np.load(bm25_dir / "postings_offsets.npy", mmap_mode="r"),
+            np.load(bm25_dir / "postings_docs.npy", mmap_mode="r"),
+            np.load(bm25_dir / "postings_tf.npy", mmap_mode="r"),
+            np.load(bm25_dir / "doc_len.npy", mmap_mode="r"),
+            np.load(bm25_dir / "idf.npy", mmap_mode="r"),
+            read_json(bm25_dir / "params.json"),
+            np.load(term_max_path, mmap_mode="r") if term_max_path.exists() else None,
+        )
+
+    def save(self, bm25_dir: Path) -> None:
+        bm25_dir.mkdir(parents=True, exist_ok=True)
+        terms = list(self.terms)
+        write_json(bm25_dir / "vocab.json", {"terms": terms})
+        if not MappedVocab.write(bm25_dir, terms):
+            for name in VOCAB_FILES:
+                (bm25_dir / name).unlink(missing_ok=True)
+        np.save(bm25_dir / "postings_offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+        np.save(bm25_dir / "postings_docs.npy", np.asarray(self.doc_ids, dtype=np.int32))
+        np.save(bm25_dir / "postings_tf.npy", np.asarray(self.tfs, dtype=np.int32))
+        np.save(bm25_dir / "doc_len.npy", np.asarray(self.doc_len, dtype=np.int32))
+        np.save(bm25_dir / "idf.npy", np.asarray(self.idf, dtype=np.float64))
+        np.save(bm25_dir / "term_max.npy", np.asarray(self.term_max, dtype=np.float64))
+        write_json(bm25_dir / "params.json", {
+            "k1": self.k1,
+            "b": self.b,
+            "epsilon": self.epsilon,
+            "avgdl": self.avgdl,
+            "n_docs": self.n_docs,
+        })
+
+    def _contrib(self, tid: int, q_freq: np.ndarray, doc_len: np.ndarray) -> np.ndarray:
+        # Same expression and evaluation order as BM25Okapi.get_scores
+        return float(self.idf[tid]) * (q_freq * (self.k1 + 1) / (q_freq + self.k1 * (1 - self.b + self.b * doc_len / self.avgdl)))
+
+    def _compute_term_max(self) -> np.ndarray:
+        if len(self.doc_ids) == 0:
+            return np.zeros(len(self.terms), dtype=np.float64)
+        tids = np.repeat(np.arange(len(self.terms)), np.diff(np.asarray(self.offsets)))
+        contrib = np.asarray(self.idf)[tids] * (
+            self.tfs * (self.k1 + 1) / (self.tfs + self.k1 * (1 - self.b + self.b * np.asarray(self.doc_len)[self.doc_ids] / self.avgdl))
+        )
+        term_max = np.full(len(self.terms), -np.inf)
+        np.maximum.at(term_max, tids, contrib)
+        return term_max
+
+    def term_postings(self, term: str, allowed: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Returns (doc ids, BM25 contribution of term to each of those docs); with a boolean mask `allowed`
+        # (see rag.filters) postings outside it are dropped before any contribution is computed
+        tid = self.term_id(term)
+        if tid is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float64)
+        start, end = int(self.offsets[tid]), int(self.offsets[tid + 1])
+        docs = np.asarray(self.doc_ids[start:end])
+        q_freq = np.asarray(self.tfs[start:end])
+        if allowed is not None:
+            keep = allowed[docs]
+            docs, q_freq = docs[keep], q_freq[keep]
+        return docs, self._contrib(tid, q_freq, np.asarray(self.doc_len[docs]))
+
+    def score_docs(self, query_tokens: List[str], idxs: List[int]) -> np.ndarray:
+        # Exact BM25 scores for a handful of docs, via binary search into each term's postings
+        q = np.asarray(idxs, dtype=np.int64)
+        scores = np.zeros(len(q))
+        if len(q) == 0:
+            return scores
+        for t in query_tokens:
+            tid = self.term_id(t)
+            if tid is None:
+                continue
+            start, end = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            docs = self.doc_ids[start:end]
+            pos = np.searchsorted(docs, q)
+            hit = pos < len(docs)
+            hit[hit] = docs[pos[hit]] == q[hit]
+            if hit.any():
+                p = pos[hit] + start
+                scores[hit] += self._contrib(tid, np.asarray(self.tfs[p]), np.asarray(self.doc_len[q[hit]]))
+        return scores
+
+    def sparse_scores(self, query_tokens: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        # (sorted doc ids with at least one query term, their BM25 scores)
+        parts = [self.term_postings(t) for t in query_tokens]
+        parts = [p for p in parts if len(p[0])]
+        if not parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64)
+        if len(parts) == 1:
+            return parts[0][0].astype(np.int64), parts[0][1]
+        docs = np.concatenate([p[0] for p in parts])
+        contribs = np.concatenate([p[1] for p in parts])
+        # bincount adds in input (query-term) order, matching the dense accumulation
+        uniq, inverse = np.unique(docs, return_inverse=True)
+        return uniq.astype(np.int64), np.bincount(inverse, weights=contribs, minlength=len(uniq))
+
+    def sparse_scores_many(self, token_lists: List[List[str]], allowed: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Batched sparse_scores: (query ids, doc ids, scores) for every matched (query, doc) pair in `allowed`
+        # (all docs if None), sorted by query then doc, accumulated with a single bincount over all queries
+        memo: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        q_parts, doc_parts, contrib_parts = [], [], []
+        for qi, tokens in enumerate(token_lists):
+            for t in tokens:
+                if t not in memo:
+                    memo[t] = self.term_postings(t, allowed)
+                docs, contrib = memo[t]
+                if len(docs):
+                    q_parts.append(np.full(len(docs), qi, dtype=np.int64))
+                    doc_parts.append(docs)
+                    contrib_parts.append(contrib)
+        if not doc_parts:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0, dtype=np.float64)
+        keys = np.concatenate(q_parts) * self.n_docs + np.concatenate(doc_parts)
+        uniq, inverse = np.unique(keys, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contrib_parts), minlength=len(uniq))
+        return uniq // self.n_docs, uniq % self.n_docs, scores
+
+    def get_scores(self, query_tokens: List[str]) -> np.ndarray:
+        scores = np.zeros(self.n_docs)
+        for t in query_tokens:
+            docs, contrib = self.term_postings(t)
+            scores[docs] += contrib
+        return scores
+
+    def top_k_many(
+        self,
+        token_lists: List[List[str]],
+        k: int,
+        mode: str = "exhaustive",
+        allowed: np.ndarray | None = None,
+    ) -> List[Tuple[List[int], List[float]]]:
+        # Per query: best k docs (containing at least one query term, within `allowed` if given) and their
+        # scores, highest first. The single entry point for top-k search; one query is a one-element batch.
+        if mode not in BM25_SEARCH_MODES:
+            raise ValueError(f"Unknown bm25_search mode: {mode!r} (expected one of {BM25_SEARCH_MODES})")
+        if mode == "maxscore":
+            # Pruning thresholds are per query, so MaxScore runs query by query
+            return [self._maxscore_top_k(tokens, k, allowed) for tokens in token_lists]
+        qids, doc_ids, scores = self.sparse_scores_many(token_lists, allowed)
+        # Sort by (query, score desc, doc) and keep the first k rows of each query
+        order = np.lexsort((doc_ids, -scores, qids))
+        q_sorted = qids[order]
+        starts = np.searchsorted(q_sorted, np.arange(len(token_lists) + 1))
+        rank = np.arange(len(order)) - starts[q_sorted]
+        keep = order[rank < k]
+        bounds = np.searchsorted(qids[keep], np.arange(len(token_lists) + 1))
+        kept_docs, kept_scores = doc_ids[keep].tolist(), scores[keep].tolist()
+        return [
+            (kept_docs[bounds[i]:bounds[i + 1]], kept_scores[bounds[i]:bounds[i + 1]])
+            for i in range(len(token_lists))
+        ]
+
+    def _maxscore_top_k(self, query_tokens: List[str], k: int, allowed: np.ndarray | None = None) -> Tuple[List[int], List[float]]:
+        # Term-at-a-time MaxScore: terms are visited by decreasing upper bound. Once the bounds of
+        # the remaining terms cannot lift an unseen doc past the current k-th best partial score,
+        # their postings are only probed (binary search) for existing candidates instead of merged,
+        # and candidates that can no longer reach the threshold are dropped.
+        term_ids = {t: self.term_id(t) for t in set(query_tokens)}
+        counts = Counter(t for t in query_tokens if term_ids[t] is not None)
+        if k <= 0 or not counts:
+            return [], []
+        terms = list(counts)
+        tids = [term_ids[t] for t in terms]
+        if any(float(self.idf[tid]) <= 0 for tid in tids):
+            # Bounds assume non-negative contributions
+            return self.top_k_many([query_tokens], k, allowed=allowed)[0]
+        bounds = [float(self.term_max[tid]) * counts[t] for t, tid in zip(terms, tids)]
+        order = sorted(range(len(tids)), key=lambda i: bounds[i], reverse=True)
+        remaining = np.cumsum([bounds[i] for i in order][::-1])[::-1].tolist() + [0.0]
+
+        # Candidates are kept unsorted; only each term's postings need to be sorted for the probes
+        cand_docs = np.zeros(0, dtype=np.int64)
+        cand_scores = np.zeros(0, dtype=np.float64)
+        theta = -np.inf
+        for step, i in enumerate(order):
+            tid, mult = tids[i], counts[terms[i]]
+            start, end = int(self.offsets[tid]), int(self.offsets[tid + 1])
+            docs = self.doc_ids[start:end]
+            pos = np.searchsorted(docs, cand_docs)
+            hit = pos < len(docs)
+            hit[hit] = docs[pos[hit]] == cand_docs[hit]
+            if remaining[step] + 1e-9 >= theta:
+                # Essential term: unseen docs may still make the top k
+                contrib = self._contrib(tid, np.asarray(self.tfs[start:end]), np.asarray(self.doc_len[docs])) * mult
+                cand_scores[hit] += contrib[pos[hit]]
+                fresh = np.ones(len(docs), dtype=bool)
+                fresh[pos[hit]] = False
+                if allowed is not None:
+                    fresh &= allowed[docs]
+                fresh &= contrib + remaining[step + 1] + 1e-9 >= theta
+                cand_docs = np.concatenate([cand_docs, docs[fresh]])
+                cand_scores = np.concatenate([cand_scores, contrib[fresh]])
+            elif hit.any():
+                # Non-essential term: only probe the surviving candidates
+                p = pos[hit] + start
+                cand_scores[hit] += self._contrib(tid, np.asarray(self.tfs[p]), np.asarray(self.doc_len[cand_docs[hit]])) * mult
+            if len(cand_scores) >= k:
+                theta = float(np.partition(cand_scores, -k)[-k])
+                # small slack so summation-order rounding never prunes a tie
+                keep = cand_scores + remaining[step + 1] + 1e-9 >= theta
+                cand_docs, cand_scores = cand_docs[keep], cand_scores[keep]
+
+        # Partial scores are lower bounds and every true top-k doc survives with its complete score;
+        # rescore the leaders (ties at the cut included) in query-term order so values match
+        # sparse_scores exactly, then order them like top_k_many: score desc, then doc id asc
+        if len(cand_scores) > 2 * k:
+            cut = float(np.partition(cand_scores, -2 * k)[-2 * k])
+            cand_docs = cand_docs[cand_scores + 1e-9 >= cut]
+        exact = self.score_docs(query_tokens, cand_docs.tolist())
+        final = np.lexsort((cand_docs, -exact))[:k]
+        return cand_docs[final].tolist(), exact[final].tolist()
+
+
+class BM25Builder:
+    """Accumulates postings one document at a time as compact int32 arrays (no token lists kept)."""
+
+    def __init__(self):
+        # Term ids in first-appearance order, which is the order BM25Okapi sums idf in
+        self.term_ids: Dict[str, int] = {}
+        self.df = array("i")
+        self.post_terms = array("i")
+        self.post_docs = array("i")
+        self.post_tfs = array("i")
+        self.doc_len = array("i")
+        self.num_tokens = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    def add(self, tokens: List[str]) -> None:
+        d = len(self.doc_len)
+        self.doc_len.append(len(tokens))
+        self.num_tokens += len(tokens)
+        for term, tf in Counter(tokens).items():
+            tid = self.term_ids.get(term)
+            if tid is None:
+                tid = self.term_ids[term] = len(self.df)
+                self.df.append(0)
+            self.df[tid] += 1
+            self.post_terms.append(tid)
+            self.post_docs.append(d)
+            self.post_tfs.append(tf)
+
+    def build(self, k1: float = BM25_K1, b: float = BM25_B, epsilon: float = BM25_EPSILON) -> InvertedBM25:
+        n_docs = len(self.doc_len)
+        idf_first = np.zeros(len(self.df), dtype=np.float64)
+        idf_sum = 0.0
+        negative = []
+        for tid, freq in enumerate(self.df):
+            val = math.log(n_docs - freq + 0.5) - math.log(freq + 0.5)
+            idf_first[tid] = val
+            idf_sum += val
+            if val < 0:
+                negative.append(tid)
+        average_idf = idf_sum / len(self.df) if self.df else 0.0
+        if negative:
+            idf_first[negative] = epsilon * average_idf
+
+        # Persisted vocabulary is sorted; remap first-appearance ids onto it
+        terms_first = list(self.term_ids)
+        order = sorted(range(len(terms_first)), key=terms_first.__getitem__)
+        remap = np.empty(len(order), dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+        terms = [terms_first[i] for i in order]
+        idf = idf_first[order] if order else idf_first
+
+        pt = remap[np.frombuffer(self.post_terms, dtype=np.int32)] if len(self.post_terms) else np.zeros(0, dtype=np.int32)
+        pd = np.frombuffer(self.post_docs, dtype=np.int32)
+        ptf = np.frombuffer(self.post_tfs, dtype=np.int32)
+        perm = np.lexsort((pd, pt))
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(pt, minlength=len(terms)))
+
+        params = {
+            "k1": k1,
+            "b": b,
+            "epsilon": epsilon,
+            "avgdl": (self.num_tokens / n_docs) if n_docs else 0.0,
+            "n_docs": n_docs,
+        }
+        doc_len = np.frombuffer(self.doc_len, dtype=np.int32).copy() if n_docs else np.zeros(0, dtype=np.int32)
+        return InvertedBM25(terms, offsets, pd[perm].copy(), ptf[perm].copy(), doc_len, idf, params)
+
+
+def has_inverted_index(bm25_dir: Path) -> bool:
+    return (bm25_dir / "params.json").exists() and (bm25_dir / "postings_docs.npy").exists()
+
+
+def load_bm25(bm25_dir: Path) -> InvertedBM25:
+    if has_inverted_index(bm25_dir):
+        return InvertedBM25.load(bm25_dir)
+    # Index built before the inverted layout existed: derive it from the corpus in memory
+    from .utils import tokenize
+
+    corpus = read_json(bm25_dir / "corpus.json")
+    return InvertedBM25.from_tokenized([tokenize(doc) for doc in corpus["documents"]])
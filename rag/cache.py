@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+import numpy as np
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+class LRUCache:
+    """Thread-safe bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def resize(self, maxsize: int) -> None:
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._data) > max(maxsize, 0):
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class AnswerCache:
+    """TTL + LRU cache of chat answers, keyed by (normalized query, context) with optional near-duplicate hits.
+
+    Every lookup passes the current index signature; a different signature drops all entries, so answers
+    never outlive the index they were generated from. With similarity_threshold > 0, a miss on the exact
+    key falls back to the entry with the same context whose query embedding has the highest cosine
+    similarity, if it reaches the threshold.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600.0, similarity_threshold: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        # key -> (expires_at, query embedding or None, result)
+        self._data: "OrderedDict[Tuple[str, Hashable], Tuple[float, Optional[np.ndarray], Dict[str, Any]]]" = OrderedDict()
+        self._signature: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    @staticmethod
+    def key(query: str, context: Hashable) -> Tuple[str, Hashable]:
+        return normalize_query(query), context
+
+    def _check_signature(self, signature: Hashable) -> None:
+        if signature != self._signature:
+            self._data.clear()
+            self._signature = signature
+
+    def lookup(
+        self,
+        key: Tuple[str, Hashable],
+        signature: Hashable,
+        embed_query: Optional[Callable[[], np.ndarray]] = None,
+    ) -> Optional[Tuple[Dict[str, Any], Optional[float]]]:
+        # (result copy, None) on an exact hit, (result copy, cosine) on a near-duplicate hit. embed_query is
+        # only called after an exact miss; embeddings are L2-normalized, so cosine is a dot product.
+        with self._lock:
+            self._check_signature(signature)
+            now = time.monotonic()
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(entry[2]), None
+            if entry is not None:
+                del self._data[key]
+            candidates = [(k, e[1]) for k, e in self._data.items() if k[1] == key[1] and e[1] is not None and e[0] > now]
+        if self.similarity_threshold > 0 and embed_query is not None and candidates:
+            query_emb = embed_query()
+            sims = np.stack([emb for _, emb in candidates]) @ query_emb
+            best = int(np.argmax(sims))
+            if sims[best] >= self.similarity_threshold:
+                with self._lock:
+                    entry = self._data.get(candidates[best][0])
+                    if entry is not None:
+                        self._data.move_to_end(candidates[best][0])
+                        self.similar_hits += 1
+                        return copy.deepcopy(entry[2]), float(sims[best])
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Tuple[str, Hashable], signature: Hashable, result: Dict[str, Any], query_emb: Optional[np.ndarray] = None) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._check_signature(signature)
+            self._data[key] = (time.monotonic() + self.ttl, query_emb, copy.deepcopy(result))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._data), "hits": self.hits, "similar_hits": self.similar_hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return len(self._data)
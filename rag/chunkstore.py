@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+from collections.abc import Sequence
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+import numpy as np
+import orjson
+
+from .types import Chunk
+from .utils import read_json, read_jsonl, write_json
+from .vectors import NpyAppender
+
+# Columnar chunk table under meta/, next to chunks.jsonl (which stays the audit copy):
+#   chunks.content.bin      UTF-8 content of every chunk, concatenated
+#   chunks.offsets.npy      int64 (n + 1) byte offsets into chunks.content.bin
+#   chunks.doc.npy          int32 row into chunks.docs.json (source id, uri, type, extra; interned per document)
+#   chunks.chunk_index.npy  int32 position of the chunk within its document
+#   chunks.chunk_id.npy     uint8 (n, 32) SHA-256 digests; chunk_id and checksum are their hex form
+#   chunks.checksum.npy     uint8 (n, 32)
+#   chunks.created_at.npy   int64 microseconds since the epoch (naive UTC, as written by Chunk)
+CHUNK_STORE_FILES = (
+    "chunks.content.bin",
+    "chunks.offsets.npy",
+    "chunks.doc.npy",
+    "chunks.chunk_index.npy",
+    "chunks.chunk_id.npy",
+    "chunks.checksum.npy",
+    "chunks.created_at.npy",
+    "chunks.docs.json",
+)
+
+_EPOCH = datetime(1970, 1, 1)
+# Rows buffered by ChunkStoreWriter before they are appended to the column files
+_FLUSH_ROWS = 4096
+
+
+def _to_micros(iso: str) -> int:
+    delta = datetime.fromisoformat(iso) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+class ChunkStoreWriter:
+    """Appends chunks to the columnar store as they are produced (flat memory; documents are interned)."""
+
+    def __init__(self, meta_dir: Path):
+        self.meta_dir = meta_dir
+        meta_dir.mkdir(parents=True, exist_ok=True)
+        self._content = (meta_dir / "chunks.content.bin").open("wb")
+        self._columns = {
+            "offsets": NpyAppender(meta_dir / "chunks.offsets.npy", np.int64),
+            "doc": NpyAppender(meta_dir / "chunks.doc.npy", np.int32),
+            "chunk_index": NpyAppender(meta_dir / "chunks.chunk_index.npy", np.int32),
+            "chunk_id": NpyAppender(meta_dir / "chunks.chunk_id.npy", np.uint8),
+            "checksum": NpyAppender(meta_dir / "chunks.checksum.npy", np.uint8),
+            "created_at": NpyAppender(meta_dir / "chunks.created_at.npy", np.int64),
+        }
+        self._columns["offsets"].append(np.zeros(1, dtype=np.int64))
+        self._offset = 0
+        self._doc_ids: Dict[bytes, int] = {}
+        self._docs: List[List] = []
+        self._buffer: Dict[str, List] = {name: [] for name in self._columns}
+
+    def add(self, chunk: Chunk) -> None:
+        doc = [chunk.document_source_id, chunk.document_uri, chunk.document_type, chunk.extra]
+        key = orjson.dumps(doc, option=orjson.OPT_SORT_KEYS)
+        doc_id = self._doc_ids.get(key)
+        if doc_id is None:
+            doc_id = self._doc_ids[key] = len(self._docs)
+            self._docs.append(doc)
+        data = chunk.content.encode("utf-8")
+        self._content.write(data)
+        self._offset += len(data)
+        buf = self._buffer
+        buf["offsets"].append(self._offset)
+        buf["doc"].append(doc_id)
+        buf["chunk_index"].append(chunk.chunk_index)
+        buf["chunk_id"].append(bytes.fromhex(chunk.chunk_id))
+        buf["checksum"].append(bytes.fromhex(chunk.checksum))
+        buf["created_at"].append(_to_micros(chunk.created_at))
+        if len(buf["doc"]) >= _FLUSH_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        for name, rows in self._buffer.items():
+            if not rows:
+                continue
+            if name in ("chunk_id", "checksum"):
+                block = np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(-1, 32)
+            else:
+                block = np.asarray(rows)
+            self._columns[name].append(block)
+            rows.clear()
+
+    def close(self) -> None:
+        self._flush()
+        self._content.close()
+        for name, col in self._columns.items():
+            if col.row_shape is None and name in ("chunk_id", "checksum"):
+                col.row_shape = (32,)
+            col.close()
+        write_json(self.meta_dir / "chunks.docs.json", {"documents": self._docs})
+
+
+class ChunkStore(Sequence):
+    """Memory-mapped columnar chunks; content is decoded only for the rows that are accessed."""
+
+    def __init__(self, meta_dir: Path):
+        blob_path = meta_dir / "chunks.content.bin"
+        # np.memmap cannot map an empty file
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if blob_path.stat().st_size else np.zeros(0, dtype=np.uint8)
+        self.offsets = np.load(meta_dir / "chunks.offsets.npy", mmap_mode="r")
+        self.doc = np.load(meta_dir / "chunks.doc.npy", mmap_mode="r")
+        self.chunk_index = np.load(meta_dir / "chunks.chunk_index.npy", mmap_mode="r")
+        self.chunk_id_digests = np.load(meta_dir / "chunks.chunk_id.npy", mmap_mode="r")
+        self.checksum_digests = np.load(meta_dir / "chunks.checksum.npy", mmap_mode="r")
+        self.created_at_us = np.load(meta_dir / "chunks.created_at.npy", mmap_mode="r")
+        self.documents: List[Tuple[str, str, str, Dict[str, str]]] = [tuple(d) for d in read_json(meta_dir / "chunks.docs.json")["documents"]]
+
+    def __len__(self) -> int:
+        return int(self.doc.shape[0])
+
+    def content_at(self, i: int) -> str:
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].tobytes().decode("utf-8")
+
+    def chunk_id_at(self, i: int) -> str:
+        return self.chunk_id_digests[i].tobytes().hex()
+
+    def chunk_ids(self) -> List[str]:
+        return [self.chunk_id_at(i) for i in range(len(self))]
+
+    def _chunk(self, i: int) -> Chunk:
+        source_id, uri, doc_type, extra = self.documents[int(self.doc[i])]
+        return Chunk(
+            chunk_id=self.chunk_id_at(i),
+            document_source_id=source_id,
+            document_uri=uri,
+            document_type=doc_type,
+            content=self.content_at(i),
+            chunk_index=int(self.chunk_index[i]),
+            checksum=self.checksum_digests[i].tobytes().hex(),
+            created_at=(_EPOCH + timedelta(microseconds=int(self.created_at_us[i]))).isoformat(),
+            extra=dict(extra),
+        )
+
+    def __getitem__(self, i: Union[int, slice]) -> Union[Chunk, List[Chunk]]:
+        if isinstance(i, slice):
+            return [self._chunk(j) for j in range(*i.indices(len(self)))]
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("chunk index out of range")
+        return self._chunk(i)
+
+    def __iter__(self) -> Iterator[Chunk]:
+        for i in range(len(self)):
+            yield self._chunk(i)
+
+
+def has_chunk_store(meta_dir: Path) -> bool:
+    return all((meta_dir / name).exists() for name in CHUNK_STORE_FILES)
+
+
+def load_chunks(meta_dir: Path) -> Sequence[Chunk]:
+    if has_chunk_store(meta_dir):
+        return ChunkStore(meta_dir)
+    # Index built before the columnar store existed: parse chunks.jsonl into memory
+    return [Chunk(**row) for row in read_jsonl(meta_dir / "chunks.jsonl")]
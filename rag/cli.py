@@ -1,20 +1,60 @@
 from __future__ import annotations
 
+import os
+import sys
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Optional, List
+from typing import Dict, Iterator, Optional, List
 
 import typer
 from rich.console import Console
 from rich.table import Table
 
 from .config import RAGConfig
-from .index import build_index
-from .retrieve import retrieve
+from .fusion import parse_weights
+from .types import ScoredChunk
 
 app = typer.Typer(add_completion=False)
 console = Console()
 
 
+def result_payload(r: ScoredChunk) -> Dict:
+    from dataclasses import asdict
+
+    return {
+        "fused_score": r.fused_score,
+        "fused_rank": r.fused_rank,
+        "signals": asdict(r.signals),
+        "chunk": asdict(r.chunk),
+        "provenance": {
+            "source_type": r.chunk.document_type,
+            "uri": r.chunk.document_uri,
+            "title": r.chunk.extra.get("source_title", ""),
+            "chunk_index": r.chunk.chunk_index,
+            "chunk_checksum": r.chunk.checksum,
+        },
+        "snippet": r.chunk.content[:280],
+    }
+
+
+@contextmanager
+def profiling(enabled: bool, mode: str, out_dir: Path, label: str, all_threads: bool = False) -> Iterator[None]:
+    # --profile: run the block under rag.profiling and report the written files on stderr (stdout may be JSON)
+    if not enabled:
+        yield
+        return
+    from .profiling import profile_name, profiled
+
+    with profiled(out_dir, profile_name(label), mode, all_threads=all_threads) as paths:
+        yield
+    typer.echo("profile " + ", ".join(f"{k}: {v}" for k, v in paths.items()), err=True)
+
+
+PROFILE_HELP = "Profile this command (sampling: collapsed stacks for flame graphs; cprofile: .prof) and write a top-N summary"
+FILTER_HELP = 'Only retrieve chunks matching this metadata filter, e.g. \'document_type = url and uri ^= "https://docs."\''
+FUSION_HELP = "How BM25 and vector results are combined: rrf, weighted_rrf, combsum or combmnz"
+
+
 @app.command(name="build-index")
 def build_index_cmd(
     index_dir: Path = typer.Option(..., exists=False, dir_okay=True, file_okay=False, writable=True),
@@ -23,7 +63,22 @@ def build_index_cmd(
     model: str = typer.Option("sentence-transformers/all-MiniLM-L6-v2", help="Embedding model"),
     max_chunk_words: int = typer.Option(200),
     chunk_overlap_words: int = typer.Option(40),
+    embedding_storage: str = typer.Option("float32", help="Also store embeddings as float16 or int8 (per-row scales) and score from that copy"),
+    vector_index: str = typer.Option("flat", help="Also build an approximate vector index: flat (none) or ivf"),
+    ivf_lists: int = typer.Option(0, help="IVF lists (0 = ~4*sqrt(num_chunks))"),
+    update: bool = typer.Option(False, "--update", help="Incremental build: reuse unchanged documents and embeddings from the existing index"),
+    fetch_workers: int = typer.Option(8, help="Concurrent URL fetches"),
+    fetch_per_host: int = typer.Option(2, help="Concurrent URL fetches per host"),
+    fetch_timeout: float = typer.Option(20.0, help="Read timeout per URL (seconds)"),
+    embed_batch_size: int = typer.Option(256, help="Chunks per embedding batch while building"),
+    workers: int = typer.Option(1, min=0, help="Processes hashing/reading/chunking files (0 = one per CPU)"),
+    embed_workers: int = typer.Option(1, min=0, help="Processes encoding chunks, each with its own model copy (0 = one per CPU)"),
+    profile: bool = typer.Option(False, "--profile", help=PROFILE_HELP),
+    profile_mode: str = typer.Option("sampling", help="sampling (all build threads) or cprofile (main thread)"),
+    profile_dir: Path = typer.Option(Path("profiles"), file_okay=False, help="Where --profile writes its files"),
 ):
+    from .index import build_index
+
     urls: List[str] = []
     if urls_file and urls_file.exists():
         urls = [line.strip() for line in urls_file.read_text().splitlines() if line.strip()]
@@ -33,10 +88,155 @@ def build_index_cmd(
         embedding_model_name=model,
         max_chunk_words=max_chunk_words,
         chunk_overlap_words=chunk_overlap_words,
+        embedding_storage=embedding_storage,
+        vector_index=vector_index,
+        ivf_lists=ivf_lists,
+        fetch_workers=fetch_workers,
+        fetch_per_host=fetch_per_host,
+        fetch_timeout=fetch_timeout,
+        embed_batch_size=embed_batch_size,
+        ingest_workers=workers or os.cpu_count() or 1,
+        embed_workers=embed_workers or os.cpu_count() or 1,
     )
 
-    build_index(cfg, input_path, urls)
+    with profiling(profile, profile_mode, profile_dir, "build-index", all_threads=True):
+        stats = build_index(cfg, input_path, urls, update=update)
     console.print(f"[green]Index built at[/green] {index_dir}")
+    if update:
+        console.print(
+            f"documents: {stats['documents_unchanged']} unchanged, {stats['documents_changed']} changed, "
+            f"{stats['documents_added']} added, {stats['documents_deleted']} deleted; "
+            f"chunks: {stats['chunks_embedded']} embedded, {stats['chunks_reused']} reused"
+        )
+    if stats["chunks_embedded"]:
+        console.print(
+            f"embedded {stats['chunks_embedded']} chunks in {stats['embed_seconds']:.1f}s "
+            f"({stats['embed_texts_per_sec']:.1f} texts/sec, {cfg.embed_workers} worker(s))"
+        )
+    if stats["urls_failed"]:
+        console.print(f"[yellow]{stats['urls_failed']} URL(s) could not be fetched[/yellow]")
+
+
+@app.command(name="prepare-index")
+def prepare_index_cmd(
+    index_dir: Path = typer.Option(..., exists=True, file_okay=False, dir_okay=True, readable=True),
+    warm: bool = typer.Option(True, help="Read the artifacts into the page cache"),
+):
+    from .serving import prepare_index, warm_page_cache
+
+    written = prepare_index(index_dir)
+    for name in written:
+        console.print(f"[green]Wrote[/green] {name}")
+    if not written:
+        console.print("Index already has every memory-mapped artifact")
+    if warm:
+        stats = warm_page_cache(index_dir)
+        console.print(f"Paged in {stats['files']} files ({stats['bytes'] / 2**20:.1f} MB)")
+
+
+@app.command(name="startup-report")
+def startup_report_cmd(
+    index_dir: Path = typer.Option(..., exists=True, file_okay=False, dir_okay=True, readable=True),
+    query: str = typer.Option("warm up", help="Query used for the first/second query timings"),
+    json: bool = typer.Option(False, "--json", help="Emit JSON instead of a table"),
+):
+    from .startup import measure_startup
+
+    steps = measure_startup(RAGConfig(index_dir=index_dir), query)
+
+    if json:
+        import orjson
+
+        console.print(orjson.dumps({"steps": steps}, option=orjson.OPT_INDENT_2).decode("utf-8"))
+        return
+
+    table = Table(show_header=True, header_style="bold magenta", title="startup cost")
+    table.add_column("Step")
+    table.add_column("Seconds", justify="right")
+    for step in steps:
+        table.add_row(step["step"], f"{step['seconds']:.3f}")
+    console.print(table)
+
+
+@app.command(name="bench-ingest")
+def bench_ingest_cmd(
+    input_path: List[Path] = typer.Option(..., help="Files or directories to ingest"),
+    workers: str = typer.Option("1,2,4,8", help="Comma-separated worker counts to time"),
+    max_chunk_words: int = typer.Option(200),
+    chunk_overlap_words: int = typer.Option(40),
+    json: bool = typer.Option(False, "--json", help="Emit JSON instead of a table"),
+):
+    from .ingest import bench_ingest
+
+    # Nothing is written; index_dir is unused
+    cfg = RAGConfig(index_dir=Path("."), max_chunk_words=max_chunk_words, chunk_overlap_words=chunk_overlap_words)
+    worker_counts = [int(w) for w in workers.split(",") if w.strip()]
+    results = bench_ingest(input_path, cfg, worker_counts)
+
+    if json:
+        import orjson
+
+        console.print(orjson.dumps({"cpu_count": os.cpu_count(), "results": results}, option=orjson.OPT_INDENT_2).decode("utf-8"))
+        return
+
+    table = Table(show_header=True, header_style="bold magenta", title=f"ingest scaling ({os.cpu_count()} CPUs)")
+    for col in ("Workers", "Seconds", "Docs/s", "Chunks/s", "MB/s", "Speedup"):
+        table.add_column(col, justify="right")
+    for r in results:
+        table.add_row(
+            str(r["workers"]),
+            f"{r['seconds']:.2f}",
+            f"{r['docs_per_sec']:.0f}",
+            f"{r['chunks_per_sec']:.0f}",
+            f"{r['mb_per_sec']:.1f}",
+            f"{r['speedup']:.2f}x",
+        )
+    console.print(table)
+
+
+@app.command(name="bench")
+def bench_cmd(
+    sizes: str = typer.Option("1000,10000", help="Comma-separated synthetic corpus sizes in chunks (e.g. 1000,100000,1000000)"),
+    queries: int = typer.Option(200, min=1, help="Timed queries per stage"),
+    model: str = typer.Option("hashing:384", help="Embedding model: hashing:<dim> (model-free) or a sentence-transformers name"),
+    max_chunk_words: int = typer.Option(100, help="Words per synthetic chunk"),
+    embedding_storage: str = typer.Option("float32", help="float32, float16 or int8"),
+    vector_index: str = typer.Option("flat", help="flat or ivf"),
+    bm25_search: str = typer.Option("exhaustive", help="exhaustive or maxscore"),
+    seed: int = typer.Option(0),
+    chatbot: bool = typer.Option(True, "--chatbot/--no-chatbot", help="Also time WorkingRAGChatBot with a stubbed LLM"),
+    work_dir: Optional[Path] = typer.Option(None, file_okay=False, help="Keep corpora and indexes here (default: temp dir, removed)"),
+    output: Optional[Path] = typer.Option(None, dir_okay=False, help="Write the JSON report to this file"),
+    baseline: Optional[Path] = typer.Option(None, exists=True, dir_okay=False, help="Earlier report to compare against; exits 1 on regressions"),
+    tolerance: float = typer.Option(0.2, help="Relative slowdown tolerated before a metric counts as a regression"),
+):
+    import orjson
+
+    from .bench import compare_reports, run_bench
+
+    cfg = RAGConfig(
+        index_dir=Path("."),
+        embedding_model_name=model,
+        max_chunk_words=max_chunk_words,
+        chunk_overlap_words=0,
+        embedding_storage=embedding_storage,
+        vector_index=vector_index,
+        bm25_search=bm25_search,
+    )
+    report = run_bench([int(n) for n in sizes.split(",") if n.strip()], cfg, queries, seed, work_dir, chatbot)
+    payload = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if output:
+        output.write_bytes(payload + b"\n")
+    else:
+        sys.stdout.write(payload.decode("utf-8") + "\n")
+
+    if baseline:
+        regressions = compare_reports(orjson.loads(baseline.read_bytes()), report, tolerance)
+        err = Console(stderr=True)
+        for r in regressions:
+            err.print(f"[red]regression[/red] {r['chunks']} chunks {r['metric']}: {r['baseline']} -> {r['current']} ({r['change']:+.0%})")
+        if regressions:
+            raise typer.Exit(code=1)
 
 
 @app.command()
@@ -47,71 +247,149 @@ def query(
     k_vector: int = typer.Option(8),
     k_fused: int = typer.Option(8),
     rrf_k: int = typer.Option(60),
+    fusion_method: str = typer.Option("rrf", help=FUSION_HELP),
+    fusion_weights: str = typer.Option("1,1", help="bm25,vector weights for weighted_rrf, combsum and combmnz"),
+    fusion_norm: str = typer.Option("minmax", help="Score normalization for combsum/combmnz: minmax or zscore"),
+    bm25_search: str = typer.Option("exhaustive", help="BM25 top-k strategy: exhaustive or maxscore"),
+    vector_rescore_k: int = typer.Option(0, help="Rescore this many quantized vector candidates exactly in float32"),
+    vector_index: str = typer.Option("flat", help="Vector search: flat (exact) or ivf (approximate, if built)"),
+    ivf_nprobe: int = typer.Option(8, help="IVF lists scanned per query"),
+    filter_expr: Optional[str] = typer.Option(None, "--filter", help=FILTER_HELP),
     json: bool = typer.Option(False, "--json", help="Emit JSON instead of pretty table"),
     pretty: bool = typer.Option(False, "--pretty", help="Pretty table output"),
+    profile: bool = typer.Option(False, "--profile", help=PROFILE_HELP),
+    profile_mode: str = typer.Option("sampling", help="sampling or cprofile"),
+    profile_dir: Path = typer.Option(Path("profiles"), file_okay=False, help="Where --profile writes its files"),
 ):
+    from .retrieve import retrieve
+
     cfg = RAGConfig(
         index_dir=index_dir,
         k_bm25=k_bm25,
         k_vector=k_vector,
         k_fused=k_fused,
         rrf_k=rrf_k,
+        fusion_method=fusion_method,
+        fusion_weights=parse_weights(fusion_weights),
+        fusion_norm=fusion_norm,
+        bm25_search=bm25_search,
+        vector_rescore_k=vector_rescore_k,
+        vector_index=vector_index,
+        ivf_nprobe=ivf_nprobe,
     )
 
-    results = retrieve(cfg, query)
+    # Profiled: retrieval plus output (JSON serialization / table rendering)
+    with profiling(profile, profile_mode, profile_dir, "query"):
+        results = retrieve(cfg, query, filter_expr=filter_expr)
 
-    if json:
-        import orjson
-        from dataclasses import asdict
+        if json:
+            import orjson
+
+            payload = [result_payload(r) for r in results]
+            console.print(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode("utf-8"))
+            return
+
+        table = Table(show_header=True, header_style="bold magenta")
+        table.add_column("Rank", justify="right")
+        table.add_column("Fused")
+        table.add_column("BM25 (rank)")
+        table.add_column("Vector (rank)")
+        table.add_column("Source")
+        table.add_column("Snippet")
 
-        payload = []
         for r in results:
-            payload.append(
-                {
-                    "fused_score": r.fused_score,
-                    "fused_rank": r.fused_rank,
-                    "signals": asdict(r.signals),
-                    "chunk": asdict(r.chunk),
-                    "provenance": {
-                        "source_type": r.chunk.document_type,
-                        "uri": r.chunk.document_uri,
-                        "title": r.chunk.extra.get("source_title", ""),
-                        "chunk_index": r.chunk.chunk_index,
-                        "chunk_checksum": r.chunk.checksum,
-                    },
-                    "snippet": r.chunk.content[:280],
-                }
+            source = f"{r.chunk.document_type}: {r.chunk.document_uri} [#{r.chunk.chunk_index}]"
+            bm25 = "-"
+            if r.signals.bm25_score is not None:
+                bm25 = f"{r.signals.bm25_score:.4f} ({r.signals.bm25_rank})"
+            vec = "-"
+            if r.signals.vector_score is not None:
+                vec = f"{r.signals.vector_score:.4f} ({r.signals.vector_rank})"
+
+            table.add_row(
+                str(r.fused_rank),
+                f"{r.fused_score:.4f}",
+                bm25,
+                vec,
+                source,
+                (r.chunk.content[:160] + ("…" if len(r.chunk.content) > 160 else "")),
             )
-        console.print(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode("utf-8"))
-        return
 
-    table = Table(show_header=True, header_style="bold magenta")
-    table.add_column("Rank", justify="right")
-    table.add_column("Fused")
-    table.add_column("BM25 (rank)")
-    table.add_column("Vector (rank)")
-    table.add_column("Source")
-    table.add_column("Snippet")
+        console.print(table)
 
-    for r in results:
-        source = f"{r.chunk.document_type}: {r.chunk.document_uri} [#{r.chunk.chunk_index}]"
-        bm25 = "-"
-        if r.signals.bm25_score is not None:
-            bm25 = f"{r.signals.bm25_score:.4f} ({r.signals.bm25_rank})"
-        vec = "-"
-        if r.signals.vector_score is not None:
-            vec = f"{r.signals.vector_score:.4f} ({r.signals.vector_rank})"
 
-        table.add_row(
-            str(r.fused_rank),
-            f"{r.fused_score:.4f}",
-            bm25,
-            vec,
-            source,
-            (r.chunk.content[:160] + ("…" if len(r.chunk.content) > 160 else "")),
-        )
+@app.command(name="query-batch")
+def query_batch(
+    queries_file: Path = typer.Argument(..., exists=True, dir_okay=False, readable=True, help="JSONL with one {\"query\": ...} per line (optional \"id\")"),
+    index_dir: Path = typer.Option(..., exists=True, file_okay=False, dir_okay=True, readable=True),
+    output: Optional[Path] = typer.Option(None, help="Write JSONL results here instead of stdout"),
+    batch_size: int = typer.Option(256, min=1, help="Queries embedded and scored per retrieve_many call"),
+    k_bm25: int = typer.Option(8),
+    k_vector: int = typer.Option(8),
+    k_fused: int = typer.Option(8),
+    rrf_k: int = typer.Option(60),
+    fusion_method: str = typer.Option("rrf", help=FUSION_HELP),
+    fusion_weights: str = typer.Option("1,1", help="bm25,vector weights for weighted_rrf, combsum and combmnz"),
+    fusion_norm: str = typer.Option("minmax", help="Score normalization for combsum/combmnz: minmax or zscore"),
+    bm25_search: str = typer.Option("exhaustive", help="BM25 top-k strategy: exhaustive or maxscore"),
+    vector_rescore_k: int = typer.Option(0, help="Rescore this many quantized vector candidates exactly in float32"),
+    vector_index: str = typer.Option("flat", help="Vector search: flat (exact) or ivf (approximate, if built)"),
+    ivf_nprobe: int = typer.Option(8, help="IVF lists scanned per query"),
+    filter_expr: Optional[str] = typer.Option(None, "--filter", help=FILTER_HELP),
+):
+    import orjson
 
-    console.print(table)
+    from .retrieve import retrieve_many
+
+    cfg = RAGConfig(
+        index_dir=index_dir,
+        k_bm25=k_bm25,
+        k_vector=k_vector,
+        k_fused=k_fused,
+        rrf_k=rrf_k,
+        fusion_method=fusion_method,
+        fusion_weights=parse_weights(fusion_weights),
+        fusion_norm=fusion_norm,
+        bm25_search=bm25_search,
+        vector_rescore_k=vector_rescore_k,
+        vector_index=vector_index,
+        ivf_nprobe=ivf_nprobe,
+    )
+
+    out = output.open("wb") if output else sys.stdout.buffer
+    written = 0
+
+    def flush(batch: List[Dict]) -> None:
+        nonlocal written
+        results = retrieve_many(cfg, [str(row.get("query", "")) for row in batch], filter_expr=filter_expr)
+        for row, hits in zip(batch, results):
+            out.write(orjson.dumps({
+                "id": row.get("id", written),
+                "query": row.get("query", ""),
+                "results": [result_payload(r) for r in hits],
+            }))
+            out.write(b"\n")
+            written += 1
+        out.flush()
+
+    try:
+        batch: List[Dict] = []
+        with queries_file.open("rb") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = orjson.loads(line)
+                batch.append(row if isinstance(row, dict) else {"query": row})
+                if len(batch) >= batch_size:
+                    flush(batch)
+                    batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if output:
+            out.close()
+    if output:
+        console.print(f"[green]Wrote {written} results to[/green] {output}")
 
 
 if __name__ == "__main__":
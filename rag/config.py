@@ -9,9 +9,24 @@ class RAGConfig:
     max_chunk_words: int = 200
     chunk_overlap_words: int = 40
     allowed_file_extensions: tuple = (".txt", ".md")
+    embedding_storage: str = "float32"  # extra copy to score from: "float32" (none), "float16" or "int8"
+    vector_index: str = "flat"  # "flat" (brute force) or "ivf" (approximate; built by build_index, used at query time)
+    ivf_lists: int = 0  # number of IVF lists at build time; 0 = ~4*sqrt(num_chunks)
+    fetch_workers: int = 8  # concurrent URL fetches
+    fetch_per_host: int = 2  # concurrent URL fetches per host
+    fetch_timeout: float = 20.0  # read timeout per URL, seconds
+    embed_batch_size: int = 256  # chunks per encoder call during build_index
+    ingest_workers: int = 1  # processes hashing/reading/chunking files during build_index (1 = in-process)
+    embed_workers: int = 1  # model worker processes encoding chunks during build_index (1 = in-process)
 
     # Retrieval settings
     k_bm25: int = 8
     k_vector: int = 8
     k_fused: int = 8
-    rrf_k: int = 60  # RRF constant to smooth reciprocal ranks 
\ No newline at end of file
+    rrf_k: int = 60  # RRF constant to smooth reciprocal ranks
+    fusion_method: str = "rrf"  # "rrf", "weighted_rrf", "combsum" or "combmnz" (see rag.fusion)
+    fusion_weights: tuple = (1.0, 1.0)  # (bm25, vector) weights for weighted_rrf, combsum and combmnz
+    fusion_norm: str = "minmax"  # per-query score normalization for combsum/combmnz: "minmax" or "zscore"
+    bm25_search: str = "exhaustive"  # "exhaustive" or "maxscore" (dynamic pruning, same top-k)
+    vector_rescore_k: int = 0  # >k_vector: rescore this many quantized candidates exactly in float32
+    ivf_nprobe: int = 8  # IVF lists scanned per query; higher = better recall, more latency 
\ No newline at end of file
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import math
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Packs retrieved chunks into the LLM prompt under a token budget, in rank order:
+#
+#   - tokens are counted with the target model's tokenizer (tiktoken, in requirements.txt); if it is missing
+#     or its encoding cannot be loaded (offline), they are estimated at CHARS_PER_TOKEN characters per token
+#   - text already in the prompt is dropped: any run of SHINGLE_WORDS or more words that an earlier
+#     (higher-ranked) block contains. This removes the chunk_overlap_words shared by adjacent chunks of
+#     one document and boilerplate repeated across pages (navigation, footers); a chunk with fewer than
+#     SHINGLE_WORDS new words is skipped, and dropped interior runs leave a "…". Only packed blocks count
+#     as seen: text of a skipped chunk is still kept when a later chunk repeats it
+#   - blocks are added while they fit; the first one that does not is cut to the remaining budget
+#     (if at least MIN_TRUNCATED_TOKENS are left) and packing stops there
+#
+# Each block is "[n] <source title> — chunk #<index>" followed by its text; n numbers the packed blocks,
+# so citations [n] refer to PackedContext.used[n - 1].
+
+CONTEXT_TOKEN_BUDGET = 1500
+CHARS_PER_TOKEN = 4
+SHINGLE_WORDS = 8
+MIN_TRUNCATED_TOKENS = 32
+NO_CONTEXT = "No relevant information found."
+ELLIPSIS = "…"
+BLOCK_SEPARATOR = "\n\n"
+
+
+class TokenCounter:
+    """Estimate of CHARS_PER_TOKEN characters per token; the fallback when tiktoken is unavailable."""
+
+    exact = False
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.count(text) <= max_tokens:
+            return text
+        cut = text[: max(max_tokens, 0) * CHARS_PER_TOKEN]
+        # Do not end in the middle of a word
+        return cut.rsplit(" ", 1)[0] if " " in cut else cut
+
+
+class TiktokenCounter(TokenCounter):
+    """Exact token counts for a model's tiktoken encoding."""
+
+    exact = True
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[: max(max_tokens, 0)])
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model: str) -> TokenCounter:
+    # Unknown model names use cl100k_base. tiktoken downloads an encoding on first use, so loading can fail
+    # offline; that (or tiktoken not being installed) falls back to the estimate, with a warning per model.
+    try:
+        import tiktoken
+    except ImportError:
+        print(f"⚠️ tiktoken is not installed; estimating {model} tokens at {CHARS_PER_TOKEN} characters each")
+        return TokenCounter()
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("cl100k_base")
+    except Exception as exc:
+        print(f"⚠️ Could not load the tiktoken encoding for {model} ({exc}); estimating tokens at {CHARS_PER_TOKEN} characters each")
+        return TokenCounter()
+    return TiktokenCounter(encoding)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    used: List[int] = field(default_factory=list)  # positions in the input, one per block, in block order
+    tokens: int = 0
+    truncated: bool = False  # the last block was cut to fit the budget
+
+
+def _shingles(words: Sequence[str]) -> List[tuple]:
+    return [tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+
+
+def _new_text(words: List[str], seen: set) -> Tuple[Optional[str], List[tuple]]:
+    # (words minus every run covered by a shingle in seen, the chunk's shingles); the text is None if fewer
+    # than SHINGLE_WORDS words are new. seen is not updated: only text that reaches the prompt counts as seen.
+    keys = [w.lower() for w in words]
+    shingles = _shingles(keys)
+    covered = [False] * len(words)
+    for i, shingle in enumerate(shingles):
+        if shingle in seen:
+            covered[i:i + SHINGLE_WORDS] = [True] * SHINGLE_WORDS
+    if len(words) - sum(covered) < SHINGLE_WORDS and any(covered):
+        return None, shingles
+    parts: List[str] = []
+    for i, word in enumerate(words):
+        if not covered[i]:
+            parts.append(word)
+        elif i > 0 and not covered[i - 1] and not all(covered[i:]):
+            parts.append(ELLIPSIS)
+    return " ".join(parts), shingles
+
+
+def pack_context(chunks: Sequence[Dict[str, Any]], counter: TokenCounter, budget: int = CONTEXT_TOKEN_BUDGET) -> PackedContext:
+    """Pack chunk dicts (Chunk fields; best first) into prompt context of at most `budget` tokens (<= 0: no limit)."""
+    if not chunks:
+        return PackedContext(NO_CONTEXT)
+    limit = budget if budget > 0 else math.inf
+    sep_tokens = counter.count(BLOCK_SEPARATOR)
+    seen: set = set()
+    blocks: List[str] = []
+    packed = PackedContext("")
+    for pos, chunk in enumerate(chunks):
+        body, shingles = _new_text(chunk["content"].split(), seen)
+        if not body:
+            continue
+        title = (chunk.get("extra") or {}).get("source_title") or "Unknown"
+        header = f"[{len(blocks) + 1}] {title} — chunk #{chunk['chunk_index']}\n"
+        overhead = sep_tokens if blocks else 0
+        cost = counter.count(header + body) + overhead
+        if packed.tokens + cost > limit:
+            room = limit - packed.tokens - overhead - counter.count(header) - counter.count(ELLIPSIS)
+            if room < MIN_TRUNCATED_TOKENS:
+                break
+            full = body
+            # Tokens can merge across the header/body boundary: shrink until the block really fits
+            while True:
+                body = counter.truncate(full, int(room)) + ELLIPSIS
+                cost = counter.count(header + body) + overhead
+                if packed.tokens + cost <= limit or room <= 1:
+                    break
+                room -= packed.tokens + cost - limit
+            packed.truncated = True
+        blocks.append(header + body)
+        seen.update(shingles)
+        packed.used.append(pos)
+        packed.tokens += cost
+        if packed.truncated:
+            break
+    packed.text = BLOCK_SEPARATOR.join(blocks) if blocks else NO_CONTEXT
+    return packed
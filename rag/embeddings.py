@@ -1,17 +1,225 @@
-from typing import List
+from __future__ import annotations
+
+import multiprocessing
+import os
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Deque, List, Optional
 import numpy as np
-from sentence_transformers import SentenceTransformer
+
+from .cache import LRUCache, normalize_query
+from .metrics import REGISTRY
+from .startup import timed_import, timed_step
+from .utils import tokenize
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 _model_cache = {}
 
+# Length-adaptive batching: a batch holds up to TOKEN_BUDGET (estimated) tokens, so short texts are
+# encoded in large batches and long ones in small batches with little padding
+TOKEN_BUDGET = 64 * 256
+MAX_BATCH = 256
+
+# Query embeddings keyed by (model, normalized query); repeated questions skip the encoder
+_query_cache = LRUCache(maxsize=4096)
+
+QUERY_CACHE_LOOKUPS = REGISTRY.counter("rag_query_embedding_cache_lookups_total", "Query embedding cache lookups by result", ("result",))
+QUERY_CACHE_ENTRIES = REGISTRY.gauge("rag_query_embedding_cache_entries", "Query embeddings cached")
+
+
+def _collect_query_cache() -> None:
+    QUERY_CACHE_LOOKUPS.set_total(_query_cache.hits, result="hit")
+    QUERY_CACHE_LOOKUPS.set_total(_query_cache.misses, result="miss")
+    QUERY_CACHE_ENTRIES.set(len(_query_cache))
+
+
+REGISTRY.on_collect(_collect_query_cache)
+
+
+# Model names of the form "hashing:<dim>" select HashingEmbedder instead of a sentence-transformers model
+HASHING_PREFIX = "hashing:"
+
 
-def get_model(model_name: str) -> SentenceTransformer:
+class HashingEmbedder:
+    """Model-free encoder: signed feature hashing of word tokens into `dim` buckets.
+
+    Deterministic and fast, with no torch dependency; vectors only capture word overlap, so it is meant for
+    benchmarks and tests (rag bench), not for answer quality.
+    """
+
+    def __init__(self, dim: int):
+        if dim <= 0:
+            raise ValueError(f"HashingEmbedder dim must be positive, got {dim}")
+        self.dim = dim
+        # token -> (bucket, sign); crc32 keeps buckets stable across processes (unlike hash())
+        self._buckets: dict = {}
+
+    def _bucket(self, token: str) -> tuple:
+        b = self._buckets.get(token)
+        if b is None:
+            h = zlib.crc32(token.encode("utf-8"))
+            b = self._buckets[token] = (h % self.dim, 1.0 if h & 0x80000000 else -1.0)
+        return b
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts: List[str], normalize_embeddings: bool = True, **kwargs) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        rows, cols, signs = [], [], []
+        for i, text in enumerate(texts):
+            for token in tokenize(text):
+                col, sign = self._bucket(token)
+                rows.append(i)
+                cols.append(col)
+                signs.append(sign)
+        if rows:
+            np.add.at(out, (np.asarray(rows), np.asarray(cols)), np.asarray(signs, dtype=np.float32))
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out /= np.where(norms > 0, norms, 1.0)
+        return out
+
+
+def get_model(model_name: str) -> SentenceTransformer | HashingEmbedder:
+    # sentence_transformers (and torch) are imported here, on first model use, not with this module
+    if model_name.startswith(HASHING_PREFIX):
+        if model_name not in _model_cache:
+            _model_cache[model_name] = HashingEmbedder(int(model_name[len(HASHING_PREFIX):]))
+        return _model_cache[model_name]
     if model_name not in _model_cache:
-        _model_cache[model_name] = SentenceTransformer(model_name)
+        st = timed_import("sentence_transformers")
+        with timed_step(f"load model {model_name}"):
+            _model_cache[model_name] = st.SentenceTransformer(model_name)
     return _model_cache[model_name]
 
 
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token; texts past the model's max_seq_length are truncated anyway
+    return min(len(text) // 4 + 2, 512)
+
+
+def length_batches(texts: List[str], token_budget: int = TOKEN_BUDGET, max_batch: int = MAX_BATCH) -> List[np.ndarray]:
+    # Index arrays of texts sorted longest-first, cut so batch_size * longest_in_batch <= token_budget
+    lengths = np.array([estimate_tokens(t) for t in texts], dtype=np.int64)
+    order = np.argsort(-lengths, kind="stable")
+    batches: List[np.ndarray] = []
+    start = 0
+    while start < len(order):
+        size = max(1, min(max_batch, token_budget // int(lengths[order[start]])))
+        batches.append(order[start:start + size])
+        start += size
+    return batches
+
+
+def _encode(model: SentenceTransformer, texts: List[str]) -> np.ndarray:
+    return model.encode(texts, batch_size=max(1, len(texts)), show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True).astype("float32")
+
+
 def embed_texts(texts: List[str], model_name: str) -> np.ndarray:
     model = get_model(model_name)
-    embeddings = model.encode(texts, batch_size=64, show_progress_bar=False, convert_to_numpy=True, normalize_embeddings=True)
-    return embeddings.astype("float32") 
\ No newline at end of file
+    if len(texts) <= 1:
+        return _encode(model, texts)
+    out = None
+    for idx in length_batches(texts):
+        embs = _encode(model, [texts[i] for i in idx])
+        if out is None:
+            out = np.empty((len(texts), embs.shape[1]), dtype=np.float32)
+        out[idx] = embs
+    return out
+
+
+# Worker-process state for ParallelEmbedder: one model per process
+_worker_model: Optional[SentenceTransformer] = None
+
+
+def _init_worker(model_name: str, num_threads: int) -> None:
+    global _worker_model
+    if not model_name.startswith(HASHING_PREFIX):
+        import torch
+
+        # Split the cores between workers instead of every worker using all of them
+        torch.set_num_threads(num_threads)
+    _worker_model = get_model(model_name)
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _encode(_worker_model, texts)
+
+
+class ParallelEmbedder:
+    """Encodes on a pool of worker processes, each holding its own copy of the model (CPU-only builds)."""
+
+    def __init__(self, model_name: str, workers: int, token_budget: int = TOKEN_BUDGET):
+        self.workers = max(1, workers)
+        self.token_budget = token_budget
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(model_name, threads),
+        )
+
+    def submit(self, texts: List[str]) -> Callable[[], np.ndarray]:
+        # Shards length-sorted batches across the workers; the returned callable waits for them and
+        # reassembles the rows in input order
+        shards: Deque[tuple] = deque(
+            (idx, self._pool.submit(_encode_in_worker, [texts[i] for i in idx]))
+            for idx in length_batches(texts, self.token_budget)
+        )
+
+        def result() -> np.ndarray:
+            out = None
+            while shards:
+                idx, fut = shards.popleft()
+                embs = fut.result()
+                if out is None:
+                    out = np.empty((len(texts), embs.shape[1]), dtype=np.float32)
+                out[idx] = embs
+            return out if out is not None else np.zeros((0, 0), dtype=np.float32)
+
+        return result
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts)()
+
+    def close(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
+
+    def __enter__(self) -> "ParallelEmbedder":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def embed_queries(queries: List[str], model_name: str) -> np.ndarray:
+    # Like embed_texts on the normalized queries, but served from the LRU where possible;
+    # all misses are encoded in a single embed_texts call
+    keys = [(model_name, normalize_query(q)) for q in queries]
+    out: List[np.ndarray] = [_query_cache.get(k) for k in keys]
+    missing = sorted({k[1] for k, v in zip(keys, out) if v is None})
+    if missing:
+        fresh = dict(zip(missing, embed_texts(missing, model_name)))
+        for i, k in enumerate(keys):
+            if out[i] is None:
+                out[i] = fresh[k[1]]
+                _query_cache.put(k, fresh[k[1]])
+    if not out:
+        return np.zeros((0, 0), dtype="float32")
+    return np.vstack(out)
+
+
+def set_query_cache_size(maxsize: int) -> None:
+    _query_cache.resize(maxsize)
+
+
+def warm_up(model_name: str) -> None:
+    # Load the model and run one encode so the first real query pays neither cost
+    get_model(model_name)
+    with timed_step("warm-up encode"):
+        embed_texts(["warm up"], model_name)
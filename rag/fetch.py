@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterable, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+from .types import Document
+
+
+@dataclass
+class FetchResult:
+    url: str
+    title: str
+    text: str
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    not_modified: bool = False  # 304: the caller's previous copy is still current
+    error: Optional[str] = None
+
+
+def make_session(pool_size: int) -> requests.Session:
+    # One pooled session shared by every fetch thread, so connections are reused per host
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def parse_html(html: str, url: str) -> Tuple[str, str]:
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.string.strip() if soup.title and soup.title.string else url
+    for script in soup(["script", "style", "noscript"]):
+        script.extract()
+    text = soup.get_text(" ")
+    text = " ".join(text.split())
+    return title, text
+
+
+def fetch_page(
+    url: str,
+    session: Optional[requests.Session] = None,
+    timeout: float = 20.0,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> FetchResult:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    resp = (session or requests).get(url, timeout=timeout, headers=headers)
+    if resp.status_code == 304:
+        return FetchResult(url, url, "", etag=etag, last_modified=last_modified, not_modified=True)
+    resp.raise_for_status()
+    title, text = parse_html(resp.text, url)
+    return FetchResult(url, title, text, etag=resp.headers.get("ETag"), last_modified=resp.headers.get("Last-Modified"))
+
+
+def fetch_url(url: str) -> Tuple[str, str]:
+    result = fetch_page(url)
+    return result.title, result.text
+
+
+def iter_fetch_urls(
+    urls: Iterable[str],
+    previous: Optional[Dict[str, Document]] = None,
+    max_workers: int = 8,
+    per_host: int = 2,
+    timeout: float = 20.0,
+) -> Iterator[FetchResult]:
+    # Fetch concurrently (bounded pool, at most per_host in flight per host) and yield results in
+    # input order. At most 2*max_workers pages are pending at once, so a slow consumer bounds memory.
+    # With previous documents, sends If-None-Match / If-Modified-Since so unchanged pages come back
+    # as 304 without a body to parse. Failures yield an empty page with FetchResult.error set.
+    previous = previous or {}
+    max_workers = max(max_workers, 1)
+    per_host = max(per_host, 1)
+    session = make_session(max_workers)
+    # Scheduled per host: a URL whose host already has per_host fetches in flight waits in that host's
+    # queue, not in a pool thread, so a slow host never holds threads other hosts could use
+    lock = threading.Lock()
+    waiting: Dict[str, Deque[Tuple[str, Future]]] = {}
+    active: Dict[str, int] = {}
+    stopped = threading.Event()
+
+    def fetch_one(url: str) -> FetchResult:
+        prev = previous.get(url)
+        try:
+            return fetch_page(
+                url,
+                session=session,
+                timeout=timeout,
+                etag=prev.etag if prev else None,
+                last_modified=prev.last_modified if prev else None,
+            )
+        except Exception as e:
+            return FetchResult(url, url, "", error=str(e))
+
+    def run(host: str, url: str, out: Future) -> None:
+        # Fetches url, then the host's queued URLs, until its queue is empty
+        while True:
+            if out.set_running_or_notify_cancel():
+                try:
+                    out.set_result(fetch_one(url))
+                except BaseException as e:
+                    out.set_exception(e)
+            with lock:
+                queued = waiting.get(host)
+                if stopped.is_set() or not queued:
+                    active[host] -= 1
+                    return
+                url, out = queued.popleft()
+
+    def schedule(pool: ThreadPoolExecutor, url: str) -> Future:
+        out: Future = Future()
+        host = urlsplit(url).netloc.lower()
+        with lock:
+            start = active.get(host, 0) < per_host
+            if start:
+                active[host] = active.get(host, 0) + 1
+            else:
+                waiting.setdefault(host, deque()).append((url, out))
+        if start:
+            pool.submit(run, host, url, out)
+        return out
+
+    pending: Deque[Future] = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            try:
+                for url in urls:
+                    pending.append(schedule(pool, url))
+                    if len(pending) >= 2 * max_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+            finally:
+                stopped.set()
+                for fut in pending:
+                    fut.cancel()
+    finally:
+        session.close()
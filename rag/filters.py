@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import re
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .cache import LRUCache
+from .types import Chunk
+from .utils import read_json, write_json
+
+# Metadata filters, evaluated before any scoring. build_index writes one posting index per field under meta/:
+#   filter.<field>.values.json   {"values": [...]}: distinct values, sorted, so a prefix is a contiguous range
+#   filter.<field>.offsets.npy   int64 (n_values + 1) offsets into the postings
+#   filter.<field>.postings.npy  int32 chunk rows grouped by value, ascending within each value
+# An expression evaluates to a boolean mask over chunk rows (a bitmap); BM25 drops postings outside it before
+# accumulating and vector search only scores rows inside it.
+#
+# Expression grammar (keywords are case-insensitive):
+#   expr   := term ("or" term)*
+#   term   := factor ("and" factor)*
+#   factor := "not" factor | "(" expr ")" | FIELD op VALUE | FIELD "in" "(" VALUE ("," VALUE)* ")"
+#   op     := "=" | "!=" | "^=" (starts with)
+# VALUE is a quoted string ('...' or "...", backslash escapes) or a bare word without spaces, parentheses,
+# commas, quotes or = ! ^. Examples:
+#   document_type = url and uri ^= "https://docs.example.com/"
+#   source_title in ("Handbook", "FAQ") or not document_type = file
+
+FILTER_FIELDS = ("document_type", "uri", "source_title")
+# Masks kept per loaded index for repeated filter expressions (one byte per chunk each)
+FILTER_CACHE_SIZE = 16
+
+_TOKEN_RE = re.compile(r"""\s*(?:(!=|\^=|=|\(|\)|,)|"((?:[^"\\]|\\.)*)"|'((?:[^'\\]|\\.)*)'|([^\s(),"'=!^]+))""")
+_ESCAPE_RE = re.compile(r"\\(.)")
+
+Node = Tuple
+
+
+def chunk_field_values(chunk: Chunk) -> Tuple[str, str, str]:
+    # Values of FILTER_FIELDS for one chunk
+    return chunk.document_type, chunk.document_uri, str(chunk.extra.get("source_title", ""))
+
+
+def _tokenize(expr: str) -> List[Tuple[str, str]]:
+    # (kind, text): kind is "op" for operators/punctuation, "str" for quoted values, "word" otherwise
+    tokens, pos, expr = [], 0, expr.rstrip()
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if m is None or m.end() == pos:
+            raise ValueError(f"Invalid filter expression at position {pos}: {expr!r}")
+        op, dq, sq, word = m.groups()
+        if op is not None:
+            tokens.append(("op", op))
+        elif word is not None:
+            tokens.append(("word", word))
+        else:
+            tokens.append(("str", _ESCAPE_RE.sub(r"\1", dq if dq is not None else sq)))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    def __init__(self, expr: str):
+        self.expr = expr
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def _error(self, message: str) -> ValueError:
+        return ValueError(f"Invalid filter expression ({message}): {self.expr!r}")
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self) -> Tuple[str, str]:
+        tok = self._peek()
+        if tok is None:
+            raise self._error("unexpected end")
+        self.pos += 1
+        return tok
+
+    def _keyword(self, word: str) -> bool:
+        tok = self._peek()
+        if tok is not None and tok[0] == "word" and tok[1].lower() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, op: str) -> None:
+        if self._next() != ("op", op):
+            raise self._error(f"expected {op!r}")
+
+    def _value(self) -> str:
+        kind, text = self._next()
+        if kind == "op":
+            raise self._error(f"expected a value, got {text!r}")
+        return text
+
+    def parse(self) -> Node:
+        node = self._or()
+        if self._peek() is not None:
+            raise self._error(f"unexpected {self._peek()[1]!r}")
+        return node
+
+    def _or(self) -> Node:
+        node = self._and()
+        while self._keyword("or"):
+            node = ("or", node, self._and())
+        return node
+
+    def _and(self) -> Node:
+        node = self._factor()
+        while self._keyword("and"):
+            node = ("and", node, self._factor())
+        return node
+
+    def _factor(self) -> Node:
+        if self._keyword("not"):
+            return ("not", self._factor())
+        if self._peek() == ("op", "("):
+            self.pos += 1
+            node = self._or()
+            self._expect(")")
+            return node
+        kind, field = self._next()
+        if kind != "word" or field not in FILTER_FIELDS:
+            raise self._error(f"unknown field {field!r}, expected one of {FILTER_FIELDS}")
+        if self._keyword("in"):
+            self._expect("(")
+            values = [self._value()]
+            while self._peek() == ("op", ","):
+                self.pos += 1
+                values.append(self._value())
+            self._expect(")")
+            return ("in", field, tuple(values))
+        kind, op = self._next()
+        if kind != "op" or op not in ("=", "!=", "^="):
+            raise self._error(f"expected =, != or ^= after {field!r}")
+        value = self._value()
+        if op == "^=":
+            return ("prefix", field, value)
+        node = ("in", field, (value,))
+        return ("not", node) if op == "!=" else node
+
+
+@lru_cache(maxsize=256)
+def parse_filter(expr: str) -> Node:
+    """Parse a filter expression into a tuple tree; raises ValueError on syntax errors or unknown fields."""
+    return _Parser(expr).parse()
+
+
+class FieldIndex:
+    """Chunk rows per distinct value of one metadata field (values sorted, postings grouped by value)."""
+
+    def __init__(self, values: Sequence[str], offsets: np.ndarray, postings: np.ndarray):
+        self.values = values
+        self.offsets = offsets
+        self.postings = postings
+
+    @classmethod
+    def from_value_ids(cls, values: List[str], value_ids: np.ndarray) -> "FieldIndex":
+        # values in first-appearance order, value_ids[row] indexes into them; remapped onto sorted values
+        order = sorted(range(len(values)), key=values.__getitem__)
+        remap = np.empty(len(order), dtype=np.int32)
+        remap[order] = np.arange(len(order), dtype=np.int32)
+        sorted_ids = remap[value_ids] if len(value_ids) else np.zeros(0, dtype=np.int32)
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(sorted_ids, minlength=len(order)))
+        postings = np.argsort(sorted_ids, kind="stable").astype(np.int32)
+        return cls([values[i] for i in order], offsets, postings)
+
+    @classmethod
+    def load(cls, meta_dir: Path, field: str) -> "FieldIndex":
+        return cls(
+            read_json(meta_dir / f"filter.{field}.values.json")["values"],
+            np.load(meta_dir / f"filter.{field}.offsets.npy", mmap_mode="r"),
+            np.load(meta_dir / f"filter.{field}.postings.npy", mmap_mode="r"),
+        )
+
+    def save(self, meta_dir: Path, field: str) -> None:
+        write_json(meta_dir / f"filter.{field}.values.json", {"values": list(self.values)})
+        np.save(meta_dir / f"filter.{field}.offsets.npy", np.asarray(self.offsets, dtype=np.int64))
+        np.save(meta_dir / f"filter.{field}.postings.npy", np.asarray(self.postings, dtype=np.int32))
+
+    def _range_rows(self, lo: int, hi: int) -> np.ndarray:
+        return self.postings[int(self.offsets[lo]):int(self.offsets[hi])]
+
+    def rows_equal(self, value: str) -> np.ndarray:
+        i = bisect_left(self.values, value)
+        if i < len(self.values) and self.values[i] == value:
+            return self._range_rows(i, i + 1)
+        return self.postings[:0]
+
+    def rows_prefix(self, prefix: str) -> np.ndarray:
+        # Values starting with prefix are contiguous in sorted order, and so are their postings
+        lo = bisect_left(self.values, prefix)
+        hi = bisect_left(self.values, prefix + "\U0010ffff", lo)
+        return self._range_rows(lo, hi)
+
+
+def filter_index_files(field: str) -> Tuple[str, str, str]:
+    return (f"filter.{field}.values.json", f"filter.{field}.offsets.npy", f"filter.{field}.postings.npy")
+
+
+def has_filter_index(meta_dir: Path) -> bool:
+    return all((meta_dir / name).exists() for field in FILTER_FIELDS for name in filter_index_files(field))
+
+
+class FilterIndexWriter:
+    """Collects each chunk's field values during build_index; close() writes the per-field posting indexes."""
+
+    def __init__(self, meta_dir: Path):
+        self.meta_dir = meta_dir
+        self._value_ids: Dict[str, Dict[str, int]] = {field: {} for field in FILTER_FIELDS}
+        self._rows: Dict[str, array] = {field: array("i") for field in FILTER_FIELDS}
+
+    def add(self, chunk: Chunk) -> None:
+        for field, value in zip(FILTER_FIELDS, chunk_field_values(chunk)):
+            ids = self._value_ids[field]
+            vid = ids.get(value)
+            if vid is None:
+                vid = ids[value] = len(ids)
+            self._rows[field].append(vid)
+
+    def close(self) -> None:
+        for field in FILTER_FIELDS:
+            value_ids = np.frombuffer(self._rows[field], dtype=np.int32)
+            FieldIndex.from_value_ids(list(self._value_ids[field]), value_ids).save(self.meta_dir, field)
+
+
+def build_field_indexes(chunks: Sequence[Chunk]) -> Dict[str, FieldIndex]:
+    # In-memory posting indexes of an existing chunk table; a columnar store is read per document, not per chunk
+    from .chunkstore import ChunkStore
+
+    value_ids: Dict[str, Dict[str, int]] = {field: {} for field in FILTER_FIELDS}
+    if isinstance(chunks, ChunkStore):
+        doc_values = np.empty((len(chunks.documents), len(FILTER_FIELDS)), dtype=np.int32)
+        for d, (_, uri, doc_type, extra) in enumerate(chunks.documents):
+            for fi, (field, value) in enumerate(zip(FILTER_FIELDS, (doc_type, uri, str(extra.get("source_title", ""))))):
+                doc_values[d, fi] = value_ids[field].setdefault(value, len(value_ids[field]))
+        rows = doc_values[np.asarray(chunks.doc)]
+    else:
+        rows = np.asarray(
+            [[value_ids[f].setdefault(v, len(value_ids[f])) for f, v in zip(FILTER_FIELDS, chunk_field_values(c))] for c in chunks],
+            dtype=np.int32,
+        ).reshape(-1, len(FILTER_FIELDS))
+    return {
+        field: FieldIndex.from_value_ids(list(value_ids[field]), np.ascontiguousarray(rows[:, fi]))
+        for fi, field in enumerate(FILTER_FIELDS)
+    }
+
+
+def write_filter_index(meta_dir: Path, chunks: Sequence[Chunk]) -> None:
+    # For indexes built before filter indexes existed (see rag.serving.prepare_index)
+    for field, index in build_field_indexes(chunks).items():
+        index.save(meta_dir, field)
+
+
+class MetadataIndex:
+    """Per-field posting indexes of one index; mask(expr) returns the rows an expression selects."""
+
+    def __init__(self, fields: Dict[str, FieldIndex], n_rows: int):
+        self.fields = fields
+        self.n_rows = n_rows
+        self._masks = LRUCache(maxsize=FILTER_CACHE_SIZE)
+
+    @classmethod
+    def load(cls, meta_dir: Path, chunks: Sequence[Chunk]) -> "MetadataIndex":
+        if not has_filter_index(meta_dir):
+            # Older index: derive the postings in memory (rag.serving.prepare_index writes them once instead)
+            return cls.from_chunks(chunks)
+        return cls({field: FieldIndex.load(meta_dir, field) for field in FILTER_FIELDS}, len(chunks))
+
+    @classmethod
+    def from_chunks(cls, chunks: Sequence[Chunk]) -> "MetadataIndex":
+        return cls(build_field_indexes(chunks), len(chunks))
+
+    def _evaluate(self, node: Node) -> np.ndarray:
+        op = node[0]
+        if op == "and":
+            return self._evaluate(node[1]) & self._evaluate(node[2])
+        if op == "or":
+            return self._evaluate(node[1]) | self._evaluate(node[2])
+        if op == "not":
+            return ~self._evaluate(node[1])
+        field = self.fields[node[1]]
+        mask = np.zeros(self.n_rows, dtype=bool)
+        if op == "prefix":
+            mask[field.rows_prefix(node[2])] = True
+        else:
+            for value in node[2]:
+                mask[field.rows_equal(value)] = True
+        return mask
+
+    def mask(self, expr: str) -> np.ndarray:
+        """Boolean mask over chunk rows selected by expr (cached per expression; treat as read-only)."""
+        mask = self._masks.get(expr)
+        if mask is None:
+            mask = self._evaluate(parse_filter(expr))
+            mask.flags.writeable = False
+            self._masks.put(expr, mask)
+        return mask
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# Rank/score fusion of the BM25 and vector candidate lists for a batch of queries, entirely on NumPy arrays.
+# Every (signal, query, candidate) becomes one array element keyed by query * n_docs + doc; contributions
+# are computed in one vectorized expression and summed per key with one bincount.
+#
+#   rrf           sum over signals of 1 / (rrf_k + rank)
+#   weighted_rrf  sum over signals of w_signal / (rrf_k + rank)
+#   combsum       sum over signals of w_signal * norm(score)
+#   combmnz       combsum * number of signals that returned the doc
+#
+# Ranks are 0-based within each signal's list. norm is applied per (query, signal) list: "minmax" maps
+# to [0, 1] (a constant list maps to 1), "zscore" to mean 0 / std 1 (a constant list maps to 0).
+
+FUSION_METHODS = ("rrf", "weighted_rrf", "combsum", "combmnz")
+FUSION_NORMS = ("minmax", "zscore")
+
+# Row layout of fused results: (doc index, fused score, bm25 rank, vector rank), ranks 0-based, -1 if absent
+FusedRow = Tuple[int, float, int, int]
+
+
+def parse_weights(text: str) -> Tuple[float, float]:
+    # "bm25,vector" as given on the command line or in FUSION_WEIGHTS, e.g. "1,0.5"
+    weights = tuple(float(w) for w in text.split(",") if w.strip())
+    if len(weights) != 2:
+        raise ValueError(f"Fusion weights must be two comma-separated numbers (bm25,vector), got {text!r}")
+    return weights
+
+
+def _flatten(tops: Sequence[Sequence[int]], scores: Sequence[Sequence[float]] | None) -> Tuple[np.ndarray, ...]:
+    # Ragged lists -> (list ids, docs, 0-based ranks within the list, scores, per-list offsets)
+    lengths = np.fromiter((len(t) for t in tops), dtype=np.int64, count=len(tops))
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+    total = int(offsets[-1])
+    qids = np.repeat(np.arange(len(tops), dtype=np.int64), lengths)
+    docs = np.fromiter((d for t in tops for d in t), dtype=np.int64, count=total)
+    ranks = np.arange(total, dtype=np.int64) - offsets[qids]
+    if scores is None:
+        vals = np.zeros(total, dtype=np.float64)
+    else:
+        vals = np.fromiter((s for row in scores for s in row), dtype=np.float64, count=total)
+    return qids, docs, ranks, vals, offsets
+
+
+def normalize_scores(scores: np.ndarray, offsets: np.ndarray, norm: str) -> np.ndarray:
+    """Normalize each segment scores[offsets[i]:offsets[i + 1]] independently ("minmax" or "zscore")."""
+    if norm not in FUSION_NORMS:
+        raise ValueError(f"Unknown fusion_norm: {norm!r} (expected one of {FUSION_NORMS})")
+    lengths = np.diff(offsets)
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return scores.astype(np.float64)
+    starts = offsets[:-1][nonempty]
+    seg = np.repeat(np.arange(int(nonempty.sum())), lengths[nonempty])
+    if norm == "minmax":
+        lo = np.minimum.reduceat(scores, starts)
+        hi = np.maximum.reduceat(scores, starts)
+        span = (hi - lo)[seg]
+        return np.where(span > 0, (scores - lo[seg]) / np.where(span > 0, span, 1.0), 1.0)
+    n = lengths[nonempty].astype(np.float64)
+    mean = np.add.reduceat(scores, starts) / n
+    centered = scores - mean[seg]
+    std = np.sqrt(np.add.reduceat(centered * centered, starts) / n)[seg]
+    return np.where(std > 0, centered / np.where(std > 0, std, 1.0), 0.0)
+
+
+def fuse_many(
+    bm25_tops: Sequence[Sequence[int]],
+    vector_tops: Sequence[Sequence[int]],
+    n_docs: int,
+    k_fused: int,
+    method: str = "rrf",
+    rrf_k: int = 60,
+    weights: Sequence[float] = (1.0, 1.0),
+    norm: str = "minmax",
+    bm25_scores: Sequence[Sequence[float]] | None = None,
+    vector_scores: Sequence[Sequence[float]] | None = None,
+) -> List[List[FusedRow]]:
+    """Fuse per-query BM25 and vector candidate lists (best first) and keep the top k_fused per query.
+
+    Returns per query [(doc, fused score, bm25 rank, vector rank)], best first; ties go to the lower doc index.
+    combsum / combmnz need bm25_scores and vector_scores aligned with the tops.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion_method: {method!r} (expected one of {FUSION_METHODS})")
+    n_queries = len(bm25_tops)
+    comb = method in ("combsum", "combmnz")
+    if comb and (bm25_scores is None or vector_scores is None):
+        raise ValueError(f"fusion_method {method!r} needs bm25_scores and vector_scores")
+
+    # Both signals' lists as one ragged batch: list i is signal i // n_queries, query i % n_queries
+    tops = list(bm25_tops) + list(vector_tops)
+    seg, docs, ranks, vals, offsets = _flatten(tops, list(bm25_scores) + list(vector_scores) if comb else None)
+    if not len(docs):
+        return [[] for _ in range(n_queries)]
+    is_bm25 = seg < n_queries
+    if comb:
+        contrib = normalize_scores(vals, offsets, norm)
+    else:
+        contrib = 1.0 / (rrf_k + ranks)
+    if method != "rrf":
+        contrib *= np.where(is_bm25, float(weights[0]), float(weights[1]))
+
+    all_keys = np.where(is_bm25, seg, seg - n_queries) * n_docs + docs
+    uniq, inverse = np.unique(all_keys, return_inverse=True)
+    fused = np.bincount(inverse, weights=contrib, minlength=len(uniq))
+    if method == "combmnz":
+        fused *= np.bincount(inverse, minlength=len(uniq))
+    bm25_rank = np.full(len(uniq), -1, dtype=np.int64)
+    vector_rank = np.full(len(uniq), -1, dtype=np.int64)
+    bm25_rank[inverse[is_bm25]] = ranks[is_bm25]
+    vector_rank[inverse[~is_bm25]] = ranks[~is_bm25]
+
+    # Top k_fused per query: sort by (query, fused desc, doc) and cut each query's run
+    q_of, docs = uniq // n_docs, uniq % n_docs
+    order = np.lexsort((docs, -fused, q_of))
+    q_sorted = q_of[order]
+    starts = np.searchsorted(q_sorted, np.arange(n_queries + 1))
+    keep = order[(np.arange(len(order)) - starts[q_sorted]) < k_fused]
+    bounds = np.searchsorted(q_of[keep], np.arange(n_queries + 1))
+    rows = list(zip(docs[keep].tolist(), fused[keep].tolist(), bm25_rank[keep].tolist(), vector_rank[keep].tolist()))
+    return [rows[bounds[i]:bounds[i + 1]] for i in range(n_queries)]
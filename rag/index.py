@@ -1,26 +1,38 @@
 from __future__ import annotations
 
+import queue
+import shutil
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Tuple
-from dataclasses import asdict
+from typing import Callable, Deque, List, Dict, Tuple
+from dataclasses import asdict, replace
 from datetime import datetime
 
 import numpy as np
-import requests
-from bs4 import BeautifulSoup
+import orjson
 
+from .ann import IVFIndex, VECTOR_INDEXES
+from .bm25 import BM25Builder
+from .chunkstore import ChunkStoreWriter
 from .config import RAGConfig
+from .fetch import iter_fetch_urls
+from .filters import FilterIndexWriter
+from .ingest import chunk_document, iter_ingest_files
 from .types import Document, Chunk
+from .vectors import NpyAppender, write_quantized
 from .utils import (
-    iter_files,
-    read_text_file,
-    chunk_text_by_words,
-    sha256_file,
+    JsonlWriter,
+    iter_jsonl_spans,
+    read_json,
+    read_jsonl,
+    read_jsonl_span,
     sha256_text,
+    tokenize,
     write_json,
-    write_jsonl,
 )
-from .embeddings import embed_texts
 
 
 class IndexArtifacts:
@@ -54,101 +66,356 @@ class IndexArtifacts:
         return self.bm25_dir / "corpus.json"
 
 
-def fetch_url(url: str) -> Tuple[str, str]:
-    resp = requests.get(url, timeout=20)
-    resp.raise_for_status()
-    html = resp.text
-    soup = BeautifulSoup(html, "html.parser")
-    title = soup.title.string.strip() if soup.title and soup.title.string else url
-    for script in soup(["script", "style", "noscript"]):
-        script.extract()
-    text = soup.get_text(" ")
-    text = " ".join(text.split())
-    return title, text
-
-
-def build_index(config: RAGConfig, input_paths: List[Path], urls: List[str] | None = None) -> None:
-    artifacts = IndexArtifacts(config.index_dir)
-
-    documents: List[Document] = []
-    chunks: List[Chunk] = []
-
-    for path in iter_files(input_paths, config.allowed_file_extensions):
-        text = read_text_file(path)
-        checksum = sha256_file(path)
-        doc = Document(
-            source_id=str(path.resolve()),
-            source_type="file",
-            uri=str(path.resolve()),
-            title=path.name,
-            fetched_at=None,
-            checksum=checksum,
-        )
-        documents.append(doc)
-        chunk_texts = chunk_text_by_words(text, config.max_chunk_words, config.chunk_overlap_words)
-        for i, ct in enumerate(chunk_texts):
-            csum = sha256_text(ct)
-            chunk = Chunk(
-                chunk_id=csum,
-                document_source_id=doc.source_id,
-                document_uri=doc.uri,
-                document_type=doc.source_type,
-                content=ct,
-                chunk_index=i,
-                checksum=csum,
-                extra={"source_title": doc.title or ""},
-            )
-            chunks.append(chunk)
+class PreviousIndex:
+    """Artifacts of an existing index that an incremental (--update) build can reuse."""
 
-    if urls:
-        for url in urls:
-            try:
-                title, text = fetch_url(url)
-            except Exception:
-                title, text = url, ""
-            checksum = sha256_text(text)
+    def __init__(self, artifacts: IndexArtifacts, config: RAGConfig):
+        self.chunks_path = artifacts.chunks_jsonl
+        self.documents: Dict[str, Document] = {}
+        # Chunks stay on disk: each document maps to its byte spans in the previous chunks.jsonl
+        self.chunk_spans: Dict[str, List[Tuple[int, int]]] = {}
+        self.embedding_rows: Dict[str, int] = {}
+        self.embeddings = None
+        if not (artifacts.config_json.exists() and artifacts.documents_jsonl.exists() and artifacts.chunks_jsonl.exists()):
+            return
+        prev_config = read_json(artifacts.config_json)
+        # Chunks are only reusable with the same chunking, embeddings only with the same model
+        if (prev_config.get("max_chunk_words"), prev_config.get("chunk_overlap_words")) != (config.max_chunk_words, config.chunk_overlap_words):
+            return
+        self.documents = {row["source_id"]: Document(**row) for row in read_jsonl(artifacts.documents_jsonl)}
+        embedding_rows: Dict[str, int] = {}
+        n_rows = 0
+        for start, end, row in iter_jsonl_spans(self.chunks_path):
+            spans = self.chunk_spans.setdefault(row["document_source_id"], [])
+            if spans and spans[-1][1] == start:
+                spans[-1] = (spans[-1][0], end)
+            else:
+                spans.append((start, end))
+            embedding_rows[row["checksum"]] = n_rows
+            n_rows += 1
+        if prev_config.get("embedding_model_name") == config.embedding_model_name and artifacts.embeddings_npy.exists():
+            self.embeddings = np.load(artifacts.embeddings_npy, mmap_mode="r")
+            if self.embeddings.shape[0] == n_rows:
+                self.embedding_rows = embedding_rows
+            else:
+                self.embeddings = None
+
+    def unchanged(self, source_id: str, checksum: str) -> bool:
+        prev = self.documents.get(source_id)
+        return prev is not None and prev.checksum == checksum
+
+    def chunks(self, source_id: str) -> List[Chunk]:
+        return [
+            Chunk(**row)
+            for start, end in self.chunk_spans.get(source_id, [])
+            for row in read_jsonl_span(self.chunks_path, start, end)
+        ]
+
+
+class CorpusJsonWriter:
+    """Streams bm25/corpus.json ({"documents": [...], "chunk_ids": [...]}) without holding either list."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._ids_path = path.with_name(path.name + ".ids")
+        self._docs = path.open("wb")
+        self._ids = self._ids_path.open("wb")
+        self._docs.write(b'{"documents":[')
+        self._n = 0
+
+    def write(self, chunk: Chunk) -> None:
+        sep = b"," if self._n else b""
+        self._docs.write(sep + orjson.dumps(chunk.content))
+        self._ids.write(sep + orjson.dumps(chunk.chunk_id))
+        self._n += 1
+
+    def close(self) -> None:
+        self._ids.close()
+        self._docs.write(b'],"chunk_ids":[')
+        with self._ids_path.open("rb") as ids:
+            shutil.copyfileobj(ids, self._docs)
+        self._docs.write(b"]}")
+        self._docs.close()
+        self._ids_path.unlink()
+
+
+# Bounded queues between build stages: ingested documents, and chunk batches waiting for the encoder
+DOC_QUEUE_SIZE = 64
+EMBED_QUEUE_SIZE = 2
+
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Raised inside a build stage when another stage has failed."""
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> None:
+    while True:
+        if stop.is_set():
+            raise _Stopped()
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(q: queue.Queue, stop: threading.Event):
+    while True:
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            if stop.is_set():
+                raise _Stopped()
+
+
+def _run_stage(fn: Callable[[], None], stop: threading.Event) -> None:
+    try:
+        fn()
+    except BaseException:
+        stop.set()
+        raise
+
+
+def _swap_in(staging: Path, index_dir: Path) -> None:
+    # Renames instead of rewriting files in place: readers that already memory-mapped the old artifacts
+    # keep valid (unlinked) files. The swap is not atomic: between the two directory renames index_dir
+    # does not exist, and while extra entries are carried over the old index lacks them, so a load that
+    # races the swap can fail and should be retried.
+    old = index_dir.parent / f".{index_dir.name}.old"
+    shutil.rmtree(old, ignore_errors=True)
+    if index_dir.exists():
+        # Anything in index_dir that the build does not produce is carried over
+        for entry in index_dir.iterdir():
+            if not (staging / entry.name).exists():
+                entry.rename(staging / entry.name)
+        index_dir.rename(old)
+    staging.rename(index_dir)
+    shutil.rmtree(old, ignore_errors=True)
+
+
+def build_index(
+    config: RAGConfig,
+    input_paths: List[Path],
+    urls: List[str] | None = None,
+    update: bool = False,
+) -> Dict[str, float]:
+    # update=True reuses the existing index: unchanged documents keep their chunks, and chunks whose
+    # checksum was embedded before keep their embedding rows; only new content is chunked and embedded.
+    # The index is built in a staging directory next to index_dir and swapped in when complete.
+    if config.vector_index not in VECTOR_INDEXES:
+        raise ValueError(f"Unknown vector_index: {config.vector_index!r} (expected one of {VECTOR_INDEXES})")
+    index_dir = Path(config.index_dir).resolve()
+    previous = PreviousIndex(IndexArtifacts(index_dir), config) if update else None
+    staging = index_dir.parent / f".{index_dir.name}.building"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        stats = _build_streaming(IndexArtifacts(staging), config, input_paths, urls or [], previous)
+        if previous is not None:
+            # Release the memory map of the old embeddings before they are replaced
+            previous.embeddings = None
+        _swap_in(staging, index_dir)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return stats
+
+
+def _build_streaming(
+    artifacts: IndexArtifacts,
+    config: RAGConfig,
+    input_paths: List[Path],
+    urls: List[str],
+    previous: PreviousIndex | None,
+) -> Dict[str, float]:
+    # Pipeline with bounded queues, so memory stays flat in the corpus size and I/O overlaps encoding:
+    #   ingest thread: discover files / fetch URLs -> read -> chunk
+    #   this thread:   append documents.jsonl + chunks.jsonl, accumulate BM25 postings, batch chunk texts
+    #   embed thread:  encode batches (or copy reused rows) and append them to embeddings.npy
+    stats = {"documents_unchanged": 0, "documents_changed": 0, "documents_added": 0, "documents_deleted": 0}
+    stats.update(chunks_total=0, chunks_embedded=0, chunks_reused=0, embed_seconds=0.0, urls_failed=0)
+    doc_queue: queue.Queue = queue.Queue(maxsize=DOC_QUEUE_SIZE)
+    embed_queue: queue.Queue = queue.Queue(maxsize=EMBED_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def ingested(doc: Document, chunks: List[Chunk] | None) -> Tuple[Document, List[Chunk], str | None]:
+        # chunks=None: the document is unchanged since the previous build and keeps its old chunks
+        if chunks is None:
+            return doc, previous.chunks(doc.source_id), "unchanged"
+        status = None
+        if previous is not None:
+            status = "changed" if doc.source_id in previous.documents else "added"
+        return doc, chunks, status
+
+    def ingest() -> None:
+        # Files: hashed, read and chunked across config.ingest_workers processes, in discovery order
+        previous_checksums = {sid: d.checksum for sid, d in previous.documents.items()} if previous is not None else None
+        for doc, chunks in iter_ingest_files(input_paths, config, config.ingest_workers, previous_checksums):
+            _put(doc_queue, ingested(doc, chunks), stop)
+
+        # Concurrent, pooled fetches; in update mode unchanged pages come back as 304 and are not parsed
+        results = iter_fetch_urls(
+            urls,
+            previous=previous.documents if previous is not None else None,
+            max_workers=config.fetch_workers,
+            per_host=config.fetch_per_host,
+            timeout=config.fetch_timeout,
+        )
+        for res in results:
+            fetched_at = datetime.utcnow().isoformat()
+            if res.error is not None:
+                stats["urls_failed"] += 1
+                prev_doc = previous.documents.get(res.url) if previous is not None else None
+                kept = "; keeping the previously indexed copy" if prev_doc is not None else ""
+                print(f"⚠️ Failed to fetch {res.url}: {res.error}{kept}")
+                if prev_doc is not None:
+                    # A transient failure must not replace an indexed page (or its validators) with nothing
+                    _put(doc_queue, ingested(prev_doc, None), stop)
+                    continue
+            if res.not_modified:
+                _put(doc_queue, ingested(replace(previous.documents[res.url], fetched_at=fetched_at), None), stop)
+                continue
             doc = Document(
-                source_id=url,
+                source_id=res.url,
                 source_type="url",
-                uri=url,
-                title=title,
-                fetched_at=datetime.utcnow().isoformat(),
-                checksum=checksum,
+                uri=res.url,
+                title=res.title,
+                fetched_at=fetched_at,
+                checksum=sha256_text(res.text),
+                etag=res.etag,
+                last_modified=res.last_modified,
             )
-            documents.append(doc)
-            chunk_texts = chunk_text_by_words(text, config.max_chunk_words, config.chunk_overlap_words)
-            for i, ct in enumerate(chunk_texts):
-                csum = sha256_text(ct)
-                chunk = Chunk(
-                    chunk_id=csum,
-                    document_source_id=doc.source_id,
-                    document_uri=doc.uri,
-                    document_type=doc.source_type,
-                    content=ct,
-                    chunk_index=i,
-                    checksum=csum,
-                    extra={"source_title": doc.title or ""},
-                )
-                chunks.append(chunk)
+            if previous is not None and previous.unchanged(doc.source_id, doc.checksum):
+                _put(doc_queue, ingested(doc, None), stop)
+            else:
+                _put(doc_queue, ingested(doc, chunk_document(doc, res.text, config)), stop)
+        _put(doc_queue, _DONE, stop)
+
+    emb_writer = NpyAppender(artifacts.embeddings_npy)
+
+    def embed() -> None:
+        # Imported here so ingest worker processes, which import this module, never load the model stack
+        from .embeddings import ParallelEmbedder, embed_texts
+
+        # Batches hold chunk texts to encode, or int row numbers of reusable previous embeddings.
+        # With embed_workers > 1 the texts are sharded across model worker processes and up to
+        # EMBED_QUEUE_SIZE batches are in flight; rows are still appended in batch order.
+        embedder = ParallelEmbedder(config.embedding_model_name, config.embed_workers) if config.embed_workers > 1 else None
+        in_flight: Deque[Tuple[List, List[int], Callable[[], np.ndarray] | None]] = deque()
+
+        def finish(batch: List, to_embed: List[int], result: Callable[[], np.ndarray] | None) -> None:
+            new_embs = result() if result is not None else None
+            dim = new_embs.shape[1] if new_embs is not None else previous.embeddings.shape[1]
+            rows = np.empty((len(batch), dim), dtype=np.float32)
+            if new_embs is not None:
+                rows[to_embed] = new_embs
+            reused = [i for i, item in enumerate(batch) if not isinstance(item, str)]
+            if reused:
+                rows[reused] = previous.embeddings[[batch[i] for i in reused]]
+            emb_writer.append(rows)
+
+        started = None
+        try:
+            while True:
+                batch = _get(embed_queue, stop)
+                if batch is _DONE:
+                    break
+                started = started or time.perf_counter()
+                to_embed = [i for i, item in enumerate(batch) if isinstance(item, str)]
+                texts = [batch[i] for i in to_embed]
+                if not texts:
+                    in_flight.append((batch, to_embed, None))
+                elif embedder is not None:
+                    in_flight.append((batch, to_embed, embedder.submit(texts)))
+                else:
+                    in_flight.append((batch, to_embed, lambda texts=texts: embed_texts(texts, config.embedding_model_name)))
+                while len(in_flight) > (EMBED_QUEUE_SIZE if embedder is not None else 0):
+                    finish(*in_flight.popleft())
+            while in_flight:
+                finish(*in_flight.popleft())
+        finally:
+            if embedder is not None:
+                embedder.close()
+        # Wall time from the first batch to the last row written, i.e. what the build actually waited on
+        stats["embed_seconds"] = time.perf_counter() - started if started else 0.0
+
+    bm25 = BM25Builder()
+    seen = set()
+    reuse = previous.embedding_rows if previous is not None else {}
+    try:
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="build-index") as pool:
+            stages = [pool.submit(_run_stage, ingest, stop), pool.submit(_run_stage, embed, stop)]
+            try:
+                corpus_out = CorpusJsonWriter(artifacts.bm25_corpus_json)
+                store_out = ChunkStoreWriter(artifacts.meta_dir)
+                filters_out = FilterIndexWriter(artifacts.meta_dir)
+                with JsonlWriter(artifacts.documents_jsonl) as docs_out, JsonlWriter(artifacts.chunks_jsonl) as chunks_out:
+                    batch: List = []
+                    while True:
+                        item = _get(doc_queue, stop)
+                        if item is _DONE:
+                            break
+                        doc, doc_chunks, status = item
+                        if status is not None:
+                            stats[f"documents_{status}"] += 1
+                        seen.add(doc.source_id)
+                        docs_out.write(asdict(doc))
+                        for c in doc_chunks:
+                            chunks_out.write(asdict(c))
+                            corpus_out.write(c)
+                            store_out.add(c)
+                            filters_out.add(c)
+                            bm25.add(tokenize(c.content))
+                            # Embeddings: copy rows for previously embedded chunk checksums, encode the rest
+                            row = reuse.get(c.checksum)
+                            batch.append(c.content if row is None else row)
+                            stats["chunks_embedded" if row is None else "chunks_reused"] += 1
+                        if len(batch) >= config.embed_batch_size:
+                            _put(embed_queue, batch, stop)
+                            batch = []
+                    if batch:
+                        _put(embed_queue, batch, stop)
+                corpus_out.close()
+                store_out.close()
+                filters_out.close()
+                _put(embed_queue, _DONE, stop)
+            except BaseException:
+                stop.set()
+                # A failed stage stops this thread with _Stopped; surface the stage's own error instead
+                for fut in stages:
+                    exc = fut.exception()
+                    if exc is not None and not isinstance(exc, _Stopped):
+                        raise exc
+                raise
+            for fut in stages:
+                fut.result()
+    finally:
+        emb_writer.close()
+
+    stats["chunks_total"] = stats["chunks_embedded"] + stats["chunks_reused"]
+    stats["embed_texts_per_sec"] = stats["chunks_embedded"] / stats["embed_seconds"] if stats["embed_seconds"] else 0.0
+    if previous is not None:
+        stats["documents_deleted"] = sum(1 for sid in previous.documents if sid not in seen)
 
     write_json(artifacts.config_json, {
         "embedding_model_name": config.embedding_model_name,
         "max_chunk_words": config.max_chunk_words,
         "chunk_overlap_words": config.chunk_overlap_words,
+        "embedding_storage": config.embedding_storage,
+        "vector_index": config.vector_index,
         "created_at": datetime.utcnow().isoformat(),
     })
-    write_jsonl(artifacts.documents_jsonl, (asdict(d) for d in documents))
-    write_jsonl(artifacts.chunks_jsonl, (asdict(c) for c in chunks))
 
-    contents = [c.content for c in chunks]
-    if contents:
-        embs = embed_texts(contents, config.embedding_model_name)
-        np.save(artifacts.embeddings_npy, embs)
+    if emb_writer.rows:
+        write_quantized(artifacts.emb_dir, config.embedding_storage)
+        if config.vector_index == "ivf":
+            embs = np.load(artifacts.embeddings_npy, mmap_mode="r")
+            IVFIndex.build(embs, config.ivf_lists).save(artifacts.emb_dir)
+            del embs
+    else:
+        artifacts.embeddings_npy.unlink(missing_ok=True)
 
-    bm25_corpus = {
-        "documents": [c.content for c in chunks],
-        "chunk_ids": [c.chunk_id for c in chunks],
-    }
-    write_json(artifacts.bm25_corpus_json, bm25_corpus)
+    bm25.build().save(artifacts.bm25_dir)
 
-    return None 
\ No newline at end of file
+    return stats
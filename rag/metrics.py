@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# In-process metrics in the Prometheus text exposition format (no client library needed). Each metric keeps
+# one value (or bucket array) per label-value tuple behind its own lock; an update is a dict lookup plus an
+# add, so timing a stage costs about a microsecond. Values are per process: with several uvicorn workers,
+# each scrape of /metrics sees the worker that served it.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        """Exposition lines for every label-value tuple (no HELP/TYPE header)."""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (requests, errors, cache lookups)."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set_total(self, value: float, **labels: str) -> None:
+        # For collect callbacks mirroring a count kept elsewhere (e.g. LRUCache.hits)
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels_text(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+
+class Gauge(Counter):
+    """Value that goes up and down (in-flight requests, cache sizes)."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.set_total(value, **labels)
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (seconds) over fixed cumulative buckets, plus sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last = +Inf), sum]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        self.observe_many(((self._key(labels), value),))
+
+    def observe_many(self, observations: Iterable[Tuple[Tuple[str, ...], float]]) -> None:
+        # Hot path: (label values tuple in labelnames order, value) pairs under a single lock acquisition
+        buckets, n_buckets = self.buckets, len(self.buckets) + 1
+        with self._lock:
+            for key, value in observations:
+                entry = self._values.get(key)
+                if entry is None:
+                    entry = self._values[key] = [[0] * n_buckets, 0.0]
+                entry[0][bisect.bisect_left(buckets, value)] += 1
+                entry[1] += value
+
+    def count(self, **labels: str) -> int:
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(counts), total)) for k, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels_text(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels_text(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels_text(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Named metrics plus collect callbacks (run before rendering, e.g. to copy cache sizes into gauges)."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, help: str, labelnames: Iterable[str], **kwargs) -> _Metric:
+        # Idempotent, so modules can declare their metrics at import time (and be reloaded)
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} already registered as {metric.kind} with labels {metric.labelnames}")
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help, labelnames)
+
+    def gauge(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help, labelnames)
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help, labelnames, buckets=buckets)
+
+    def on_collect(self, fn: Callable[[], None]) -> None:
+        with self._lock:
+            self._collectors.append(fn)
+
+    def remove_collector(self, fn: Callable[[], None]) -> None:
+        # For callbacks tied to something shorter-lived than the process (an app instance)
+        with self._lock:
+            if fn in self._collectors:
+                self._collectors.remove(fn)
+
+    def render(self) -> str:
+        with self._lock:
+            collectors, metrics = list(self._collectors), sorted(self._metrics.values(), key=lambda m: m.name)
+        for fn in collectors:
+            try:
+                fn()
+            except Exception as exc:
+                print(f"⚠️ Metrics collector failed: {exc}")
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Content type of the text exposition format served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+RETRIEVE_STAGE_SECONDS = REGISTRY.histogram(
+    "rag_retrieve_stage_seconds", "Time per rag.retrieve stage per query batch", ("stage",)
+)
+RETRIEVE_QUERIES = REGISTRY.counter("rag_retrieve_queries_total", "Queries run through rag.retrieve")
+
+
+def record_stages(histogram: Histogram, stages: Dict[str, float], timings: Optional[Dict[str, float]] = None) -> None:
+    """Observe each stage's seconds in histogram (label "stage") and, if given, add them to timings."""
+    histogram.observe_many(((stage,), seconds) for stage, seconds in stages.items())
+    if timings is not None:
+        for stage, seconds in stages.items():
+            timings[f"{stage}_seconds"] = round(timings.get(f"{stage}_seconds", 0.0) + seconds, 6)
+
+
+class StageClock:
+    """Successive stage durations: clock.lap("bm25") returns and stores the seconds since the previous lap."""
+
+    __slots__ = ("last", "stages")
+
+    def __init__(self):
+        self.last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def lap(self, stage: str) -> float:
+        now = time.perf_counter()
+        seconds = now - self.last
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.last = now
+        return seconds
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+# On-demand CPU profiles of one command or request:
+#   sampling: a background thread snapshots the target threads' Python stacks every `interval` seconds and
+#             writes <name>.collapsed (one "thread;outer;...;inner count" line per distinct stack, the input
+#             format of flamegraph.pl / speedscope / inferno) plus a top-N summary <name>.txt
+#   cprofile: deterministic cProfile of the calling thread; writes <name>.prof (pstats / snakeviz) and <name>.txt
+
+PROFILE_MODES = ("sampling", "cprofile")
+DEFAULT_INTERVAL = 0.001
+
+
+def _label(code: CodeType, cache: Dict[CodeType, str]) -> str:
+    label = cache.get(code)
+    if label is None:
+        name = getattr(code, "co_qualname", code.co_name)
+        label = cache[code] = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+    return label
+
+
+class SamplingProfiler:
+    """Samples the Python stacks of selected threads (all but its own when thread_ids is None)."""
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, thread_ids: Optional[Set[int]] = None):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.samples: Counter = Counter()
+        self._labels: Dict[CodeType, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._switch_interval = sys.getswitchinterval()
+
+    def _stack(self, frame: Optional[FrameType]) -> Tuple[str, ...]:
+        stack: List[str] = []
+        while frame is not None:
+            stack.append(_label(frame.f_code, self._labels))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for tid, frame in sys._current_frames().items():
+                if tid == own or (self.thread_ids is not None and tid not in self.thread_ids):
+                    continue
+                self.samples[(names.get(tid, str(tid)),) + self._stack(frame)] += 1
+
+    def start(self) -> None:
+        # A CPU-bound thread only yields the GIL every switch interval; shorten it so samples arrive on time
+        sys.setswitchinterval(min(self._switch_interval, self.interval))
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in sorted(self.samples.items()))
+
+    def summary(self, top: int = 30) -> str:
+        total = sum(self.samples.values())
+        self_counts: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.samples.items():
+            frames = stack[1:]  # stack[0] is the thread name
+            if frames:
+                self_counts[frames[-1]] += count
+            for label in set(frames):
+                inclusive[label] += count
+        lines = [f"{total} samples every {self.interval * 1000:g} ms", "", "   self%  total%  function"]
+        for label, count in self_counts.most_common(top):
+            lines.append(f"{100 * count / total:7.1f} {100 * inclusive[label] / total:7.1f}  {label}")
+        lines += ["", "  total%  function (inclusive)"]
+        for label, count in inclusive.most_common(top):
+            lines.append(f"{100 * count / total:7.1f}  {label}")
+        return "\n".join(lines) + "\n"
+
+
+def profile_name(label: str) -> str:
+    # Sortable and unique per process: <label>-<UTC timestamp>-<pid>-<thread>
+    stamp = datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    return f"{label}-{stamp}-{os.getpid()}-{threading.get_ident() % 100000}"
+
+
+@contextmanager
+def profiled(
+    out_dir: Path,
+    name: str,
+    mode: str = "sampling",
+    top: int = 30,
+    interval: float = DEFAULT_INTERVAL,
+    all_threads: bool = False,
+) -> Iterator[Dict[str, str]]:
+    """Profile the enclosed block; the yielded dict receives the written file paths (and seconds) on exit.
+
+    Sampling covers the calling thread, or every thread with all_threads (e.g. build_index's pipeline);
+    cprofile always covers the calling thread only.
+    """
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode!r} (expected one of {PROFILE_MODES})")
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths: Dict[str, str] = {}
+    started = time.perf_counter()
+    if mode == "sampling":
+        sampler = SamplingProfiler(interval, None if all_threads else {threading.get_ident()})
+        sampler.start()
+        try:
+            yield paths
+        finally:
+            sampler.stop()
+            collapsed, summary = out_dir / f"{name}.collapsed", out_dir / f"{name}.txt"
+            collapsed.write_text(sampler.collapsed(), encoding="utf-8")
+            summary.write_text(sampler.summary(top), encoding="utf-8")
+            paths.update(collapsed=str(collapsed), summary=str(summary), seconds=f"{time.perf_counter() - started:.3f}")
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield paths
+        finally:
+            profiler.disable()
+            prof, summary = out_dir / f"{name}.prof", out_dir / f"{name}.txt"
+            profiler.dump_stats(str(prof))
+            text = io.StringIO()
+            stats = pstats.Stats(profiler, stream=text)
+            stats.sort_stats("tottime").print_stats(top)
+            stats.sort_stats("cumulative").print_stats(top)
+            summary.write_text(text.getvalue(), encoding="utf-8")
+            paths.update(prof=str(prof), summary=str(summary), seconds=f"{time.perf_counter() - started:.3f}")
@@ -1,14 +1,21 @@
 from __future__ import annotations
 
-from typing import List, Dict, Tuple
+import os
+import threading
+from functools import cached_property
+from typing import List, Dict, Optional, Tuple
 from pathlib import Path
 
-import numpy as np
-from rank_bm25 import BM25Okapi
-
+from .ann import IVFIndex
+from .bm25 import load_bm25
+from .chunkstore import ChunkStore, load_chunks
 from .config import RAGConfig
-from .types import Chunk, ScoredChunk, SignalScores
-from .utils import read_json, read_jsonl, tokenize
+from .filters import MetadataIndex
+from .fusion import fuse_many
+from .metrics import RETRIEVE_QUERIES, RETRIEVE_STAGE_SECONDS, StageClock, record_stages
+from .types import ScoredChunk, SignalScores
+from .utils import read_json, tokenize
+from .vectors import EmbeddingStore
 
 
 class LoadedIndex:
@@ -19,110 +26,190 @@ class LoadedIndex:
         self.emb_dir = self.index_dir / "embeddings"
         self.bm25_dir = self.index_dir / "bm25"
 
-        self.chunks = [Chunk(**row) for row in read_jsonl(self.meta_dir / "chunks.jsonl")]
-
-        # Load embeddings
-        self.embeddings = None
-        embs_path = self.emb_dir / "embeddings.npy"
-        if embs_path.exists():
-            self.embeddings = np.load(embs_path)
-            # embeddings should already be L2-normalized by embed_texts
-
-        # Load BM25
-        bm25_corpus = read_json(self.bm25_dir / "corpus.json")
-        tokenized_corpus = [tokenize(doc) for doc in bm25_corpus["documents"]]
-        self.bm25 = BM25Okapi(tokenized_corpus)
-        self.bm25_chunk_ids = bm25_corpus["chunk_ids"]
-        self.chunk_id_to_idx = {cid: i for i, cid in enumerate(self.bm25_chunk_ids)}
-
-
-def reciprocal_rank_fusion(ranks: Dict[str, int], k: int) -> float:
-    score = 0.0
-    for _, r in ranks.items():
-        if r is not None:
-            score += 1.0 / (k + r)
-    return score
-
-
-def topk_indices(scores: np.ndarray, k: int, largest: bool = True) -> List[int]:
-    if len(scores) == 0:
+        # Columnar, memory-mapped chunks (content decoded per accessed row); older indexes parse chunks.jsonl
+        self.chunks = load_chunks(self.meta_dir)
+
+        # Queries must be embedded with the model the index was built with
+        meta_config_path = self.meta_dir / "config.json"
+        self.meta_config = read_json(meta_config_path) if meta_config_path.exists() else {}
+        self.embedding_model_name = self.meta_config.get("embedding_model_name", config.embedding_model_name)
+
+        # Load embeddings (memory-mapped; scored from the float16/int8 copy when the index has one)
+        self.vectors = EmbeddingStore.load(self.emb_dir)
+        # embeddings should already be L2-normalized by embed_texts
+        self.embeddings = self.vectors.exact if self.vectors is not None else None
+        self.ivf = IVFIndex.load(self.emb_dir) if self.vectors is not None else None
+
+        # Load BM25 (persisted inverted index; legacy indexes fall back to corpus.json)
+        self.bm25 = load_bm25(self.bm25_dir)
+
+    # Built on first use only: they hold one Python string per chunk
+    @cached_property
+    def bm25_chunk_ids(self) -> List[str]:
+        if isinstance(self.chunks, ChunkStore):
+            return self.chunks.chunk_ids()
+        return [c.chunk_id for c in self.chunks]
+
+    @cached_property
+    def chunk_id_to_idx(self) -> Dict[str, int]:
+        return {cid: i for i, cid in enumerate(self.bm25_chunk_ids)}
+
+    @cached_property
+    def metadata(self) -> MetadataIndex:
+        # Per-field posting indexes for filter expressions (meta/filter.*; derived for older indexes)
+        return MetadataIndex.load(self.meta_dir, self.chunks)
+
+
+_ARTIFACT_SUBDIRS = ("meta", "embeddings", "bm25")
+
+_registry: Dict[Path, Tuple[Tuple, LoadedIndex]] = {}
+_registry_lock = threading.Lock()
+_load_locks: Dict[Path, threading.Lock] = {}
+
+
+def index_signature(index_dir: Path) -> Tuple:
+    # (relative path, mtime_ns, size) for every artifact; any rewrite of the index changes it
+    sig = []
+    for sub in _ARTIFACT_SUBDIRS:
+        d = Path(index_dir) / sub
+        if not d.is_dir():
+            continue
+        for entry in sorted(os.scandir(d), key=lambda e: e.name):
+            if entry.is_file():
+                st = entry.stat()
+                sig.append((f"{sub}/{entry.name}", st.st_mtime_ns, st.st_size))
+    return tuple(sig)
+
+
+def get_loaded_index(config: RAGConfig) -> LoadedIndex:
+    key = Path(config.index_dir).resolve()
+    sig = index_signature(key)
+    with _registry_lock:
+        entry = _registry.get(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    # One loader per index_dir; concurrent callers wait for it and share the result
+    with load_lock:
+        with _registry_lock:
+            entry = _registry.get(key)
+        sig = index_signature(key)
+        if entry is not None and entry[0] == sig:
+            return entry[1]
+        li = LoadedIndex(config)
+        with _registry_lock:
+            _registry[key] = (sig, li)
+        return li
+
+
+def clear_index_registry() -> None:
+    with _registry_lock:
+        _registry.clear()
+
+
+def retrieve_many(
+    config: RAGConfig,
+    queries: List[str],
+    timings: Optional[Dict[str, float]] = None,
+    filter_expr: Optional[str] = None,
+) -> List[List[ScoredChunk]]:
+    # Stage durations (load, filter, bm25, vector_embed, vector_search, fusion, assemble) go to the
+    # rag_retrieve_stage_seconds histogram and, when timings is given, into it as "<stage>_seconds".
+    # filter_expr (see rag.filters) restricts every query to the chunks it selects, before any scoring.
+    if not queries:
         return []
-    if k >= len(scores):
-        idx = np.argsort(scores)
-        return idx[::-1].tolist() if largest else idx.tolist()
-    if largest:
-        idx = np.argpartition(scores, -k)[-k:]
-        return idx[np.argsort(scores[idx])][::-1].tolist()
-    else:
-        idx = np.argpartition(scores, k)[:k]
-        return idx[np.argsort(scores[idx])].tolist()
-
-
-def cosine_search(query: str, embeddings: np.ndarray, model_name: str, top_k: int) -> Tuple[np.ndarray, List[int]]:
-    if embeddings is None or len(embeddings) == 0:
-        return np.array([]), []
-    from .embeddings import embed_texts
-
-    q = embed_texts([query], model_name)[0]
-    # embeddings and q are normalized, cosine = dot
-    scores = embeddings @ q
-    idxs = topk_indices(scores, min(top_k, embeddings.shape[0]), largest=True)
-    return scores, idxs
-
-
-def retrieve(config: RAGConfig, query: str) -> List[ScoredChunk]:
-    li = LoadedIndex(config)
-
-    # BM25
-    bm25_scores = li.bm25.get_scores(tokenize(query))
-    bm25_top_idx = topk_indices(np.array(bm25_scores), config.k_bm25, largest=True)
-
-    # Vector
-    vector_scores = np.array([])
-    vector_top_idx: List[int] = []
-    if li.embeddings is not None:
-        scores, idxs = cosine_search(query, li.embeddings, config.embedding_model_name, config.k_vector)
-        vector_scores = scores
-        vector_top_idx = idxs
-
-    # Rank maps
-    bm25_rank_map: Dict[int, int] = {i: rank for rank, i in enumerate(bm25_top_idx)}
-    vector_rank_map: Dict[int, int] = {i: rank for rank, i in enumerate(vector_top_idx)}
-
-    # Union
-    candidate_idxs = sorted(set(bm25_top_idx) | set(vector_top_idx))
-
-    # Fuse
-    fused_results: List[Tuple[int, float, SignalScores]] = []
-    for idx in candidate_idxs:
-        bm25_rank = bm25_rank_map.get(idx)
-        vec_rank = vector_rank_map.get(idx)
-        rranks = {}
-        if bm25_rank is not None:
-            rranks["bm25"] = bm25_rank
-        if vec_rank is not None:
-            rranks["vector"] = vec_rank
-        fused_score = reciprocal_rank_fusion(rranks, config.rrf_k)
-        sig = SignalScores(
-            bm25_score=float(bm25_scores[idx]) if idx < len(bm25_scores) else None,
-            bm25_rank=(bm25_rank + 1) if bm25_rank is not None else None,
-            vector_score=float(vector_scores[idx]) if idx in vector_top_idx else None,
-            vector_rank=(vec_rank + 1) if vec_rank is not None else None,
-        )
-        fused_results.append((idx, fused_score, sig))
-
-    fused_results.sort(key=lambda x: x[1], reverse=True)
-    fused_results = fused_results[: config.k_fused]
-
-    out: List[ScoredChunk] = []
-    for rank, (idx, fused_score, sig) in enumerate(fused_results, start=1):
-        out.append(
-            ScoredChunk(
-                chunk=li.chunks[idx],
-                fused_score=float(fused_score),
-                fused_rank=rank,
-                signals=sig,
+    clock = StageClock()
+    li = get_loaded_index(config)
+    clock.lap("load")
+    n_docs = len(li.chunks)
+
+    allowed = None
+    if filter_expr:
+        allowed = li.metadata.mask(filter_expr)
+        clock.lap("filter")
+    n_allowed = int(allowed.sum()) if allowed is not None else n_docs
+
+    # BM25 (only documents containing a query term are scored; exhaustive mode is batched)
+    token_lists = [tokenize(q) for q in queries]
+    bm25_results = li.bm25.top_k_many(token_lists, config.k_bm25, mode=config.bm25_search, allowed=allowed)
+    bm25_tops = [idxs for idxs, _ in bm25_results]
+    clock.lap("bm25")
+
+    # Vector: one encoder call for the batch's uncached queries, then blocked matrix-matrix scoring
+    vector_tops: List[List[int]] = [[] for _ in queries]
+    vector_top_scores: List[List[float]] = [[] for _ in queries]
+    if config.k_vector > 0 and li.vectors is not None and len(li.vectors) and n_allowed:
+        from .embeddings import embed_queries
+
+        query_embs = embed_queries(list(queries), li.embedding_model_name)
+        clock.lap("vector_embed")
+        # A filter selecting fewer rows than IVF would probe is searched exactly (and more cheaply) instead
+        use_ivf = config.vector_index == "ivf" and li.ivf is not None
+        if use_ivf and allowed is not None and n_allowed <= li.ivf.expected_scan_rows(n_docs, config.ivf_nprobe):
+            use_ivf = False
+        if use_ivf:
+            top_idx, top_scores = li.ivf.search(
+                li.vectors, query_embs, config.k_vector, nprobe=config.ivf_nprobe, rescore_k=config.vector_rescore_k, allowed=allowed
+            )
+        else:
+            top_idx, top_scores = li.vectors.search(query_embs, config.k_vector, rescore_k=config.vector_rescore_k, allowed=allowed)
+        for qi, (idxs, scores) in enumerate(zip(top_idx.tolist(), top_scores.tolist())):
+            found = [j for j, idx in enumerate(idxs) if idx >= 0]
+            vector_tops[qi] = [idxs[j] for j in found]
+            vector_top_scores[qi] = [scores[j] for j in found]
+        clock.lap("vector_search")
+
+    fused_batch = fuse_many(
+        bm25_tops,
+        vector_tops,
+        n_docs,
+        config.k_fused,
+        method=config.fusion_method,
+        rrf_k=config.rrf_k,
+        weights=config.fusion_weights,
+        norm=config.fusion_norm,
+        bm25_scores=[scores for _, scores in bm25_results],
+        vector_scores=vector_top_scores,
+    )
+    clock.lap("fusion")
+
+    out: List[List[ScoredChunk]] = []
+    for qi, fused_rows in enumerate(fused_batch):
+        bm25_idxs, bm25_scores = bm25_results[qi]
+        bm25_score_map = dict(zip(bm25_idxs, bm25_scores))
+        vector_score_map = dict(zip(vector_tops[qi], vector_top_scores[qi]))
+        vector_only = [idx for idx, _, bm25_rank, _ in fused_rows if bm25_rank < 0]
+        bm25_score_map.update(zip(vector_only, li.bm25.score_docs(token_lists[qi], vector_only).tolist()))
+
+        results: List[ScoredChunk] = []
+        for rank, (idx, fused_score, bm25_rank, vec_rank) in enumerate(fused_rows, start=1):
+            sig = SignalScores(
+                bm25_score=bm25_score_map[idx],
+                bm25_rank=(bm25_rank + 1) if bm25_rank >= 0 else None,
+                vector_score=float(vector_score_map[idx]) if vec_rank >= 0 else None,
+                vector_rank=(vec_rank + 1) if vec_rank >= 0 else None,
+            )
+            results.append(
+                ScoredChunk(
+                    chunk=li.chunks[idx],
+                    fused_score=float(fused_score),
+                    fused_rank=rank,
+                    signals=sig,
+                )
             )
-        )
+        out.append(results)
+
+    clock.lap("assemble")
+    RETRIEVE_QUERIES.inc(len(queries))
+    record_stages(RETRIEVE_STAGE_SECONDS, clock.stages, timings)
+    return out
+
 
-    return out 
\ No newline at end of file
+def retrieve(
+    config: RAGConfig,
+    query: str,
+    timings: Optional[Dict[str, float]] = None,
+    filter_expr: Optional[str] = None,
+) -> List[ScoredChunk]:
+    return retrieve_many(config, [query], timings, filter_expr)[0]
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+from .bm25 import VOCAB_FILES, InvertedBM25, MappedVocab, has_inverted_index, load_bm25
+from .chunkstore import ChunkStoreWriter, has_chunk_store, load_chunks
+from .filters import has_filter_index, write_filter_index
+from .types import Chunk
+from .utils import iter_jsonl_spans, read_json
+
+# Multi-worker serving: every artifact a query touches is a memory-mapped file, so worker processes attach
+# to the same page-cache pages instead of each building private copies. prepare_index derives whatever an
+# older index is missing, once, in the parent before the workers start.
+
+
+def prepare_index(index_dir: Path) -> List[str]:
+    """Write the memory-mappable artifacts missing from index_dir; returns the relative paths written."""
+    index_dir = Path(index_dir)
+    meta_dir, bm25_dir = index_dir / "meta", index_dir / "bm25"
+    written: List[str] = []
+
+    if not has_chunk_store(meta_dir) and (meta_dir / "chunks.jsonl").exists():
+        writer = ChunkStoreWriter(meta_dir)
+        for _, _, row in iter_jsonl_spans(meta_dir / "chunks.jsonl"):
+            writer.add(Chunk(**row))
+        writer.close()
+        written.append("meta/chunks.* (columnar chunk store)")
+
+    if not has_filter_index(meta_dir) and has_chunk_store(meta_dir):
+        write_filter_index(meta_dir, load_chunks(meta_dir))
+        written.append("meta/filter.* (metadata filter postings)")
+
+    if not has_inverted_index(bm25_dir) and (bm25_dir / "corpus.json").exists():
+        # Legacy index: the inverted index would otherwise be derived from corpus.json in every worker
+        load_bm25(bm25_dir).save(bm25_dir)
+        written.append("bm25/ (inverted index)")
+    elif has_inverted_index(bm25_dir):
+        if not all((bm25_dir / name).exists() for name in VOCAB_FILES):
+            if MappedVocab.write(bm25_dir, read_json(bm25_dir / "vocab.json")["terms"]):
+                written.extend(f"bm25/{name}" for name in VOCAB_FILES)
+        if not (bm25_dir / "term_max.npy").exists():
+            np.save(bm25_dir / "term_max.npy", np.asarray(InvertedBM25.load(bm25_dir).term_max, dtype=np.float64))
+            written.append("bm25/term_max.npy")
+    return written
+
+
+def warm_page_cache(index_dir: Path) -> Dict[str, int]:
+    """Ask the kernel to read every index artifact into the page cache (workers then map resident pages)."""
+    files, size = 0, 0
+    for sub in ("meta", "embeddings", "bm25"):
+        d = Path(index_dir) / sub
+        if not d.is_dir():
+            continue
+        for path in d.iterdir():
+            if not path.is_file():
+                continue
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if hasattr(os, "posix_fadvise"):
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            finally:
+                os.close(fd)
+            files += 1
+            size += path.stat().st_size
+    return {"files": files, "bytes": size}
@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import importlib
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from types import ModuleType
+from typing import TYPE_CHECKING, Dict, Iterator, List
+
+if TYPE_CHECKING:
+    from .config import RAGConfig
+
+# Named startup steps (heavy imports, index load, model load, warm-up) in the order they finished
+_steps: List[Dict] = []
+_lock = threading.Lock()
+
+
+def record_step(name: str, seconds: float) -> None:
+    with _lock:
+        _steps.append({"step": name, "seconds": round(seconds, 4)})
+
+
+@contextmanager
+def timed_step(name: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        record_step(f"{name} (failed)", time.perf_counter() - started)
+        raise
+    record_step(name, time.perf_counter() - started)
+
+
+def timed_import(module: str) -> ModuleType:
+    # Imports module on first use, recording what that cost; later calls are a sys.modules lookup
+    loaded = sys.modules.get(module)
+    if loaded is not None:
+        return loaded
+    with timed_step(f"import {module}"):
+        return importlib.import_module(module)
+
+
+def startup_report() -> List[Dict]:
+    with _lock:
+        return list(_steps)
+
+
+def reset_startup_report() -> None:
+    with _lock:
+        _steps.clear()
+
+
+# Imported in this order by measure_startup; each line is the incremental cost given the ones before it
+HEAVY_IMPORTS = ("numpy", "rag.retrieve", "rag.index", "openai", "sentence_transformers")
+
+
+def measure_startup(config: RAGConfig, query: str = "warm up") -> List[Dict]:
+    """Cold-start cost of this process: heavy imports, index load, model load + warm-up, first and second query."""
+    from dataclasses import replace
+
+    reset_startup_report()
+    for module in HEAVY_IMPORTS:
+        try:
+            timed_import(module)
+        except ImportError:
+            record_step(f"import {module} (not installed)", 0.0)
+
+    from .retrieve import get_loaded_index, retrieve
+
+    with timed_step("load index"):
+        index = get_loaded_index(config)
+    if index.vectors is not None and len(index.vectors):
+        try:
+            from .embeddings import warm_up
+            warm_up(index.embedding_model_name)
+        except Exception:
+            config = replace(config, k_vector=0)
+    else:
+        config = replace(config, k_vector=0)
+    with timed_step("first query"):
+        retrieve(config, query)
+    with timed_step("second query"):
+        retrieve(config, query)
+    return startup_report()
@@ -11,6 +11,8 @@ class Document:
     title: Optional[str] = None
     fetched_at: Optional[str] = None  # ISO timestamp if fetched from URL
     checksum: Optional[str] = None
+    etag: Optional[str] = None  # HTTP validators for conditional re-fetches of URLs
+    last_modified: Optional[str] = None
 
 
 @dataclass
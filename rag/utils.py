@@ -4,6 +4,7 @@ import hashlib
 from pathlib import Path
 from typing import Iterable, List, Dict, Generator, Tuple
 from dataclasses import asdict
+import numpy as np
 import orjson
 
 WORD_RE = re.compile(r"\w+", re.UNICODE)
@@ -56,6 +57,43 @@ def read_jsonl(path: Path) -> List[Dict]:
     return out
 
 
+def iter_jsonl_spans(path: Path) -> Generator[Tuple[int, int, Dict], None, None]:
+    # (start byte, end byte, row) per non-empty line, so rows can be re-read later without holding them
+    offset = 0
+    with path.open("rb") as f:
+        for line in f:
+            start, offset = offset, offset + len(line)
+            if line.strip():
+                yield start, offset, orjson.loads(line)
+
+
+def read_jsonl_span(path: Path, start: int, end: int) -> List[Dict]:
+    with path.open("rb") as f:
+        f.seek(start)
+        return [orjson.loads(line) for line in f.read(end - start).splitlines() if line.strip()]
+
+
+class JsonlWriter:
+    """Appends rows to a JSONL file as they are produced."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = path.open("wb")
+
+    def write(self, row: Dict) -> None:
+        self._f.write(orjson.dumps(row))
+        self._f.write(b"\n")
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "JsonlWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
 def iter_files(paths: List[Path], allowed_exts: Tuple[str, ...]) -> Generator[Path, None, None]:
     seen = set()
     for p in paths:
@@ -72,6 +110,35 @@ def iter_files(paths: List[Path], allowed_exts: Tuple[str, ...]) -> Generator[Pa
                         yield fpath
 
 
+def topk_indices(scores: np.ndarray, k: int, largest: bool = True) -> List[int]:
+    if len(scores) == 0:
+        return []
+    if k >= len(scores):
+        idx = np.argsort(scores)
+        return idx[::-1].tolist() if largest else idx.tolist()
+    if largest:
+        idx = np.argpartition(scores, -k)[-k:]
+        return idx[np.argsort(scores[idx])][::-1].tolist()
+    else:
+        idx = np.argpartition(scores, k)[:k]
+        return idx[np.argsort(scores[idx])].tolist()
+
+
+def topk_rows(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    # Row-wise top-k of a (num_queries, num_items) matrix: (indices, values), each row sorted descending
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty
+    if k < scores.shape[1]:
+        idx = np.argpartition(scores, -k, axis=1)[:, -k:]
+    else:
+        idx = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    vals = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
 def chunk_text_by_words(text: str, max_words: int, overlap_words: int) -> List[str]:
     tokens = tokenize(text)
     if not tokens:
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import struct
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .utils import topk_rows
+
+EMBEDDING_STORAGES = ("float32", "float16", "int8")
+
+# Rows of the stored matrix upcast/scored at once; bounds the float32 working set for quantized storage
+ROW_BLOCK = 1 << 16
+# Upper bound on the (queries x rows) score block held in memory at once
+SCORE_BLOCK = 1 << 24
+# Fixed .npy header size used by NpyAppender, so the final shape can be written in place
+NPY_HEADER_BYTES = 128
+
+
+def quantized_path(emb_dir: Path, storage: str) -> Path:
+    return emb_dir / f"embeddings.{storage}.npy"
+
+
+def scales_path(emb_dir: Path) -> Path:
+    return emb_dir / "embeddings.int8.scales.npy"
+
+
+def quantize(embs: np.ndarray, storage: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    # Returns (stored matrix, per-row scales or None); row i decodes to stored[i] * scales[i]
+    if storage not in EMBEDDING_STORAGES:
+        raise ValueError(f"Unknown embedding storage: {storage!r} (expected one of {EMBEDDING_STORAGES})")
+    embs = np.asarray(embs, dtype=np.float32)
+    if storage == "float32":
+        return embs, None
+    if storage == "float16":
+        return embs.astype(np.float16), None
+    scales = np.abs(embs).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    q = np.clip(np.rint(embs / scales[:, None]), -127, 127).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def _remove_stale_copies(emb_dir: Path, storage: str) -> None:
+    for other in EMBEDDING_STORAGES[1:]:
+        if other != storage:
+            quantized_path(emb_dir, other).unlink(missing_ok=True)
+    if storage != "int8":
+        scales_path(emb_dir).unlink(missing_ok=True)
+
+
+def write_quantized(emb_dir: Path, storage: str) -> None:
+    # Derives the float16/int8 copy from embeddings.npy in row blocks (preallocated memmaps, flat memory)
+    _remove_stale_copies(emb_dir, storage)
+    if storage == "float32":
+        return
+    exact = np.load(emb_dir / "embeddings.npy", mmap_mode="r")
+    dtype = np.float16 if storage == "float16" else np.int8
+    out = np.lib.format.open_memmap(quantized_path(emb_dir, storage), mode="w+", dtype=dtype, shape=exact.shape)
+    scales = np.lib.format.open_memmap(scales_path(emb_dir), mode="w+", dtype=np.float32, shape=(exact.shape[0],)) if storage == "int8" else None
+    for start in range(0, exact.shape[0], ROW_BLOCK):
+        q, s = quantize(exact[start:start + ROW_BLOCK], storage)
+        out[start:start + len(q)] = q
+        if scales is not None:
+            scales[start:start + len(q)] = s
+    out.flush()
+    del out
+    if scales is not None:
+        scales.flush()
+        del scales
+
+
+class NpyAppender:
+    """Writes an .npy block by block when the row count is not known up front."""
+
+    def __init__(self, path: Path, dtype=np.float32):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.row_shape: Optional[Tuple[int, ...]] = None
+        self._f = path.open("wb")
+        self._f.write(b"\0" * NPY_HEADER_BYTES)
+
+    def append(self, block: np.ndarray) -> None:
+        block = np.ascontiguousarray(block, dtype=self.dtype)
+        if self.row_shape is None:
+            self.row_shape = block.shape[1:]
+        elif block.shape[1:] != self.row_shape:
+            raise ValueError(f"Row shape changed from {self.row_shape} to {block.shape[1:]}")
+        self._f.write(block.tobytes())
+        self.rows += block.shape[0]
+
+    def close(self) -> None:
+        # Rewrites the reserved header with the final shape; np.load / mmap read the result as usual
+        shape = (self.rows,) + (self.row_shape or ())
+        header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (self.dtype.str, shape)
+        header = header.ljust(NPY_HEADER_BYTES - 11) + "\n"
+        self._f.seek(0)
+        self._f.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1"))
+        self._f.close()
+
+
+class EmbeddingStore:
+    """Memory-mapped chunk embeddings, optionally scored from a float16/int8 copy."""
+
+    def __init__(self, exact: np.ndarray, stored: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None, storage: str = "float32"):
+        self.exact = exact
+        self.stored = stored if stored is not None else exact
+        self.scales = scales
+        self.storage = storage
+
+    @classmethod
+    def load(cls, emb_dir: Path) -> Optional["EmbeddingStore"]:
+        exact_path = emb_dir / "embeddings.npy"
+        if not exact_path.exists():
+            return None
+        exact = np.load(exact_path, mmap_mode="r")
+        if quantized_path(emb_dir, "int8").exists() and scales_path(emb_dir).exists():
+            return cls(exact, np.load(quantized_path(emb_dir, "int8"), mmap_mode="r"), np.load(scales_path(emb_dir), mmap_mode="r"), "int8")
+        if quantized_path(emb_dir, "float16").exists():
+            return cls(exact, np.load(quantized_path(emb_dir, "float16"), mmap_mode="r"), None, "float16")
+        return cls(exact)
+
+    def __len__(self) -> int:
+        return int(self.stored.shape[0])
+
+    def score_rows(self, query_embs: np.ndarray, start: int, end: int) -> np.ndarray:
+        # Cosine scores of queries against stored rows [start, end), computed on the stored form
+        block = self.stored[start:end]
+        if block.dtype != np.float32:
+            block = block.astype(np.float32)
+        scores = query_embs @ block.T
+        if self.scales is not None:
+            scores *= self.scales[start:end]
+        return scores
+
+    def score_id_rows(self, query_embs: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        # Cosine scores of queries against an arbitrary subset of rows (Q, len(ids)), on the stored form
+        rows = np.asarray(self.stored[ids], dtype=np.float32)
+        scores = query_embs @ rows.T
+        if self.scales is not None:
+            scores *= self.scales[ids]
+        return scores
+
+    def score_ids(self, query_emb: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        # Cosine scores of one query against an arbitrary subset of rows, on the stored form
+        return self.score_id_rows(query_emb[None, :], ids)[0]
+
+    def rescore(self, query_embs: np.ndarray, idx: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Exact float32 scores for (Q, R) candidate ids, cut to the best top_k per query
+        exact_rows = np.asarray(self.exact[idx.ravel()], dtype=np.float32).reshape(idx.shape + (-1,))
+        exact_scores = np.einsum("qd,qkd->qk", query_embs, exact_rows)
+        pos, vals = topk_rows(exact_scores, top_k)
+        return np.take_along_axis(idx, pos, axis=1), vals
+
+    def search(
+        self,
+        query_embs: np.ndarray,
+        top_k: int,
+        rescore_k: int = 0,
+        allowed: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        # (Q, k) top indices and scores. With rescore_k > top_k on quantized storage, the best rescore_k
+        # candidates are rescored exactly against the float32 rows before cutting to top_k.
+        # allowed (boolean mask over rows, see rag.filters) restricts the search: a sparse mask gathers and
+        # scores only its rows; a dense one keeps the contiguous block scan and masks the other scores out.
+        query_embs = np.asarray(query_embs, dtype=np.float32)
+        n_queries, n_rows = query_embs.shape[0], len(self)
+        ids = None
+        n_candidates = n_rows
+        if allowed is not None:
+            ids = np.flatnonzero(allowed)
+            n_candidates = len(ids)
+            if n_candidates * 2 > n_rows:
+                ids = None
+        if n_candidates == 0 or n_queries == 0 or top_k <= 0:
+            empty = np.zeros((n_queries, 0))
+            return empty.astype(np.int64), empty
+        rescore = self.stored is not self.exact and rescore_k > top_k
+        k = min(rescore_k if rescore else top_k, n_candidates)
+
+        query_rows = max(1, SCORE_BLOCK // min(n_candidates, ROW_BLOCK))
+        idx_parts, score_parts = [], []
+        for qs in range(0, n_queries, query_rows):
+            q = query_embs[qs:qs + query_rows]
+            best_idx, best_scores = [], []
+            for start in range(0, n_candidates if ids is not None else n_rows, ROW_BLOCK):
+                if ids is not None:
+                    block_ids = ids[start:start + ROW_BLOCK]
+                    idx, vals = topk_rows(self.score_id_rows(q, block_ids), k)
+                    best_idx.append(block_ids[idx])
+                else:
+                    end = min(start + ROW_BLOCK, n_rows)
+                    scores = self.score_rows(q, start, end)
+                    if allowed is not None:
+                        scores[:, ~allowed[start:end]] = -np.inf
+                    idx, vals = topk_rows(scores, k)
+                    best_idx.append(idx + start)
+                best_scores.append(vals)
+            if len(best_idx) == 1:
+                idx, vals = best_idx[0], best_scores[0]
+            else:
+                merged_idx = np.hstack(best_idx)
+                pos, vals = topk_rows(np.hstack(best_scores), k)
+                idx = np.take_along_axis(merged_idx, pos, axis=1)
+            if rescore:
+                idx, vals = self.rescore(q, idx, top_k)
+            idx_parts.append(idx)
+            score_parts.append(vals)
+        return np.vstack(idx_parts), np.vstack(score_parts)
@@ -4,12 +4,17 @@ Working RAG + OpenAI Chat Integration
 Uses existing embeddings without regenerating them.
 """
 
+import asyncio
 import os
+import re
 import sys
 import json
-import numpy as np
+import time
+from concurrent.futures import Executor
+from dataclasses import replace
+from functools import partial
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 
 # Load environment variables from .env file
 try:
@@ -19,171 +24,189 @@ except ImportError:
     print("Warning: python-dotenv not installed. Install with: pip install python-dotenv")
 
 try:
-    from openai import OpenAI
-except ImportError:
-    print("Error: OpenAI package not installed. Run: pip install openai")
-    sys.exit(1)
+    from openai import AsyncOpenAI, OpenAI
+except ImportError as exc:
+    # Raised rather than sys.exit, so importers (server, rag bench) can handle it
+    raise ImportError("OpenAI package not installed. Run: pip install openai") from exc
 
 # Add the rag module to the path
 sys.path.append(str(Path(__file__).parent))
 
+from rag.cache import AnswerCache
 from rag.config import RAGConfig
-from rag.types import ScoredChunk, SignalScores
-from rag.utils import read_json, read_jsonl, tokenize
-from rank_bm25 import BM25Okapi
+from rag.context import CONTEXT_TOKEN_BUDGET, PackedContext, get_token_counter, pack_context
+from rag.metrics import REGISTRY, StageClock
+from rag.retrieve import LoadedIndex, get_loaded_index, index_signature, retrieve
+from rag.startup import timed_step
+from rag.types import ScoredChunk
+
+
+SYSTEM_PROMPT = "You are a Josh, a friendly sales assistant for an AI Software Development Company that provides accurate, cited answers based on what you know from provided documents."
+MESSAGE_SYSTEM_PROMPT = "You are a simple message generator. Write a short message (1-2 sentences) for someone interested in a chatbot project. Do not reference any documents, sources, or external information. Do not include citations or sources. Just write a simple, natural message."
+# UI tags the prompt asks the model to append (see samples/user_flows.md); the last one in an answer wins
+UI_TAG_RE = re.compile(r"\[(contact_form|book_demo|button_group_[a-z_]+)\]")
+
+
+def extract_ui_tag(answer: str) -> Optional[str]:
+    tags = UI_TAG_RE.findall(answer or "")
+    return tags[-1] if tags else None
+
+
+# Aggregated over every request in this process and served by /metrics (see rag.metrics)
+CHAT_STAGE_SECONDS = REGISTRY.histogram(
+    "chat_stage_seconds",
+    "Time per chat stage (cache_lookup, retrieve, prompt, llm_queue, llm, first_token, total)",
+    ("mode", "stage"),
+)
+CHAT_REQUESTS = REGISTRY.counter(
+    "chat_requests_total", "Chat requests by mode (sync, async, stream, message) and outcome", ("mode", "outcome")
+)
+ANSWER_CACHE_LOOKUPS = REGISTRY.counter("chat_answer_cache_lookups_total", "Answer cache lookups by result", ("result",))
+LLM_WAITING = REGISTRY.gauge("chat_llm_waiting", "Requests waiting for an LLM concurrency slot")
+LLM_IN_FLIGHT = REGISTRY.gauge("chat_llm_in_flight", "Upstream LLM calls in flight")
+CONTEXT_TOKENS = REGISTRY.histogram(
+    "chat_context_tokens", "Prompt context tokens per LLM call", buckets=(250, 500, 1000, 1500, 2000, 4000, 8000)
+)
 
 
 class WorkingRAGChatBot:
-    def __init__(self, index_dir: str, api_key: str = None, model: str = "gpt-3.5-turbo"):
+    def __init__(
+        self,
+        index_dir: str,
+        api_key: str = None,
+        model: str = "gpt-3.5-turbo",
+        config: RAGConfig | None = None,
+        llm_max_concurrency: int = 16,
+        llm_timeout: float | None = 60.0,
+        answer_cache_size: int = 1024,
+        answer_cache_ttl: float = 3600.0,
+        answer_cache_similarity: float = 0.0,
+        include_timings: bool = False,
+        context_token_budget: int = CONTEXT_TOKEN_BUDGET,
+    ):
         """Initialize the working RAG chatbot."""
         self.index_dir = Path(index_dir)
         self.model = model
+        self.config = config or RAGConfig(index_dir=self.index_dir)
+        self.vector_search_enabled = False
         
-        # Initialize OpenAI client
-        if api_key:
-            self.client = OpenAI(api_key=api_key)
-        else:
+        # Initialize OpenAI clients (blocking for chat(), async for achat(); OPENAI_BASE_URL is honoured by both)
+        if not api_key:
             api_key = os.getenv("OPENAI_API_KEY")
             if not api_key:
                 raise ValueError("OpenAI API key not found. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
-            self.client = OpenAI(api_key=api_key)
+        self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
+        
+        # Async path: at most llm_max_concurrency upstream calls in flight; llm_timeout covers queueing + the call
+        self.llm_timeout = llm_timeout
+        self.llm_semaphore = asyncio.Semaphore(max(1, llm_max_concurrency))
+        
+        # Answers keyed by normalized query + model + context size + session selections; hits skip retrieval and
+        # the LLM. answer_cache_similarity > 0 also serves near-duplicate queries (needs vector search).
+        self.answer_cache = AnswerCache(maxsize=answer_cache_size, ttl=answer_cache_ttl, similarity_threshold=answer_cache_similarity)
+        
+        # Stage timings are always aggregated into metrics; include_timings also returns them per request
+        # as retrieval_metadata["timings"] ("<stage>_seconds", retrieval stages from rag.retrieve included)
+        self.include_timings = include_timings
+        
+        # Prompt context is packed in rank order into context_token_budget tokens of the model's tokenizer
+        # (estimated without tiktoken), without text repeated across chunks (see rag.context); <= 0 = no limit.
+        # The tokenizer is looked up per pack (cached per model), so a model override applies to counting too.
+        self.context_token_budget = context_token_budget
         
         # Load the existing index
         self._load_index()
     
     def _load_index(self):
-        """Load the existing RAG index."""
+        """Load the existing RAG index and warm up the query encoder."""
         print("📚 Loading RAG index...")
+        with timed_step("load index"):
+            index = self._index()
+        print(f"✅ Loaded {len(index.chunks)} chunks, embeddings: {index.embeddings.shape if index.embeddings is not None else 'None'}")
+        self.warm_up()
+    
+    def _index(self) -> LoadedIndex:
+        """Shared process-wide index; reloaded by the registry when the artifacts change."""
+        return get_loaded_index(self.config)
+    
+    @property
+    def chunks(self):
+        return self._index().chunks
+    
+    @property
+    def embeddings(self):
+        return self._index().embeddings
+    
+    @property
+    def bm25(self):
+        return self._index().bm25
+    
+    @property
+    def retrieval_method(self) -> str:
+        return "hybrid" if self.vector_search_enabled else "bm25_only"
+    
+    def warm_up(self) -> None:
+        """Load the embedding model named in meta/config.json, then run a dummy query, so requests never pay for either."""
+        index = self._index()
+        self.vector_search_enabled = False
+        if index.vectors is not None and len(index.vectors):
+            try:
+                from rag.embeddings import warm_up
+                warm_up(index.embedding_model_name)
+                self.vector_search_enabled = True
+                print(f"🔥 Embedding model ready: {index.embedding_model_name}")
+            except Exception as e:
+                print(f"⚠️ Could not load embedding model {index.embedding_model_name} ({e}); using BM25-only retrieval")
+        # Full retrieval path once (BM25, vector, fusion, chunk store); first-touch costs land here, not on a user
+        with timed_step("warm-up query"):
+            self.retrieve_context("warm up")
+    
+    def retrieve_context(self, query: str, k_bm25: int | None = None, k_vector: int | None = None, k_fused: int | None = None, timings: Dict[str, float] | None = None, filter_expr: str | None = None) -> List[Dict[str, Any]]:
+        """Retrieve relevant chunks with hybrid BM25 + vector search fused by RRF (see rag.retrieve).
         
-        # Load chunks
-        chunks_path = self.index_dir / "meta" / "chunks.jsonl"
-        self.chunks = []
-        for row in read_jsonl(chunks_path):
-            self.chunks.append({
-                'chunk_id': row['chunk_id'],
-                'document_source_id': row['document_source_id'],
-                'document_uri': row['document_uri'],
-                'document_type': row['document_type'],
-                'content': row['content'],
-                'chunk_index': row['chunk_index'],
-                'checksum': row['checksum'],
-                'extra': row.get('extra', {})
-            })
-        
-        # Load embeddings
-        embeddings_path = self.index_dir / "embeddings" / "embeddings.npy"
-        if embeddings_path.exists():
-            self.embeddings = np.load(embeddings_path)
-        else:
-            self.embeddings = None
-        
-        # Load BM25
-        bm25_path = self.index_dir / "bm25" / "corpus.json"
-        bm25_corpus = read_json(bm25_path)
-        tokenized_corpus = [tokenize(doc) for doc in bm25_corpus["documents"]]
-        self.bm25 = BM25Okapi(tokenized_corpus)
-        self.bm25_chunk_ids = bm25_corpus["chunk_ids"]
-        
-        print(f"✅ Loaded {len(self.chunks)} chunks, embeddings: {self.embeddings.shape if self.embeddings is not None else 'None'}")
-    
-    def topk_indices(self, scores: np.ndarray, k: int, largest: bool = True) -> List[int]:
-        """Get top-k indices from scores."""
-        if len(scores) == 0:
-            return []
-        if k >= len(scores):
-            idx = np.argsort(scores)
-            return idx[::-1].tolist() if largest else idx.tolist()
-        if largest:
-            idx = np.argpartition(scores, -k)[-k:]
-            return idx[np.argsort(scores[idx])][::-1].tolist()
-        else:
-            idx = np.argpartition(scores, k)[:k]
-            return idx[np.argsort(scores[idx])].tolist()
-    
-    def reciprocal_rank_fusion(self, ranks: Dict[str, int], k: int) -> float:
-        """Calculate reciprocal rank fusion score."""
-        score = 0.0
-        for _, r in ranks.items():
-            if r is not None:
-                score += 1.0 / (k + r)
-        return score
-    
-    def retrieve_context(self, query: str, k_bm25: int = 8, k_vector: int = 8, k_fused: int = 8) -> List[Dict[str, Any]]:
-        """Retrieve relevant chunks using the existing index."""
+        filter_expr restricts retrieval to matching chunks before scoring (see rag.filters), e.g.
+        'document_type = url and uri ^= "https://docs.example.com/"'.
+        Per-stage seconds are added to `timings` when it is given.
+        """
         print(f"🔍 Searching for: '{query}'")
         
-        # BM25 search
-        bm25_scores = self.bm25.get_scores(tokenize(query))
-        bm25_top_idx = self.topk_indices(np.array(bm25_scores), k_bm25, largest=True)
-        
-        # Vector search (if embeddings available)
-        vector_scores = np.array([])
-        vector_top_idx = []
-        if self.embeddings is not None:
-            # For now, we'll skip vector search to avoid embedding generation issues
-            # In a real implementation, you'd generate query embeddings here
-            pass
-        
-        # Create rank maps
-        bm25_rank_map = {i: rank for rank, i in enumerate(bm25_top_idx)}
-        vector_rank_map = {i: rank for rank, i in enumerate(vector_top_idx)}
-        
-        # Union of candidates
-        candidate_idxs = sorted(set(bm25_top_idx) | set(vector_top_idx))
-        
-        # Fuse rankings
-        fused_results = []
-        for idx in candidate_idxs:
-            bm25_rank = bm25_rank_map.get(idx)
-            vec_rank = vector_rank_map.get(idx)
-            
-            rranks = {}
-            if bm25_rank is not None:
-                rranks["bm25"] = bm25_rank
-            if vec_rank is not None:
-                rranks["vector"] = vec_rank
-            
-            fused_score = self.reciprocal_rank_fusion(rranks, 60)  # RRF k=60
-            
-            result = {
-                'chunk': self.chunks[idx],
-                'fused_score': fused_score,
-                'bm25_score': float(bm25_scores[idx]) if idx < len(bm25_scores) else None,
-                'bm25_rank': (bm25_rank + 1) if bm25_rank is not None else None,
-                'vector_score': None,  # Skipped for now
-                'vector_rank': None,
-            }
-            fused_results.append((idx, fused_score, result))
-        
-        # Sort by fused score and return top-k
-        fused_results.sort(key=lambda x: x[1], reverse=True)
-        return [result for _, _, result in fused_results[:k_fused]]
+        config = replace(
+            self.config,
+            k_bm25=k_bm25 if k_bm25 is not None else self.config.k_bm25,
+            k_vector=(k_vector if k_vector is not None else self.config.k_vector) if self.vector_search_enabled else 0,
+            k_fused=k_fused if k_fused is not None else self.config.k_fused,
+        )
+        return [self._result_dict(r) for r in retrieve(config, query, timings, filter_expr)]
+    
+    def _result_dict(self, result: ScoredChunk) -> Dict[str, Any]:
+        chunk = result.chunk
+        return {
+            'chunk': {
+                'chunk_id': chunk.chunk_id,
+                'document_source_id': chunk.document_source_id,
+                'document_uri': chunk.document_uri,
+                'document_type': chunk.document_type,
+                'content': chunk.content,
+                'chunk_index': chunk.chunk_index,
+                'checksum': chunk.checksum,
+                'extra': chunk.extra,
+            },
+            'fused_score': result.fused_score,
+            'bm25_score': result.signals.bm25_score,
+            'bm25_rank': result.signals.bm25_rank,
+            'vector_score': result.signals.vector_score,
+            'vector_rank': result.signals.vector_rank,
+        }
+    
+    def pack_context(self, chunks: List[Dict[str, Any]], model: str | None = None) -> PackedContext:
+        """Pack retrieved chunks (best first) into the context token budget of `model` (default: self.model); see rag.context."""
+        counter = get_token_counter(model or self.model)
+        return pack_context([c['chunk'] for c in chunks], counter, self.context_token_budget)
     
     def format_context_for_llm(self, chunks: List[Dict[str, Any]]) -> str:
         """Format retrieved chunks into context for the LLM."""
-        if not chunks:
-            return "No relevant information found."
-        
-        context_blocks = []
-        
-        for i, chunk_data in enumerate(chunks, 1):
-            chunk = chunk_data['chunk']
-            source_title = chunk['extra'].get("source_title", "Unknown")
-            chunk_index = chunk['chunk_index']
-            checksum = chunk['checksum'][:8]
-            
-            bm25_score_str = f"{chunk_data['bm25_score']:.3f}" if chunk_data['bm25_score'] is not None else 'N/A'
-            vector_score_str = f"{chunk_data['vector_score']:.3f}" if chunk_data['vector_score'] is not None else 'N/A'
-            
-            context_block = f"""[{i}] {source_title} — chunk #{chunk_index}
-   checksum: {checksum}
-   bm25_score: {bm25_score_str}
-   vector_score: {vector_score_str}
-   content: {chunk['content'][:500]}{'...' if len(chunk['content']) > 500 else ''}"""
-            
-            context_blocks.append(context_block)
-        
-        return "\n\n".join(context_blocks)
+        return self.pack_context(chunks).text
     
     def create_prompt(self, query: str, context: str, user_context: str | None = None) -> str:
         """Create the prompt for the LLM with context, optional user context, and instructions."""
@@ -213,122 +236,412 @@ Instructions:
 
 Answer:"""
     
-    def chat(self, query: str, max_context_chunks: int = 5, user_context: str | None = None) -> Dict[str, Any]:
+    def _no_results(self, query: str) -> Dict[str, Any]:
+        return {
+            "answer": "I couldn't find any relevant information in the available documents.",
+            "citations": [],
+            "retrieval_metadata": {
+                "query": query,
+                "chunks_found": 0,
+                "retrieval_method": self.retrieval_method
+            }
+        }
+    
+    def _chat_messages(self, query: str, context_chunks: List[Dict[str, Any]], user_context: str | None) -> Tuple[List[Dict[str, str]], PackedContext]:
+        # Pack context for LLM and create prompt; only packed chunks are cited (packed.used, in [n] order)
+        packed = self.pack_context(context_chunks)
+        CONTEXT_TOKENS.observe(packed.tokens)
+        prompt = self.create_prompt(query, packed.text, user_context=user_context)
+        print(f"📝 Generating answer using {len(packed.used)} relevant sources ({packed.tokens} context tokens)...")
+        messages = [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+        return messages, packed
+    
+    def _citations(self, context_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        citations = []
+        for chunk_data in context_chunks:
+            chunk = chunk_data['chunk']
+            source_title = chunk['extra'].get("source_title", "Unknown")
+            citations.append({
+                "source_title": source_title,
+                "document_uri": chunk['document_uri'],
+                "chunk_index": chunk['chunk_index'],
+                "checksum": chunk['checksum'],
+                "bm25_score": chunk_data['bm25_score'],
+                "vector_score": chunk_data['vector_score'],
+                "fused_score": chunk_data['fused_score'],
+                "snippet": chunk['content'][:200] + "..." if len(chunk['content']) > 200 else chunk['content']
+            })
+        return citations
+    
+    def _answer(self, query: str, answer: str, chunks: List[Dict[str, Any]], context_chunks: List[Dict[str, Any]], packed: PackedContext) -> Dict[str, Any]:
+        context_chunks = [context_chunks[i] for i in packed.used]
+        return {
+            "answer": answer,
+            "citations": self._citations(context_chunks),
+            "retrieval_metadata": {
+                "query": query,
+                "chunks_found": len(chunks),
+                "chunks_used": len(context_chunks),
+                "context_tokens": packed.tokens,
+                "retrieval_method": self.retrieval_method,
+                "model_used": self.model
+            }
+        }
+    
+    def _error(self, query: str, prefix: str, error: Exception) -> Dict[str, Any]:
+        message = f"LLM request timed out after {self.llm_timeout}s" if isinstance(error, TimeoutError) else str(error)
+        metadata: Dict[str, Any] = {"query": query, "error": message}
+        if isinstance(error, TimeoutError):
+            metadata["timed_out"] = True
+        return {"answer": f"{prefix}: {message}", "citations": [], "retrieval_metadata": metadata}
+    
+    def _answer_cache_key(self, query: str, max_context_chunks: int, user_context: str | None, filter_expr: str | None = None) -> tuple:
+        return AnswerCache.key(query, (self.model, max_context_chunks, user_context or "", filter_expr or ""))
+    
+    def _query_embedding(self, query: str):
+        from rag.embeddings import embed_queries
+        return embed_queries([query], self._index().embedding_model_name)[0]
+    
+    def _cached_answer(self, query: str, key: tuple) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+        """Cached result for this key (or a near-duplicate query), or None on a miss, plus the index signature.
+        
+        Hits are flagged in retrieval_metadata. The signature is passed on to _cache_answer, so a request
+        stats the index files once for the answer cache.
+        """
+        if not self.answer_cache.enabled:
+            return None, None
+        signature = index_signature(self.index_dir)
+        embed = (lambda: self._query_embedding(query)) if self.vector_search_enabled else None
+        found = self.answer_cache.lookup(key, signature, embed)
+        if found is None:
+            ANSWER_CACHE_LOOKUPS.inc(result="miss")
+            return None, signature
+        result, similarity = found
+        ANSWER_CACHE_LOOKUPS.inc(result="exact" if similarity is None else "similar")
+        metadata = result["retrieval_metadata"]
+        metadata["cached_query"] = metadata.get("query")
+        metadata["query"] = query
+        metadata["answer_cache"] = "exact" if similarity is None else "similar"
+        if similarity is not None:
+            metadata["answer_cache_similarity"] = round(similarity, 4)
+        return result, signature
+    
+    def _cache_answer(self, query: str, key: tuple, signature: Optional[tuple], result: Dict[str, Any]) -> None:
+        # Only generated answers are cached; per-request timings are not part of the cached copy
+        if not self.answer_cache.enabled or signature is None or "error" in result["retrieval_metadata"]:
+            return
+        metadata = {k: v for k, v in result["retrieval_metadata"].items() if not k.endswith("_seconds") and k not in ("answer_cache", "timings")}
+        query_emb = self._query_embedding(query) if self.vector_search_enabled and self.answer_cache.similarity_threshold > 0 else None
+        self.answer_cache.put(key, signature, {**result, "retrieval_metadata": metadata}, query_emb)
+        result["retrieval_metadata"]["answer_cache"] = "miss"
+    
+    def _timings(self) -> Optional[Dict[str, float]]:
+        return {} if self.include_timings else None
+    
+    def _finish(self, mode: str, outcome: str, clock: StageClock, started: float, timings: Optional[Dict[str, float]], metadata: Optional[Dict[str, Any]] = None) -> None:
+        """Record stage times and the request outcome; with include_timings also put them in metadata."""
+        clock.stages["total"] = time.perf_counter() - started
+        CHAT_STAGE_SECONDS.observe_many(((mode, stage), seconds) for stage, seconds in clock.stages.items())
+        CHAT_REQUESTS.inc(mode=mode, outcome=outcome)
+        if timings is not None and metadata is not None:
+            for stage, seconds in clock.stages.items():
+                timings[f"{stage}_seconds"] = round(seconds, 6)
+            metadata["timings"] = timings
+    
+    @staticmethod
+    def _outcome(result: Dict[str, Any]) -> str:
+        metadata = result["retrieval_metadata"]
+        if "error" in metadata:
+            return "timeout" if metadata.get("timed_out") else "error"
+        if "answer_cache" in metadata and metadata["answer_cache"] != "miss":
+            return "cached"
+        return "answered" if metadata.get("chunks_found", 1) else "no_results"
+    
+    def chat(self, query: str, max_context_chunks: int = 5, user_context: str | None = None, filter_expr: str | None = None) -> Dict[str, Any]:
         """Process a query using RAG + OpenAI with optional user context for personalization."""
+        started, clock, timings = time.perf_counter(), StageClock(), self._timings()
+        result = self._chat(query, max_context_chunks, user_context, clock, timings, filter_expr)
+        self._finish("sync", self._outcome(result), clock, started, timings, result["retrieval_metadata"])
+        return result
+    
+    def _chat(self, query: str, max_context_chunks: int, user_context: str | None, clock: StageClock, timings: Optional[Dict[str, float]], filter_expr: str | None = None) -> Dict[str, Any]:
+        key = self._answer_cache_key(query, max_context_chunks, user_context, filter_expr)
+        cached, signature = self._cached_answer(query, key)
+        clock.lap("cache_lookup")
+        if cached is not None:
+            return cached
+        
         # Retrieve relevant chunks
-        chunks = self.retrieve_context(query)
+        chunks = self.retrieve_context(query, timings=timings, filter_expr=filter_expr)
+        clock.lap("retrieve")
         
         if not chunks:
-            return {
-                "answer": "I couldn't find any relevant information in the available documents.",
-                "citations": [],
-                "retrieval_metadata": {
-                    "query": query,
-                    "chunks_found": 0,
-                    "retrieval_method": "bm25_only"
-                }
-            }
+            return self._no_results(query)
         
         # Limit context to top chunks
         context_chunks = chunks[:max_context_chunks]
+        messages, packed = self._chat_messages(query, context_chunks, user_context)
+        clock.lap("prompt")
         
-        # Format context for LLM
-        context = self.format_context_for_llm(context_chunks)
-        
-        # Create prompt
-        prompt = self.create_prompt(query, context, user_context=user_context)
-        
-        print(f"📝 Generating answer using {len(context_chunks)} relevant sources...")
-        
+        LLM_IN_FLIGHT.inc()
         try:
             # Call OpenAI API
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a Josh, a friendly sales assistant for an AI Software Development Company that provides accurate, cited answers based on what you know from provided documents."},
-                    {"role": "user", "content": prompt}
-                ],
+                messages=messages,
                 max_tokens=1000,
                 temperature=0.1  # Low temperature for factual responses
             )
             
-            answer = response.choices[0].message.content
-            
-            # Extract citations from answer
-            citations = []
-            for chunk_data in context_chunks:
-                chunk = chunk_data['chunk']
-                source_title = chunk['extra'].get("source_title", "Unknown")
-                citations.append({
-                    "source_title": source_title,
-                    "document_uri": chunk['document_uri'],
-                    "chunk_index": chunk['chunk_index'],
-                    "checksum": chunk['checksum'],
-                    "bm25_score": chunk_data['bm25_score'],
-                    "vector_score": chunk_data['vector_score'],
-                    "fused_score": chunk_data['fused_score'],
-                    "snippet": chunk['content'][:200] + "..." if len(chunk['content']) > 200 else chunk['content']
-                })
-            
-            return {
-                "answer": answer,
-                "citations": citations,
-                "retrieval_metadata": {
-                    "query": query,
-                    "chunks_found": len(chunks),
-                    "chunks_used": len(context_chunks),
-                    "retrieval_method": "bm25_only",
-                    "model_used": self.model
-                }
-            }
-            
         except Exception as e:
-            return {
-                "answer": f"Error generating response: {str(e)}",
-                "citations": [],
-                "retrieval_metadata": {
-                    "query": query,
-                    "error": str(e)
-                }
+            return self._error(query, "Error generating response", e)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            clock.lap("llm")
+        
+        result = self._answer(query, response.choices[0].message.content, chunks, context_chunks, packed)
+        self._cache_answer(query, key, signature, result)
+        return result
+    
+    async def _acquire_llm_slot(self, timeout: Optional[float]) -> None:
+        LLM_WAITING.inc()
+        try:
+            await asyncio.wait_for(self.llm_semaphore.acquire(), timeout)
+        finally:
+            LLM_WAITING.dec()
+    
+    async def _acomplete(self, clock: Optional[StageClock] = None, **kwargs) -> tuple:
+        """Async completion under the concurrency limit; returns (response, queue seconds, LLM seconds)."""
+        queued = time.perf_counter()
+        async with asyncio.timeout(self.llm_timeout):
+            await self._acquire_llm_slot(None)
+            try:
+                started = time.perf_counter()
+                if clock is not None:
+                    clock.lap("llm_queue")
+                LLM_IN_FLIGHT.inc()
+                try:
+                    response = await self.async_client.chat.completions.create(model=self.model, **kwargs)
+                finally:
+                    LLM_IN_FLIGHT.dec()
+                    if clock is not None:
+                        clock.lap("llm")
+            finally:
+                self.llm_semaphore.release()
+        return response, started - queued, time.perf_counter() - started
+    
+    async def achat(self, query: str, max_context_chunks: int = 5, user_context: str | None = None, executor: Optional[Executor] = None, filter_expr: str | None = None) -> Dict[str, Any]:
+        """Async chat(): retrieval runs in `executor` (the loop's default if None), the LLM call on the async client."""
+        started, clock, timings = time.perf_counter(), StageClock(), self._timings()
+        result = await self._achat(query, max_context_chunks, user_context, executor, clock, timings, filter_expr)
+        self._finish("async", self._outcome(result), clock, started, timings, result["retrieval_metadata"])
+        return result
+    
+    async def _achat(self, query: str, max_context_chunks: int, user_context: str | None, executor: Optional[Executor], clock: StageClock, timings: Optional[Dict[str, float]], filter_expr: str | None = None) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        key = self._answer_cache_key(query, max_context_chunks, user_context, filter_expr)
+        cached, signature = await loop.run_in_executor(executor, self._cached_answer, query, key)
+        clock.lap("cache_lookup")
+        if cached is not None:
+            return cached
+        chunks = await loop.run_in_executor(executor, partial(self.retrieve_context, query, timings=timings, filter_expr=filter_expr))
+        clock.lap("retrieve")
+        retrieval_seconds = time.perf_counter() - started
+        
+        if not chunks:
+            return self._no_results(query)
+        
+        context_chunks = chunks[:max_context_chunks]
+        messages, packed = self._chat_messages(query, context_chunks, user_context)
+        clock.lap("prompt")
+        
+        try:
+            response, queue_seconds, llm_seconds = await self._acomplete(
+                clock,
+                messages=messages,
+                max_tokens=1000,
+                temperature=0.1
+            )
+        except Exception as e:
+            return self._error(query, "Error generating response", e)
+        
+        result = self._answer(query, response.choices[0].message.content, chunks, context_chunks, packed)
+        self._cache_answer(query, key, signature, result)
+        result["retrieval_metadata"].update({
+            "retrieval_seconds": round(retrieval_seconds, 4),
+            "llm_queue_seconds": round(queue_seconds, 4),
+            "llm_seconds": round(llm_seconds, 4),
+        })
+        return result
+    
+    async def astream_chat(self, query: str, max_context_chunks: int = 5, user_context: str | None = None, executor: Optional[Executor] = None, filter_expr: str | None = None) -> AsyncIterator[Dict[str, Any]]:
+        """Streaming achat(): yields {"event", "data"} dicts in order retrieval, token..., ui_tag (if any), done.
+        
+        An upstream failure or timeout yields an "error" event instead of "done".
+        """
+        loop = asyncio.get_running_loop()
+        started, clock, timings = time.perf_counter(), StageClock(), self._timings()
+        key = self._answer_cache_key(query, max_context_chunks, user_context, filter_expr)
+        cached, signature = await loop.run_in_executor(executor, self._cached_answer, query, key)
+        clock.lap("cache_lookup")
+        if cached is not None:
+            # Replayed in one token event; same event sequence as a generated answer
+            self._finish("stream", "cached", clock, started, timings, cached["retrieval_metadata"])
+            yield {"event": "retrieval", "data": {"citations": cached["citations"], "retrieval_metadata": cached["retrieval_metadata"]}}
+            yield {"event": "token", "data": {"text": cached["answer"]}}
+            tag = extract_ui_tag(cached["answer"])
+            if tag:
+                yield {"event": "ui_tag", "data": {"tag": tag}}
+            yield {"event": "done", "data": {"answer": cached["answer"], "retrieval_metadata": cached["retrieval_metadata"]}}
+            return
+        chunks = await loop.run_in_executor(executor, partial(self.retrieve_context, query, timings=timings, filter_expr=filter_expr))
+        clock.lap("retrieve")
+        retrieval_seconds = time.perf_counter() - started
+        
+        if not chunks:
+            result = self._no_results(query)
+            self._finish("stream", "no_results", clock, started, timings, result["retrieval_metadata"])
+            yield {"event": "retrieval", "data": {"citations": [], "retrieval_metadata": result["retrieval_metadata"]}}
+            yield {"event": "token", "data": {"text": result["answer"]}}
+            yield {"event": "done", "data": {"answer": result["answer"], "retrieval_metadata": result["retrieval_metadata"]}}
+            return
+        
+        context_chunks = chunks[:max_context_chunks]
+        messages, packed = self._chat_messages(query, context_chunks, user_context)
+        clock.lap("prompt")
+        result = self._answer(query, "", chunks, context_chunks, packed)
+        metadata = result["retrieval_metadata"]
+        metadata["retrieval_seconds"] = round(retrieval_seconds, 4)
+        yield {"event": "retrieval", "data": {"citations": result["citations"], "retrieval_metadata": dict(metadata)}}
+        
+        # One deadline (llm_timeout) for the semaphore wait, the request and every chunk read
+        deadline = None if self.llm_timeout is None else loop.time() + self.llm_timeout
+        def remaining() -> Optional[float]:
+            return None if deadline is None else max(0.0, deadline - loop.time())
+        
+        parts: List[str] = []
+        first_token = None
+        queued = time.perf_counter()
+        try:
+            await self._acquire_llm_slot(remaining())
+            try:
+                llm_started = time.perf_counter()
+                clock.lap("llm_queue")
+                LLM_IN_FLIGHT.inc()
+                stream = await asyncio.wait_for(
+                    self.async_client.chat.completions.create(
+                        model=self.model,
+                        messages=messages,
+                        max_tokens=1000,
+                        temperature=0.1,
+                        stream=True
+                    ),
+                    remaining(),
+                )
+                try:
+                    events = stream.__aiter__()
+                    while True:
+                        try:
+                            event = await asyncio.wait_for(events.__anext__(), remaining())
+                        except StopAsyncIteration:
+                            break
+                        text = event.choices[0].delta.content if event.choices else None
+                        if text:
+                            if first_token is None:
+                                first_token = time.perf_counter()
+                            parts.append(text)
+                            yield {"event": "token", "data": {"text": text}}
+                finally:
+                    await stream.close()
+            finally:
+                LLM_IN_FLIGHT.dec()
+                self.llm_semaphore.release()
+                clock.lap("llm")
+        except Exception as e:
+            error = self._error(query, "Error generating response", e)
+            self._finish("stream", self._outcome(error), clock, started, timings, error["retrieval_metadata"])
+            yield {"event": "error", "data": error["retrieval_metadata"]}
+            return
+        except BaseException:
+            # Client went away (generator closed / task cancelled) mid-stream
+            self._finish("stream", "cancelled", clock, started, None)
+            raise
+        
+        answer = "".join(parts)
+        tag = extract_ui_tag(answer)
+        if tag:
+            yield {"event": "ui_tag", "data": {"tag": tag}}
+        self._cache_answer(query, key, signature, {"answer": answer, "citations": result["citations"], "retrieval_metadata": metadata})
+        metadata.update({
+            "llm_queue_seconds": round(llm_started - queued, 4),
+            "llm_seconds": round(time.perf_counter() - llm_started, 4),
+            "first_token_seconds": round(first_token - started, 4) if first_token is not None else None,
+        })
+        if first_token is not None:
+            clock.stages["first_token"] = first_token - started
+        self._finish("stream", "answered", clock, started, timings, metadata)
+        yield {"event": "done", "data": {"answer": answer, "retrieval_metadata": metadata}}
+    
+    def _message_messages(self, query: str) -> List[Dict[str, str]]:
+        return [
+            {"role": "system", "content": MESSAGE_SYSTEM_PROMPT},
+            {"role": "user", "content": query}
+        ]
+    
+    def _message_result(self, query: str, answer: str) -> Dict[str, Any]:
+        return {
+            "answer": answer,
+            "citations": [],
+            "retrieval_metadata": {
+                "query": query,
+                "method": "message_generation",
+                "model_used": self.model
             }
+        }
     
     def generate_message(self, query: str) -> Dict[str, Any]:
         """Generate a smooth, natural message using OpenAI without RAG."""
-        print(f"DEBUG: generate_message called with query: {query}")
+        started, clock, timings = time.perf_counter(), StageClock(), self._timings()
+        LLM_IN_FLIGHT.inc()
         try:
             # Call OpenAI API with a simple prompt for message generation
             response = self.client.chat.completions.create(
                 model=self.model,
-                messages=[
-                    {"role": "system", "content": "You are a simple message generator. Write a short message (1-2 sentences) for someone interested in a chatbot project. Do not reference any documents, sources, or external information. Do not include citations or sources. Just write a simple, natural message."},
-                    {"role": "user", "content": query}
-                ],
+                messages=self._message_messages(query),
                 max_tokens=80,
                 temperature=0.8  # Higher temperature for more natural language
             )
-            
-            answer = response.choices[0].message.content
-            print(f"DEBUG: Generated message: {answer}")
-            
-            return {
-                "answer": answer,
-                "citations": [],
-                "retrieval_metadata": {
-                    "query": query,
-                    "method": "message_generation",
-                    "model_used": self.model
-                }
-            }
+            result = self._message_result(query, response.choices[0].message.content)
             
         except Exception as e:
-            return {
-                "answer": f"Error generating message: {str(e)}",
-                "citations": [],
-                "retrieval_metadata": {
-                    "query": query,
-                    "error": str(e)
-                }
-            }
+            result = self._error(query, "Error generating message", e)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            clock.lap("llm")
+        self._finish("message", self._outcome(result), clock, started, timings, result["retrieval_metadata"])
+        return result
+    
+    async def agenerate_message(self, query: str) -> Dict[str, Any]:
+        """Async generate_message(), sharing the LLM concurrency limit and timeout with achat()."""
+        started, clock, timings = time.perf_counter(), StageClock(), self._timings()
+        try:
+            response, queue_seconds, llm_seconds = await self._acomplete(
+                clock,
+                messages=self._message_messages(query),
+                max_tokens=80,
+                temperature=0.8
+            )
+        except Exception as e:
+            result = self._error(query, "Error generating message", e)
+        else:
+            result = self._message_result(query, response.choices[0].message.content)
+            result["retrieval_metadata"].update({"llm_queue_seconds": round(queue_seconds, 4), "llm_seconds": round(llm_seconds, 4)})
+        self._finish("message", self._outcome(result), clock, started, timings, result["retrieval_metadata"])
+        return result
     
     def interactive_chat(self):
         """Start an interactive chat session."""
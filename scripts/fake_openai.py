@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Minimal OpenAI-compatible chat completions server for load testing.
+Answers every request with a canned reply after a fixed delay, without calling any model.
+With "stream": true the reply is sent as SSE chunks spread evenly over the same delay.
+
+    python scripts/fake_openai.py --port 9000 --latency 0.8
+    OPENAI_BASE_URL=http://127.0.0.1:9000/v1 OPENAI_API_KEY=fake uvicorn server:app
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+LATENCY = float(os.getenv("FAKE_OPENAI_LATENCY", "0.5"))
+ANSWER = os.getenv(
+    "FAKE_OPENAI_ANSWER",
+    "We can usually deliver a pilot chatbot within four weeks [1]. Pricing depends on the channels you need [2].\n\nSources: [1], [2]\n[book_demo]",
+)
+
+app = FastAPI(title="Fake OpenAI")
+app.state.in_flight = 0
+app.state.max_in_flight = 0
+
+
+async def _stream(model: str) -> AsyncIterator[str]:
+    tokens = re.findall(r"\S+\s*", ANSWER)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    app.state.in_flight += 1
+    app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+    try:
+        for token in tokens:
+            await asyncio.sleep(LATENCY / len(tokens))
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            yield f"data: {json.dumps(chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+    finally:
+        app.state.in_flight -= 1
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request) -> Any:
+    body = await request.json()
+    if body.get("stream"):
+        return StreamingResponse(_stream(body.get("model", "fake")), media_type="text/event-stream")
+    app.state.in_flight += 1
+    app.state.max_in_flight = max(app.state.max_in_flight, app.state.in_flight)
+    try:
+        await asyncio.sleep(LATENCY)
+    finally:
+        app.state.in_flight -= 1
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.get("/stats")
+def stats() -> Dict[str, int]:
+    # Peak concurrent upstream calls seen, to check LLM_MAX_CONCURRENCY from the outside
+    return {"in_flight": app.state.in_flight, "max_in_flight": app.state.max_in_flight}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=LATENCY, help="Seconds to wait before answering")
+    args = parser.parse_args()
+    LATENCY = args.latency
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
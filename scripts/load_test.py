@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the chat API.
+Fires --requests POSTs at --concurrency in parallel and reports throughput, latency percentiles and
+the LLM queue time reported in retrieval_metadata. With --stream the requests go to /chat/stream and
+time to first token is reported as well.
+
+    python scripts/load_test.py --url http://127.0.0.1:8000/chat --requests 200 --concurrency 50
+    python scripts/load_test.py --url http://127.0.0.1:8000/chat/stream --stream
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+import httpx
+import numpy as np
+
+QUERIES = [
+    "How long does a pilot take?",
+    "What channels do you support?",
+    "How is pricing calculated?",
+    "Can I book a demo?",
+    "How do you handle data retention?",
+]
+
+
+async def _one(client: httpx.AsyncClient, url: str, query: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        resp = await client.post(url, json={"query": query, "session_id": "load-test"})
+        meta = resp.json().get("retrieval_metadata", {}) if resp.status_code == 200 else {}
+        ok = resp.status_code == 200 and "error" not in meta
+    except httpx.HTTPError:
+        meta, ok = {}, False
+    return {"seconds": time.perf_counter() - started, "ok": ok, "meta": meta}
+
+
+async def _one_stream(client: httpx.AsyncClient, url: str, query: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    first_token, meta, ok, event = None, {}, False, None
+    try:
+        async with client.stream("POST", url, json={"query": query, "session_id": "load-test"}) as resp:
+            async for line in resp.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: "):
+                    if event == "token" and first_token is None:
+                        first_token = time.perf_counter() - started
+                    elif event == "done":
+                        meta, ok = json.loads(line[len("data: "):])["retrieval_metadata"], True
+                    elif event == "error":
+                        meta = json.loads(line[len("data: "):])
+    except httpx.HTTPError:
+        pass
+    return {"seconds": time.perf_counter() - started, "ok": ok, "meta": meta, "first_token": first_token}
+
+
+async def run(url: str, n_requests: int, concurrency: int, timeout: float, stream: bool = False) -> Dict[str, Any]:
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def bounded(i: int) -> Dict[str, Any]:
+            async with sem:
+                return await (_one_stream if stream else _one)(client, url, QUERIES[i % len(QUERIES)])
+
+        started = time.perf_counter()
+        results: List[Dict[str, Any]] = await asyncio.gather(*(bounded(i) for i in range(n_requests)))
+        elapsed = time.perf_counter() - started
+
+    latencies = np.array([r["seconds"] for r in results])
+    queue = [r["meta"]["llm_queue_seconds"] for r in results if "llm_queue_seconds" in r["meta"]]
+    first = [r["first_token"] for r in results if r.get("first_token") is not None]
+    report = {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "ok": sum(r["ok"] for r in results),
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(n_requests / elapsed, 2),
+        "latency_p50": round(float(np.percentile(latencies, 50)), 3),
+        "latency_p95": round(float(np.percentile(latencies, 95)), 3),
+        "latency_p99": round(float(np.percentile(latencies, 99)), 3),
+        "llm_queue_mean": round(float(np.mean(queue)), 3) if queue else None,
+        "llm_queue_max": round(float(np.max(queue)), 3) if queue else None,
+    }
+    if stream:
+        report["first_token_p50"] = round(float(np.percentile(first, 50)), 3) if first else None
+        report["first_token_p95"] = round(float(np.percentile(first, 95)), 3) if first else None
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the chat API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/chat")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--stream", action="store_true", help="Target /chat/stream and report time to first token")
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run(args.url, args.requests, args.concurrency, args.timeout, args.stream)), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,22 @@ REST API for WorkingRAGChatBot using FastAPI.
 Exposes endpoints to check health and to perform RAG-augmented chat.
 """
 
+import asyncio
+import json
 import os
+import tempfile
+import threading
+import time
+
+_import_started = time.perf_counter()
+
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Set
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 
 try:
@@ -19,7 +30,16 @@ except Exception:
     pass
 
 # Local imports
+from rag.config import RAGConfig
+from rag.filters import parse_filter
+from rag.fusion import FUSION_METHODS, FUSION_NORMS, parse_weights
+from rag.metrics import CONTENT_TYPE, REGISTRY
+from rag.profiling import PROFILE_MODES, profile_name, profiled
+from rag.startup import record_step, startup_report, timed_step
 from retrieval_chatbot import WorkingRAGChatBot
+from session_store import create_session_store
+
+record_step("import server modules", time.perf_counter() - _import_started)
 
 
 class ChatRequest(BaseModel):
@@ -29,6 +49,7 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = Field(None, description="Client-provided session identifier for memory")
     selections: Optional[Dict[str, Any]] = Field(None, description="Structured user selections (e.g., buttons/forms)")
     message_generation: Optional[bool] = Field(False, description="Flag to indicate this is for message generation, not regular chat")
+    filter: Optional[str] = Field(None, description='Metadata filter applied before retrieval, e.g. document_type = url and uri ^= "https://docs.example.com/"')
 
 
 class ChatResponse(BaseModel):
@@ -37,6 +58,46 @@ class ChatResponse(BaseModel):
     retrieval_metadata: Dict[str, Any]
 
 
+HTTP_REQUESTS = REGISTRY.counter("http_requests_total", "HTTP requests by route, method and status", ("method", "path", "status"))
+HTTP_SECONDS = REGISTRY.histogram("http_request_duration_seconds", "HTTP request time until the last body byte", ("method", "path"))
+HTTP_IN_FLIGHT = REGISTRY.gauge("http_requests_in_flight", "HTTP requests being served (streams until they end)", ("path",))
+READY = REGISTRY.gauge("chat_ready", "1 once the chatbot has finished warming up")
+ANSWER_CACHE_ENTRIES = REGISTRY.gauge("chat_answer_cache_entries", "Answers cached")
+SESSIONS = REGISTRY.gauge("chat_sessions", "Stored session contexts")
+SESSION_BYTES = REGISTRY.gauge("chat_session_bytes", "Serialized size of stored session contexts")
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing requests per route; streamed responses are timed to their last byte."""
+
+    def __init__(self, app, route_paths: Callable[[], Set[str]]):
+        self.app = app
+        self.route_paths = route_paths
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        # Unknown paths share one label so scanners cannot blow up the series count
+        path = scope["path"] if scope["path"] in self.route_paths() else "other"
+        status = "500"
+
+        async def send_with_status(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(path=path)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec(path=path)
+            HTTP_SECONDS.observe(time.perf_counter() - started, method=scope["method"], path=path)
+            HTTP_REQUESTS.inc(method=scope["method"], path=path, status=status)
+
+
 def create_app() -> FastAPI:
     app = FastAPI(title="Chatbot Pilot RAG API", version="0.1.0")
 
@@ -44,31 +105,188 @@ def create_app() -> FastAPI:
     index_dir_env = os.getenv("INDEX_DIR", str(Path(__file__).parent / "local_index"))
     model_env = os.getenv("OPENAI_MODEL", os.getenv("MODEL", "gpt-3.5-turbo"))
     api_key_env = os.getenv("OPENAI_API_KEY")
+    bm25_search_env = os.getenv("BM25_SEARCH", "exhaustive")
+    fusion_method_env = os.getenv("FUSION_METHOD", "rrf")
+    fusion_weights_env = parse_weights(os.getenv("FUSION_WEIGHTS", "1,1"))  # bm25,vector
+    fusion_norm_env = os.getenv("FUSION_NORM", "minmax")
+    if fusion_method_env not in FUSION_METHODS:
+        raise ValueError(f"Unknown FUSION_METHOD: {fusion_method_env!r} (expected one of {FUSION_METHODS})")
+    if fusion_norm_env not in FUSION_NORMS:
+        raise ValueError(f"Unknown FUSION_NORM: {fusion_norm_env!r} (expected one of {FUSION_NORMS})")
+    vector_rescore_k_env = int(os.getenv("VECTOR_RESCORE_K", "0"))
+    vector_index_env = os.getenv("VECTOR_INDEX", "flat")
+    ivf_nprobe_env = int(os.getenv("IVF_NPROBE", "8"))
+    query_cache_size_env = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+    llm_max_concurrency_env = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    llm_timeout_env = float(os.getenv("LLM_TIMEOUT", "60")) or None  # 0 disables the timeout
+    retrieval_workers_env = int(os.getenv("RETRIEVAL_WORKERS", "4"))
+    answer_cache_size_env = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))  # 0 disables the answer cache
+    answer_cache_ttl_env = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+    answer_cache_similarity_env = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))  # e.g. 0.95; 0 = exact matches only
+    context_token_budget_env = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))  # prompt context tokens; 0 = no limit
 
-    # Simple in-memory store for session context (non-persistent)
-    app.state.session_context: Dict[str, Dict[str, Any]] = {}
+    session_expiry_interval_env = float(os.getenv("SESSION_EXPIRY_INTERVAL", "60"))
+    chat_timings_env = os.getenv("CHAT_TIMINGS", "false").lower() in {"1", "true", "yes"}  # per-stage timings in retrieval_metadata
 
-    # Instantiate chatbot at startup so we don't reload index on every request
-    @app.on_event("startup")
-    def startup_event() -> None:
+    # Per-request CPU profiles: every request with PROFILE_REQUESTS=all, otherwise only requests sending
+    # "X-Profile: <PROFILE_TOKEN>" (no token configured = header ignored). One profiled request at a time.
+    profile_requests_env = os.getenv("PROFILE_REQUESTS", "off").lower()
+    profile_token_env = os.getenv("PROFILE_TOKEN", "")
+    profile_mode_env = os.getenv("PROFILE_MODE", "sampling")
+    profile_dir_env = Path(os.getenv("PROFILE_DIR", str(Path(tempfile.gettempdir()) / "chatbot-pilot-profiles")))
+    profile_top_env = int(os.getenv("PROFILE_TOP", "30"))
+    if profile_mode_env not in PROFILE_MODES:
+        raise ValueError(f"Unknown PROFILE_MODE: {profile_mode_env!r} (expected one of {PROFILE_MODES})")
+    profile_lock = threading.Lock()
+
+    # Session context (selections) per session_id: bounded in-process LRU, or SQLite shared by all workers
+    app.state.sessions = create_session_store()
+
+    # Chatbot construction (index load, embedding model load, dummy query) runs in the background after
+    # startup: "/" answers at once (liveness) while /health and the chat endpoints return 503 until it is done.
+    # If it fails, "/" returns 503 too, so a liveness probe restarts the process.
+    app.state.ready = False
+    app.state.startup_error = None
+
+    def initialize_chatbot() -> None:
+        started = time.perf_counter()
         try:
-            app.state.index_dir = Path(index_dir_env)
-            app.state.model = model_env
-            app.state.chatbot = WorkingRAGChatBot(index_dir=str(app.state.index_dir), api_key=api_key_env, model=app.state.model)
+            config = RAGConfig(
+                index_dir=app.state.index_dir,
+                bm25_search=bm25_search_env,
+                fusion_method=fusion_method_env,
+                fusion_weights=fusion_weights_env,
+                fusion_norm=fusion_norm_env,
+                vector_rescore_k=vector_rescore_k_env,
+                vector_index=vector_index_env,
+                ivf_nprobe=ivf_nprobe_env,
+            )
+            from rag.embeddings import set_query_cache_size
+            set_query_cache_size(query_cache_size_env)
+            with timed_step("initialize chatbot"):
+                app.state.chatbot = WorkingRAGChatBot(
+                    index_dir=str(app.state.index_dir),
+                    api_key=api_key_env,
+                    model=app.state.model,
+                    config=config,
+                    llm_max_concurrency=llm_max_concurrency_env,
+                    llm_timeout=llm_timeout_env,
+                    answer_cache_size=answer_cache_size_env,
+                    answer_cache_ttl=answer_cache_ttl_env,
+                    answer_cache_similarity=answer_cache_similarity_env,
+                    include_timings=chat_timings_env,
+                    context_token_budget=context_token_budget_env,
+                )
+            app.state.ready = True
+            print(f"✅ Ready in {time.perf_counter() - started:.2f}s")
+            for step in startup_report():
+                print(f"   {step['seconds']:8.3f}s  {step['step']}")
         except Exception as exc:
-            raise RuntimeError(f"Failed to initialize RAG chatbot: {exc}")
+            app.state.startup_error = f"Failed to initialize RAG chatbot: {exc}"
+            print(f"❌ {app.state.startup_error}")
+
+    # Request counts/latency/in-flight per route; gauges below are refreshed from live state on each scrape
+    app.add_middleware(MetricsMiddleware, route_paths=lambda: app.state.route_paths)
+    app.state.route_paths = set()
+
+    def collect_gauges() -> None:
+        READY.set(1 if app.state.ready else 0)
+        if app.state.ready:
+            ANSWER_CACHE_ENTRIES.set(len(app.state.chatbot.answer_cache))
+        stats = app.state.sessions.stats()
+        SESSIONS.set(stats["sessions"])
+        SESSION_BYTES.set(stats["bytes"])
+
+    @app.on_event("startup")
+    async def startup_event() -> None:
+        app.state.index_dir = Path(index_dir_env)
+        app.state.model = model_env
+        app.state.route_paths = {route.path for route in app.routes}
+        # Registered per running app (and removed on shutdown) so the process-wide registry does not keep
+        # apps that were created but never started, or have stopped, alive
+        REGISTRY.on_collect(collect_gauges)
+        # Retrieval (NumPy scoring, query encoding) runs here, off the event loop
+        app.state.retrieval_executor = ThreadPoolExecutor(max_workers=retrieval_workers_env, thread_name_prefix="retrieval")
+        app.state.sessions.start_expiry(session_expiry_interval_env)
+        app.state.warm_up = asyncio.get_running_loop().run_in_executor(None, initialize_chatbot)
+
+    def require_ready() -> None:
+        if not app.state.ready:
+            raise HTTPException(status_code=503, detail=app.state.startup_error or "Warming up", headers={"Retry-After": "5"})
+
+    def require_valid_filter(req: ChatRequest) -> None:
+        # A malformed filter is the client's error (400), not a failed request
+        if req.filter:
+            try:
+                parse_filter(req.filter)
+            except ValueError as exc:
+                raise HTTPException(status_code=400, detail=str(exc))
+
+    @app.on_event("shutdown")
+    def shutdown_event() -> None:
+        REGISTRY.remove_collector(collect_gauges)
+        executor = getattr(app.state, "retrieval_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False)
+        app.state.sessions.close()
+
+    def session_user_context(req: ChatRequest) -> Optional[str]:
+        # Merge the request's selections into the session context and render it for the prompt
+        session_id = req.session_id or "default"
+        if req.selections:
+            ctx = app.state.sessions.merge_selections(session_id, req.selections)
+        else:
+            ctx = app.state.sessions.get(session_id)
+        if ctx.get("selections"):
+            return json.dumps({"selections": ctx["selections"]}, ensure_ascii=False)
+        return None
+
+    def requested_profile(request: Request) -> Optional[str]:
+        """Profile mode for this request, or None; X-Profile-Mode may pick sampling or cprofile."""
+        if profile_requests_env != "all" and not (profile_token_env and request.headers.get("x-profile") == profile_token_env):
+            return None
+        mode = request.headers.get("x-profile-mode", profile_mode_env)
+        return mode if mode in PROFILE_MODES else profile_mode_env
+
+    async def run_profiled(label: str, mode: str, response: Response, fn, *args, **kwargs) -> Any:
+        # The whole request runs on one worker thread (the sync chatbot path), so the profile holds only this
+        # request's work. If another profiled request is running, this one is served unprofiled.
+        def call() -> Any:
+            if not profile_lock.acquire(blocking=False):
+                return fn(*args, **kwargs)
+            try:
+                with profiled(profile_dir_env, profile_name(label), mode, top=profile_top_env) as paths:
+                    result = fn(*args, **kwargs)
+            finally:
+                profile_lock.release()
+            response.headers["X-Profile"] = os.path.basename(paths["summary"])[: -len(".txt")]
+            return result
+
+        return await run_in_threadpool(call)
 
     @app.get("/", tags=["meta"])
-    def root() -> Dict[str, Any]:
-        return {
+    def root() -> Any:
+        # Liveness: 200 while warming up or ready; 503 once initialization has failed, since this process
+        # will never become ready and should be restarted
+        content = {
             "name": "chatbot-pilot-rag-api",
-            "status": "ok",
+            "status": "ok" if app.state.ready else "warming",
             "model": getattr(app.state, "model", None),
             "index_dir": str(getattr(app.state, "index_dir", index_dir_env)),
         }
+        if app.state.startup_error:
+            content.update(status="failed", error=app.state.startup_error)
+            return JSONResponse(status_code=503, content=content)
+        return content
 
     @app.get("/health", tags=["meta"]) 
-    def health() -> Dict[str, Any]:
+    def health() -> Any:
+        if not app.state.ready:
+            return JSONResponse(status_code=503, content={
+                "status": "failed" if app.state.startup_error else "warming",
+                "error": app.state.startup_error,
+                "startup": startup_report(),
+            })
         try:
             chatbot = app.state.chatbot
             return {
@@ -77,22 +295,38 @@ def create_app() -> FastAPI:
                 "index_dir": str(app.state.index_dir),
                 "chunks_loaded": len(getattr(chatbot, "chunks", [])),
                 "embeddings_loaded": chatbot.embeddings is not None,
+                "retrieval_method": chatbot.retrieval_method,
+                "answer_cache": chatbot.answer_cache.stats(),
+                "sessions": app.state.sessions.stats(),
+                "startup": startup_report(),
             }
         except Exception as exc:
             raise HTTPException(status_code=500, detail=str(exc))
 
+    @app.get("/metrics", tags=["meta"])
+    def metrics() -> PlainTextResponse:
+        """Prometheus text format: HTTP, chat stage and retrieval stage histograms, counters and gauges."""
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
     @app.post("/generate-message", tags=["chat"])
-    def generate_message_endpoint(req: ChatRequest) -> Dict[str, Any]:
+    async def generate_message_endpoint(req: ChatRequest, request: Request, response: Response) -> Dict[str, Any]:
         """Generate a simple message without RAG."""
+        require_ready()
         try:
             chatbot = app.state.chatbot
-            result = chatbot.generate_message(req.query)
+            profile_mode = requested_profile(request)
+            if profile_mode:
+                result = await run_profiled("generate-message", profile_mode, response, chatbot.generate_message, req.query)
+            else:
+                result = await chatbot.agenerate_message(req.query)
             return result
         except Exception as exc:
             raise HTTPException(status_code=500, detail=str(exc))
 
     @app.post("/chat", response_model=ChatResponse, tags=["chat"]) 
-    def chat(req: ChatRequest) -> ChatResponse:
+    async def chat(req: ChatRequest, request: Request, response: Response) -> ChatResponse:
+        require_ready()
+        require_valid_filter(req)
         try:
             chatbot = app.state.chatbot
 
@@ -102,29 +336,30 @@ def create_app() -> FastAPI:
                 app.state.model = req.model
 
             # Update session context
-            session_id = req.session_id or "default"
-            ctx = app.state.session_context.get(session_id, {})
-            if req.selections:
-                # merge selections into session context
-                ctx.setdefault("selections", {}).update(req.selections)
-            app.state.session_context[session_id] = ctx
+            user_ctx_str = await run_in_threadpool(session_user_context, req)  # SQLite I/O stays off the loop
 
             # Handle message generation differently
-            print(f"DEBUG: message_generation flag: {req.message_generation} (type: {type(req.message_generation)})")
-            print(f"DEBUG: query: {req.query}")
-            if req.message_generation == True or req.message_generation == "true" or str(req.message_generation).lower() == "true":
+            message_generation = req.message_generation == True or req.message_generation == "true" or str(req.message_generation).lower() == "true"
+            profile_mode = requested_profile(request)
+            if profile_mode:
+                if message_generation:
+                    result = await run_profiled("generate-message", profile_mode, response, chatbot.generate_message, req.query)
+                else:
+                    result = await run_profiled(
+                        "chat", profile_mode, response, chatbot.chat, req.query,
+                        max_context_chunks=req.max_context_chunks, user_context=user_ctx_str, filter_expr=req.filter,
+                    )
+            elif message_generation:
                 # For message generation, use a simple prompt without RAG
-                print("DEBUG: Using generate_message method")
-                result = chatbot.generate_message(req.query)
+                result = await chatbot.agenerate_message(req.query)
             else:
-                print("DEBUG: Using regular chat method")
-                # Build a brief user context string for the model
-                user_ctx_str = None
-                if ctx.get("selections"):
-                    import json as _json
-                    user_ctx_str = _json.dumps({"selections": ctx["selections"]}, ensure_ascii=False)
-
-                result = chatbot.chat(req.query, max_context_chunks=req.max_context_chunks, user_context=user_ctx_str)
+                result = await chatbot.achat(
+                    req.query,
+                    max_context_chunks=req.max_context_chunks,
+                    user_context=user_ctx_str,
+                    executor=app.state.retrieval_executor,
+                    filter_expr=req.filter,
+                )
 
             return ChatResponse(**result)
         except HTTPException:
@@ -132,6 +367,32 @@ def create_app() -> FastAPI:
         except Exception as exc:
             raise HTTPException(status_code=500, detail=str(exc))
 
+    @app.post("/chat/stream", tags=["chat"])
+    async def chat_stream(req: ChatRequest) -> StreamingResponse:
+        """Server-sent events: retrieval (citations + metadata), token*, ui_tag (if any), then done or error."""
+        require_ready()
+        require_valid_filter(req)
+        if req.message_generation:
+            raise HTTPException(status_code=400, detail="message_generation is only supported by /chat")
+        chatbot = app.state.chatbot
+        if req.model and req.model != app.state.model:
+            chatbot.model = req.model
+            app.state.model = req.model
+        user_ctx_str = await run_in_threadpool(session_user_context, req)  # SQLite I/O stays off the loop
+
+        async def sse():
+            async for event in chatbot.astream_chat(
+                req.query,
+                max_context_chunks=req.max_context_chunks,
+                user_context=user_ctx_str,
+                executor=app.state.retrieval_executor,
+                filter_expr=req.filter,
+            ):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+        # no-cache / X-Accel-Buffering keep proxies (nginx, Next.js rewrites) from buffering the stream
+        return StreamingResponse(sse(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
     return app
 
 
@@ -142,10 +403,20 @@ if __name__ == "__main__":
     # Simple CLI to run the server directly: python rag_api.py
     import uvicorn
 
+    from rag.serving import prepare_index, warm_page_cache
+
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
     reload = os.getenv("RELOAD", "false").lower() in {"1", "true", "yes"}
+    workers = int(os.getenv("WORKERS", "1"))
+
+    # Parent prepares the index once: missing memory-mapped artifacts are derived and the files are paged in,
+    # so every worker only maps them (shared page cache, near-zero private memory and attach time)
+    index_dir = Path(os.getenv("INDEX_DIR", str(Path(__file__).parent / "local_index")))
+    for name in prepare_index(index_dir):
+        print(f"🛠️ Prepared {name}")
+    warm_page_cache(index_dir)
 
-    uvicorn.run("server:app", host=host, port=port, reload=reload)
+    uvicorn.run("server:app", host=host, port=port, reload=reload, workers=None if reload else workers)
 
 
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Session context stores for the chat API.
+A session context is a small JSON object per session_id (currently {"selections": {...}}); selections are
+merged into it on every request, so both reads and merges are single-key operations.
+"""
+
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+
+class SessionStore(ABC):
+    """Interface for session context storage; entries expire `ttl` seconds after their last update."""
+
+    ttl: float
+
+    @abstractmethod
+    def get(self, session_id: str) -> Dict[str, Any]:
+        """Context for the session, or {} when it is unknown or expired."""
+
+    @abstractmethod
+    def merge_selections(self, session_id: str, selections: Dict[str, Any]) -> Dict[str, Any]:
+        """Shallow-merge selections into the session context and return the updated context."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Forget the session."""
+
+    @abstractmethod
+    def expire(self) -> int:
+        """Drop expired (and over-budget) sessions; returns how many were removed."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Backend name, session count and stored bytes (cheap: called on every /health and /metrics scrape)."""
+
+    def start_expiry(self, interval: float = 60.0) -> None:
+        # Background sweep so idle sessions are reclaimed even when no request touches them
+        if getattr(self, "_expiry_thread", None) is not None:
+            return
+        self._expiry_stop = threading.Event()
+
+        def run() -> None:
+            while not self._expiry_stop.wait(interval):
+                try:
+                    self.expire()
+                except Exception as exc:
+                    print(f"⚠️ Session expiry failed: {exc}")
+
+        self._expiry_thread = threading.Thread(target=run, name="session-expiry", daemon=True)
+        self._expiry_thread.start()
+
+    def close(self) -> None:
+        if getattr(self, "_expiry_thread", None) is not None:
+            self._expiry_stop.set()
+            self._expiry_thread.join()
+            self._expiry_thread = None
+
+
+def _merged(ctx: Dict[str, Any], selections: Dict[str, Any]) -> Dict[str, Any]:
+    ctx = dict(ctx)
+    ctx["selections"] = {**ctx.get("selections", {}), **selections}
+    return ctx
+
+
+class MemorySessionStore(SessionStore):
+    """Per-process LRU of session contexts bounded by entry count and serialized bytes."""
+
+    def __init__(self, max_sessions: int = 10000, max_bytes: int = 64 << 20, ttl: float = 86400.0):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # session_id -> (expires_at, context, accounted bytes)
+        self._data: "OrderedDict[str, Tuple[float, Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._data.get(session_id)
+            if entry is None:
+                return {}
+            if entry[0] <= time.monotonic():
+                self._remove(session_id)
+                return {}
+            self._data.move_to_end(session_id)
+            return entry[1]
+
+    def merge_selections(self, session_id: str, selections: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            entry = self._data.get(session_id)
+            ctx = entry[1] if entry is not None and entry[0] > time.monotonic() else {}
+            ctx = _merged(ctx, selections)
+            if entry is not None:
+                self._remove(session_id)
+            size = len(session_id) + len(orjson.dumps(ctx))
+            if size > self.max_bytes:
+                # Larger than the whole budget: used for this request only rather than flushing every other session
+                self.evictions += 1
+                return ctx
+            self._data[session_id] = (time.monotonic() + self.ttl, ctx, size)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_sessions or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+            return ctx
+
+    def _remove(self, session_id: str) -> None:
+        _, _, size = self._data.pop(session_id)
+        self._bytes -= size
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            if session_id in self._data:
+                self._remove(session_id)
+
+    def expire(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [sid for sid, (expires, _, _) in self._data.items() if expires <= now]
+            for sid in expired:
+                self._remove(sid)
+        return len(expired)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._data), "bytes": self._bytes, "evictions": self.evictions}
+
+
+class SQLiteSessionStore(SessionStore):
+    """Session contexts in a SQLite file (WAL mode), shared by every worker process pointing at the same path."""
+
+    def __init__(self, path: Path, max_sessions: int = 100000, ttl: float = 86400.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        # sqlite3 connections are per thread; each thread opens its own on first use. All of them are
+        # tracked so close() can close every one (hence check_same_thread=False; each is still used by
+        # its own thread only).
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at)")
+            # Running session count and bytes, kept by triggers so stats() reads one row instead of
+            # scanning the table; seeded from the table for files created before it existed
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS session_totals ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), sessions INTEGER NOT NULL, bytes INTEGER NOT NULL)"
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO session_totals (id, sessions, bytes) "
+                "SELECT 0, COUNT(*), COALESCE(SUM(LENGTH(session_id) + LENGTH(data)), 0) FROM sessions"
+            )
+            for name, event, change in (
+                ("sessions_insert_totals", "INSERT", "sessions = sessions + 1, bytes = bytes + LENGTH(NEW.session_id) + LENGTH(NEW.data)"),
+                ("sessions_delete_totals", "DELETE", "sessions = sessions - 1, bytes = bytes - LENGTH(OLD.session_id) - LENGTH(OLD.data)"),
+                ("sessions_update_totals", "UPDATE", "bytes = bytes + LENGTH(NEW.session_id) + LENGTH(NEW.data) - LENGTH(OLD.session_id) - LENGTH(OLD.data)"),
+            ):
+                conn.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON sessions "
+                    f"BEGIN UPDATE session_totals SET {change} WHERE id = 0; END"
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; merges take an explicit write lock with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, session_id: str) -> Dict[str, Any]:
+        row = self._conn().execute(
+            "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?", (session_id, time.time())
+        ).fetchone()
+        return orjson.loads(row[0]) if row else {}
+
+    def merge_selections(self, session_id: str, selections: Dict[str, Any]) -> Dict[str, Any]:
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND expires_at > ?", (session_id, now)
+            ).fetchone()
+            ctx = _merged(orjson.loads(row[0]) if row else {}, selections)
+            # An upsert (not INSERT OR REPLACE, whose implicit delete skips triggers) keeps session_totals right
+            conn.execute(
+                "INSERT INTO sessions (session_id, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (session_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+                (session_id, orjson.dumps(ctx), now + self.ttl),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return ctx
+
+    def delete(self, session_id: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def expire(self) -> int:
+        # Expired rows first, then the least recently updated beyond max_sessions
+        conn = self._conn()
+        removed = conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+        removed += conn.execute(
+            "DELETE FROM sessions WHERE session_id IN ("
+            "SELECT session_id FROM sessions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_sessions,),
+        ).rowcount
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        count, size = self._conn().execute("SELECT sessions, bytes FROM session_totals WHERE id = 0").fetchone()
+        return {"backend": "sqlite", "path": str(self.path), "sessions": count, "bytes": size}
+
+    def close(self) -> None:
+        # Connections of every thread that used the store, not just the caller's
+        super().close()
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def create_session_store(backend: Optional[str] = None) -> SessionStore:
+    """Store selected by SESSION_STORE (memory | sqlite), sized by SESSION_TTL / SESSION_MAX / SESSION_MAX_BYTES."""
+    backend = (backend or os.getenv("SESSION_STORE", "memory")).lower()
+    ttl = float(os.getenv("SESSION_TTL", "86400"))
+    if backend == "sqlite":
+        path = Path(os.getenv("SESSION_DB", str(Path(tempfile.gettempdir()) / "chatbot-pilot-sessions.db")))
+        return SQLiteSessionStore(path, max_sessions=int(os.getenv("SESSION_MAX", "100000")), ttl=ttl)
+    if backend == "memory":
+        return MemorySessionStore(
+            max_sessions=int(os.getenv("SESSION_MAX", "10000")),
+            max_bytes=int(os.getenv("SESSION_MAX_BYTES", str(64 << 20))),
+            ttl=ttl,
+        )
+    raise ValueError(f"Unknown SESSION_STORE: {backend!r} (expected 'memory' or 'sqlite')")
@@ -0,0 +1,63 @@
+import random
+
+import numpy as np
+import pytest
+
+from rag.bm25 import InvertedBM25
+
+
+def tie_heavy_corpus(n_docs=3000, vocab=40, length=6, seed=0):
+    # Few terms and equal document lengths: many documents share the exact same score
+    rng = random.Random(seed)
+    words = [f"t{i}" for i in range(vocab)]
+    return [[rng.choice(words) for _ in range(length)] for _ in range(n_docs)]
+
+
+def queries(n=300, vocab=40, seed=1, prefix="t"):
+    rng = random.Random(seed)
+    return [[f"{prefix}{rng.randrange(vocab)}" for _ in range(rng.randint(1, 4))] for _ in range(n)]
+
+
+def test_get_scores_match_rank_bm25():
+    rank_bm25 = pytest.importorskip("rank_bm25")
+    rng = random.Random(2)
+    words = [f"w{i}" for i in range(200)]
+    # Varying lengths, common terms (negative idf, replaced by epsilon * average idf) and unknown query terms
+    corpus = [[rng.choice(words[:5] if rng.random() < 0.3 else words) for _ in range(rng.randint(1, 30))] for _ in range(400)]
+    reference = rank_bm25.BM25Okapi(corpus)
+    inverted = InvertedBM25.from_tokenized(corpus)
+    for q in queries(100, vocab=220, seed=3, prefix="w") + [["w0", "w0", "w1"], ["unknown"]]:
+        expected = reference.get_scores(q)
+        np.testing.assert_array_equal(inverted.get_scores(q), expected)
+        docs, scores = inverted.sparse_scores(q)
+        np.testing.assert_array_equal(scores, expected[docs])
+
+
+def test_saved_index_scores_like_built(tmp_path):
+    built = InvertedBM25.from_tokenized(tie_heavy_corpus(200))
+    built.save(tmp_path)
+    loaded = InvertedBM25.load(tmp_path)
+    for q in queries(50):
+        np.testing.assert_array_equal(loaded.get_scores(q), built.get_scores(q))
+
+
+@pytest.fixture(scope="module")
+def bm25():
+    return InvertedBM25.from_tokenized(tie_heavy_corpus())
+
+
+@pytest.mark.parametrize("k", [1, 10, 50])
+def test_maxscore_matches_exhaustive(bm25, k):
+    qs = queries()
+    exhaustive = bm25.top_k_many(qs, k, mode="exhaustive")
+    maxscore = bm25.top_k_many(qs, k, mode="maxscore")
+    for q, (e_docs, e_scores), (m_docs, m_scores) in zip(qs, exhaustive, maxscore):
+        assert m_docs == e_docs, q
+        assert m_scores == e_scores, q
+
+
+def test_maxscore_matches_exhaustive_with_filter(bm25):
+    allowed = np.zeros(bm25.n_docs, dtype=bool)
+    allowed[::3] = True
+    qs = queries(100)
+    assert bm25.top_k_many(qs, 10, mode="maxscore", allowed=allowed) == bm25.top_k_many(qs, 10, allowed=allowed)
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+import rag.cache
+from rag.cache import AnswerCache, LRUCache
+
+SIG = ("index", 1)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rag.cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def answer(text):
+    return {"answer": text, "retrieval_metadata": {"query": text}}
+
+
+def unit(*values):
+    v = np.asarray(values, dtype=np.float32)
+    return v / np.linalg.norm(v)
+
+
+def test_exact_hit_normalizes_query():
+    cache = AnswerCache(maxsize=4)
+    cache.put(AnswerCache.key("What is  RAG?", "ctx"), SIG, answer("a"))
+    assert cache.lookup(AnswerCache.key("what is rag?", "ctx"), SIG) == (answer("a"), None)
+    assert cache.lookup(AnswerCache.key("what is rag?", "other ctx"), SIG) is None
+    assert cache.stats() == {"size": 1, "hits": 1, "similar_hits": 0, "misses": 1}
+
+
+def test_results_are_copies():
+    cache = AnswerCache(maxsize=4)
+    key = AnswerCache.key("q", "ctx")
+    stored = answer("a")
+    cache.put(key, SIG, stored)
+    stored["answer"] = "changed"
+    result, _ = cache.lookup(key, SIG)
+    result["retrieval_metadata"]["query"] = "changed"
+    assert cache.lookup(key, SIG)[0] == answer("a")
+
+
+def test_ttl_expiry(clock):
+    cache = AnswerCache(maxsize=4, ttl=10.0)
+    key = AnswerCache.key("q", "ctx")
+    cache.put(key, SIG, answer("a"))
+    clock[0] += 9.9
+    assert cache.lookup(key, SIG) is not None
+    clock[0] += 0.2
+    assert cache.lookup(key, SIG) is None
+    assert len(cache) == 0
+
+
+def test_lru_eviction():
+    cache = AnswerCache(maxsize=2)
+    keys = [AnswerCache.key(q, "ctx") for q in ("a", "b", "c")]
+    cache.put(keys[0], SIG, answer("a"))
+    cache.put(keys[1], SIG, answer("b"))
+    cache.lookup(keys[0], SIG)  # "a" is now the most recently used
+    cache.put(keys[2], SIG, answer("c"))
+    assert cache.lookup(keys[1], SIG) is None
+    assert cache.lookup(keys[0], SIG) is not None
+    assert cache.lookup(keys[2], SIG) is not None
+
+
+def test_disabled_cache_stores_nothing():
+    cache = AnswerCache(maxsize=0)
+    cache.put(AnswerCache.key("q", "ctx"), SIG, answer("a"))
+    assert not cache.enabled and len(cache) == 0
+
+
+def test_signature_change_drops_entries():
+    cache = AnswerCache(maxsize=4)
+    key = AnswerCache.key("q", "ctx")
+    cache.put(key, SIG, answer("a"))
+    assert cache.lookup(key, ("index", 2)) is None
+    assert cache.lookup(key, SIG) is None
+
+
+def test_near_duplicate_hit():
+    cache = AnswerCache(maxsize=4, similarity_threshold=0.95)
+    cache.put(AnswerCache.key("how much does it cost", "ctx"), SIG, answer("price"), query_emb=unit(1, 0, 0))
+    cache.put(AnswerCache.key("who are you", "ctx"), SIG, answer("bot"), query_emb=unit(0, 1, 0))
+    result, similarity = cache.lookup(AnswerCache.key("what does it cost", "ctx"), SIG, lambda: unit(1, 0.1, 0))
+    assert result == answer("price")
+    assert similarity == pytest.approx(float(unit(1, 0.1, 0)[0]))
+    # Below the threshold, or with a different context: a miss
+    assert cache.lookup(AnswerCache.key("something else", "ctx"), SIG, lambda: unit(1, 1, 0)) is None
+    assert cache.lookup(AnswerCache.key("what does it cost", "other"), SIG, lambda: unit(1, 0.1, 0)) is None
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_exact_hit_does_not_embed():
+    cache = AnswerCache(maxsize=4, similarity_threshold=0.9)
+    key = AnswerCache.key("q", "ctx")
+    cache.put(key, SIG, answer("a"), query_emb=unit(1, 0))
+
+    def embed():
+        raise AssertionError("embedded on an exact hit")
+
+    assert cache.lookup(key, SIG, embed) is not None
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    cache.resize(1)
+    assert len(cache) == 1 and cache.get("c") == 3
@@ -0,0 +1,99 @@
+import re
+
+import pytest
+
+from rag.context import ELLIPSIS, MIN_TRUNCATED_TOKENS, NO_CONTEXT, TokenCounter, pack_context
+
+COUNTER = TokenCounter()
+
+
+def words(prefix, start, stop):
+    return [f"{prefix}{i}" for i in range(start, stop + 1)]
+
+
+def chunk(index, tokens, title="Doc"):
+    return {"content": " ".join(tokens), "chunk_index": index, "extra": {"source_title": title}}
+
+
+def bodies(packed):
+    # Block texts without their "[n] title — chunk #i" header lines
+    return [block.split("\n", 1)[1] for block in packed.text.split("\n\n")]
+
+
+def test_empty_input_is_no_context():
+    packed = pack_context([], COUNTER)
+    assert packed.text == NO_CONTEXT
+    assert packed.used == [] and packed.tokens == 0 and not packed.truncated
+
+
+def test_overlap_between_adjacent_chunks_is_dropped():
+    a = words("w", 1, 20)
+    b = words("w", 13, 30)  # shares w13..w20 with a, like chunk_overlap_words
+    packed = pack_context([chunk(0, a), chunk(1, b)], COUNTER, budget=0)
+    assert bodies(packed) == [" ".join(a), " ".join(words("w", 21, 30))]
+    assert packed.used == [0, 1]
+    assert re.findall(r"^\[(\d+)\] Doc — chunk #(\d+)$", packed.text, re.M) == [("1", "0"), ("2", "1")]
+
+
+def test_interior_repeat_leaves_an_ellipsis():
+    boilerplate = words("b", 1, 8)
+    first = words("a", 1, 9) + boilerplate
+    second = words("x", 1, 9) + boilerplate + words("y", 1, 9)
+    packed = pack_context([chunk(0, first), chunk(1, second)], COUNTER, budget=0)
+    assert bodies(packed)[1] == " ".join(words("x", 1, 9) + [ELLIPSIS] + words("y", 1, 9))
+
+
+def test_repeats_are_case_insensitive():
+    a = words("w", 1, 10)
+    b = [w.upper() for w in a] + words("n", 1, 9)
+    packed = pack_context([chunk(0, a), chunk(1, b)], COUNTER, budget=0)
+    assert bodies(packed)[1] == " ".join(words("n", 1, 9))
+
+
+def test_chunk_with_little_new_text_is_skipped():
+    a = words("w", 1, 12)
+    packed = pack_context([chunk(0, a), chunk(1, a + ["n1", "n2", "n3"])], COUNTER, budget=0)
+    assert packed.used == [0]
+
+
+def test_text_of_a_skipped_chunk_is_not_treated_as_seen():
+    a = words("w", 1, 12)
+    b = a + words("n", 1, 3)  # fewer than SHINGLE_WORDS new words: skipped
+    c = words("w", 8, 12) + words("n", 1, 3) + words("x", 1, 9)
+    packed = pack_context([chunk(0, a), chunk(1, b), chunk(2, c)], COUNTER, budget=0)
+    assert packed.used == [0, 2]
+    assert bodies(packed)[1] == " ".join(c)
+
+
+def test_no_budget_packs_everything():
+    chunks = [chunk(i, words(f"c{i}x", 1, 200)) for i in range(10)]
+    for budget in (0, -1):
+        packed = pack_context(chunks, COUNTER, budget=budget)
+        assert packed.used == list(range(10))
+        assert not packed.truncated
+        assert packed.tokens > 1000
+
+
+@pytest.mark.parametrize("budget", [40, 75, 100, 333, 500, 1000, 1500])
+def test_budget_is_never_exceeded(budget):
+    chunks = [chunk(i, words(f"c{i}x", 1, 120)) for i in range(12)]
+    packed = pack_context(chunks, COUNTER, budget=budget)
+    assert packed.tokens <= budget
+    assert COUNTER.count(packed.text) <= budget
+    assert packed.used == list(range(len(packed.used)))
+    if packed.truncated:
+        assert packed.text.endswith(ELLIPSIS)
+    # Packing stops at the first block that does not fit, cut or not
+    full = pack_context(chunks[:len(packed.used)], COUNTER, budget=0)
+    assert packed.truncated == (full.tokens > budget)
+
+
+def test_truncation_needs_min_tokens_of_room():
+    first = chunk(0, words("a", 1, 40))
+    tight = COUNTER.count(pack_context([first], COUNTER, budget=0).text) + MIN_TRUNCATED_TOKENS // 2
+    packed = pack_context([first, chunk(1, words("b", 1, 200))], COUNTER, budget=tight)
+    assert packed.used == [0] and not packed.truncated
+    roomy = tight + MIN_TRUNCATED_TOKENS * 2
+    packed = pack_context([first, chunk(1, words("b", 1, 200))], COUNTER, budget=roomy)
+    assert packed.used == [0, 1] and packed.truncated
+    assert packed.tokens <= roomy
@@ -0,0 +1,122 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import orjson
+import pytest
+
+from rag.config import RAGConfig
+from rag.fetch import iter_fetch_urls
+from rag.index import build_index
+from rag.types import Document
+
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class Site:
+    """Pages by path: version (in the body and the ETag), optional delay, or a 500 response."""
+
+    def __init__(self):
+        self.versions = {}
+        self.delays = {}
+        self.failing = set()
+        self.requests = []  # (path, If-None-Match, If-Modified-Since)
+
+
+@pytest.fixture
+def site():
+    site = Site()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            site.requests.append((self.path, self.headers.get("If-None-Match"), self.headers.get("If-Modified-Since")))
+            time.sleep(site.delays.get(self.path, 0.0))
+            if self.path in site.failing or self.path not in site.versions:
+                self.send_response(500 if self.path in site.failing else 404)
+                self.end_headers()
+                return
+            etag = f'"v{site.versions[self.path]}"'
+            if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == LAST_MODIFIED:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = f"<html><title>{self.path}</title><body>page {self.path} version {site.versions[self.path]}</body></html>".encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", LAST_MODIFIED)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    port = server.server_address[1]
+    # Two host names for one server, so per-host scheduling sees two hosts
+    site.hosts = (f"http://127.0.0.1:{port}", f"http://localhost:{port}")
+    yield site
+    server.shutdown()
+    server.server_close()
+
+
+def test_results_come_back_in_input_order(site):
+    urls = []
+    for i in range(8):
+        path = f"/p{i}"
+        site.versions[path] = 1
+        # Earlier URLs are slower, so completion order differs from input order
+        site.delays[path] = 0.02 * (8 - i)
+        urls.append(site.hosts[i % 2] + path)
+    results = list(iter_fetch_urls(urls, max_workers=3, per_host=1))
+    assert [r.url for r in results] == urls
+    assert all(r.error is None and f"page /p{i} version 1" in r.text for i, r in enumerate(results))
+
+
+def test_conditional_get_reuses_the_previous_copy(site):
+    site.versions.update({"/a": 1, "/b": 2, "/c": 1})
+    a, b, c = (site.hosts[0] + p for p in ("/a", "/b", "/c"))
+    previous = {
+        a: Document(a, "url", a, etag='"v1"'),
+        b: Document(b, "url", b, etag='"v1"'),  # stale validator: the page changed
+        c: Document(c, "url", c, last_modified=LAST_MODIFIED),
+    }
+    results = {r.url: r for r in iter_fetch_urls([a, b, c], previous=previous)}
+    assert results[a].not_modified and results[a].etag == '"v1"'
+    assert not results[b].not_modified and results[b].etag == '"v2"' and "version 2" in results[b].text
+    assert results[c].not_modified and results[c].last_modified == LAST_MODIFIED
+    assert ("/a", '"v1"', None) in site.requests
+    assert ("/c", None, LAST_MODIFIED) in site.requests
+
+
+def test_failed_fetch_reports_an_error(site):
+    site.failing.add("/down")
+    [result] = iter_fetch_urls([site.hosts[0] + "/down"])
+    assert result.error and "500" in result.error
+    assert result.text == ""
+
+
+def read_documents(index_dir):
+    lines = (index_dir / "meta" / "documents.jsonl").read_bytes().splitlines()
+    return {d["uri"]: d for d in map(orjson.loads, lines)}
+
+
+def test_update_keeps_a_page_whose_fetch_fails(tmp_path, site):
+    site.versions.update({"/keep": 1, "/flaky": 1})
+    urls = [site.hosts[0] + "/keep", site.hosts[0] + "/flaky"]
+    config = RAGConfig(index_dir=tmp_path / "index", embedding_model_name="hashing:64")
+    build_index(config, [], urls)
+    before = read_documents(config.index_dir)
+
+    site.failing.add("/flaky")
+    stats = build_index(config, [], urls, update=True)
+    after = read_documents(config.index_dir)
+    assert stats["urls_failed"] == 1
+    assert stats["documents_unchanged"] == 2
+    assert after[urls[1]]["checksum"] == before[urls[1]]["checksum"]
+    assert after[urls[1]]["etag"] == '"v1"'
+    chunks = (config.index_dir / "meta" / "chunks.jsonl").read_text(encoding="utf-8")
+    assert "page flaky version 1" in chunks
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+from rag.filters import MetadataIndex, parse_filter, write_filter_index
+from rag.types import Chunk
+
+
+def make_chunks():
+    docs = [
+        ("file", "/data/handbook.md", "Handbook"),
+        ("url", "https://docs.example.com/a", "Docs A"),
+        ("url", "https://docs.example.com/b", "Docs B"),
+        ("url", "https://blog.example.com/post", "FAQ"),
+        ("file", "/data/faq.md", "FAQ"),
+        ("file", "/data/notes.txt", ""),
+    ]
+    chunks = []
+    for d, (doc_type, uri, title) in enumerate(docs):
+        for i in range(d % 3 + 1):
+            chunks.append(Chunk(
+                chunk_id=f"{d}-{i}", document_source_id=uri, document_uri=uri, document_type=doc_type,
+                content="text", chunk_index=i, checksum=f"{d}-{i}", extra={"source_title": title},
+            ))
+    return chunks
+
+
+CHUNKS = make_chunks()
+
+
+def brute_force(pred):
+    return np.array([pred(c.document_type, c.document_uri, c.extra["source_title"]) for c in CHUNKS])
+
+
+CASES = [
+    ("document_type = url", lambda t, u, s: t == "url"),
+    ("document_type != url", lambda t, u, s: t != "url"),
+    ('uri ^= "https://docs.example.com/"', lambda t, u, s: u.startswith("https://docs.example.com/")),
+    ("uri ^= /data/", lambda t, u, s: u.startswith("/data/")),
+    ('source_title in ("Handbook", "FAQ")', lambda t, u, s: s in ("Handbook", "FAQ")),
+    ("source_title = ''", lambda t, u, s: s == ""),
+    (
+        'document_type = url and uri ^= "https://docs.example.com/" or source_title = FAQ',
+        lambda t, u, s: (t == "url" and u.startswith("https://docs.example.com/")) or s == "FAQ",
+    ),
+    (
+        'document_type = url and (uri ^= "https://docs.example.com/" or source_title = FAQ)',
+        lambda t, u, s: t == "url" and (u.startswith("https://docs.example.com/") or s == "FAQ"),
+    ),
+    ("NOT document_type = file AND NOT source_title = FAQ", lambda t, u, s: t != "file" and s != "FAQ"),
+    ("not (document_type = file or document_type = url)", lambda t, u, s: False),
+    ("uri = nowhere", lambda t, u, s: False),
+    ('source_title = "Docs \\"A\\""', lambda t, u, s: s == 'Docs "A"'),
+]
+
+
+def test_parse_tree():
+    assert parse_filter("document_type = url") == ("in", "document_type", ("url",))
+    assert parse_filter("uri != x") == ("not", ("in", "uri", ("x",)))
+    assert parse_filter("uri ^= 'http://'") == ("prefix", "uri", "http://")
+    # and binds tighter than or
+    assert parse_filter("uri = a or uri = b and uri = c") == (
+        "or", ("in", "uri", ("a",)), ("and", ("in", "uri", ("b",)), ("in", "uri", ("c",)))
+    )
+    assert parse_filter("source_title in (x, 'y z')") == ("in", "source_title", ("x", "y z"))
+
+
+@pytest.mark.parametrize("expr", [
+    "", "document_type", "document_type =", "author = x", "uri = a and", "(uri = a", "uri = a)",
+    "uri in ()", "uri in (a b)", "uri == a", "uri = 'unterminated",
+])
+def test_invalid_expressions(expr):
+    with pytest.raises(ValueError):
+        parse_filter(expr)
+
+
+@pytest.mark.parametrize("expr,pred", CASES)
+def test_masks_match_brute_force(expr, pred):
+    np.testing.assert_array_equal(MetadataIndex.from_chunks(CHUNKS).mask(expr), brute_force(pred))
+
+
+def test_persisted_index_matches_derived(tmp_path):
+    write_filter_index(tmp_path, CHUNKS)
+    loaded, derived = MetadataIndex.load(tmp_path, CHUNKS), MetadataIndex.from_chunks(CHUNKS)
+    for expr, _ in CASES:
+        np.testing.assert_array_equal(loaded.mask(expr), derived.mask(expr))
+
+
+def test_masks_are_cached_read_only():
+    index = MetadataIndex.from_chunks(CHUNKS)
+    mask = index.mask("document_type = url")
+    assert index.mask("document_type = url") is mask
+    with pytest.raises(ValueError):
+        mask[0] = True
@@ -0,0 +1,93 @@
+import pytest
+
+from rag.fusion import fuse_many, parse_weights
+
+# One query: BM25 returned docs 0, 1, 2 (best first), vector search returned docs 2, 3
+BM25_TOPS, BM25_SCORES = [[0, 1, 2]], [[3.0, 2.0, 1.0]]
+VECTOR_TOPS, VECTOR_SCORES = [[2, 3]], [[0.9, 0.5]]
+
+
+def fuse(method, **kwargs):
+    return fuse_many(
+        BM25_TOPS, VECTOR_TOPS, n_docs=5, k_fused=10, method=method,
+        bm25_scores=BM25_SCORES, vector_scores=VECTOR_SCORES, **kwargs,
+    )[0]
+
+
+def scores(rows):
+    return {doc: score for doc, score, _, _ in rows}
+
+
+def test_rrf():
+    rows = fuse("rrf", rrf_k=60)
+    # docs 1 and 3 tie at 1/61; the lower doc id comes first
+    assert [doc for doc, *_ in rows] == [2, 0, 1, 3]
+    assert scores(rows) == pytest.approx({0: 1 / 60, 1: 1 / 61, 2: 1 / 62 + 1 / 60, 3: 1 / 61})
+    # (doc, score, bm25 rank, vector rank), ranks 0-based and -1 when the signal missed the doc
+    assert [(doc, b, v) for doc, _, b, v in rows] == [(2, 2, 0), (0, 0, -1), (1, 1, -1), (3, -1, 1)]
+
+
+def test_weighted_rrf():
+    rows = fuse("weighted_rrf", rrf_k=60, weights=(2.0, 1.0))
+    assert scores(rows) == pytest.approx({0: 2 / 60, 1: 2 / 61, 2: 2 / 62 + 1 / 60, 3: 1 / 61})
+    assert [doc for doc, *_ in rows] == [2, 0, 1, 3]
+
+
+def test_rrf_ignores_weights():
+    assert fuse("rrf", weights=(5.0, 1.0)) == fuse("rrf")
+
+
+def test_combsum_minmax():
+    rows = fuse("combsum")
+    # bm25 normalized to [1, 0.5, 0], vector to [1, 0]; docs 0 and 2 tie at 1
+    assert scores(rows) == pytest.approx({0: 1.0, 1: 0.5, 2: 1.0, 3: 0.0})
+    assert [doc for doc, *_ in rows] == [0, 2, 1, 3]
+
+
+def test_combsum_zscore_weighted():
+    z = 1.5 ** 0.5  # (3 - 2) / std([3, 2, 1])
+    rows = fuse("combsum", norm="zscore", weights=(1.0, 2.0))
+    assert scores(rows) == pytest.approx({0: z, 1: 0.0, 2: -z + 2.0, 3: -2.0})
+
+
+def test_combmnz():
+    rows = fuse("combmnz")
+    # combsum times the number of signals that returned the doc
+    assert scores(rows) == pytest.approx({0: 1.0, 1: 0.5, 2: 2.0, 3: 0.0})
+    assert [doc for doc, *_ in rows] == [2, 0, 1, 3]
+
+
+def test_constant_lists_normalize():
+    rows = fuse_many([[0, 1]], [[]], 2, 10, method="combsum", bm25_scores=[[1.0, 1.0]], vector_scores=[[]])[0]
+    assert scores(rows) == {0: 1.0, 1: 1.0}
+
+
+@pytest.mark.parametrize("method", ["rrf", "weighted_rrf", "combsum", "combmnz"])
+def test_batch_matches_single_queries(method):
+    bm25_tops = [[0, 1, 2], [], [4, 3]]
+    bm25_scores = [[3.0, 2.0, 1.0], [], [0.5, 0.1]]
+    vector_tops = [[2, 3], [1], []]
+    vector_scores = [[0.9, 0.5], [0.3], []]
+    batch = fuse_many(bm25_tops, vector_tops, 5, 2, method=method, weights=(1.0, 0.5), bm25_scores=bm25_scores, vector_scores=vector_scores)
+    for qi in range(3):
+        single = fuse_many(
+            [bm25_tops[qi]], [vector_tops[qi]], 5, 2, method=method, weights=(1.0, 0.5),
+            bm25_scores=[bm25_scores[qi]], vector_scores=[vector_scores[qi]],
+        )[0]
+        assert batch[qi] == single
+        assert len(single) == min(2, len(set(bm25_tops[qi]) | set(vector_tops[qi])))
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        fuse_many([[0]], [[0]], 1, 1, method="borda")
+    with pytest.raises(ValueError):
+        fuse_many([[0]], [[0]], 1, 1, method="combsum")  # needs scores
+    with pytest.raises(ValueError):
+        fuse("combsum", norm="rank")
+
+
+def test_parse_weights():
+    assert parse_weights("1,0.5") == (1.0, 0.5)
+    with pytest.raises(ValueError):
+        parse_weights("1")
@@ -0,0 +1,86 @@
+import shutil
+
+import numpy as np
+import orjson
+import pytest
+
+from rag.config import RAGConfig
+from rag.index import build_index
+
+# Per-build timestamps (and created_at fields in JSON); everything else must be identical between an --update build and a full rebuild
+TIMESTAMP_FILES = {"meta/chunks.created_at.npy"}
+
+
+def write_docs(root, docs):
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    for name, text in docs.items():
+        (root / name).write_text(text, encoding="utf-8")
+
+
+def words(seed, n):
+    rng = np.random.default_rng(seed)
+    return " ".join(f"w{i}" for i in rng.integers(0, 500, size=n))
+
+
+def build(index_dir, docs_dir, update=False):
+    config = RAGConfig(index_dir=index_dir, embedding_model_name="hashing:64", max_chunk_words=50, chunk_overlap_words=10)
+    return build_index(config, [docs_dir], update=update)
+
+
+def read_rows(path):
+    rows = [orjson.loads(line) for line in path.read_bytes().splitlines() if line.strip()]
+    for row in rows:
+        row.pop("created_at", None)
+    return rows
+
+
+def assert_same_index(a, b):
+    files_a = sorted(p.relative_to(a).as_posix() for p in a.rglob("*") if p.is_file())
+    files_b = sorted(p.relative_to(b).as_posix() for p in b.rglob("*") if p.is_file())
+    assert files_a == files_b
+    for rel in files_a:
+        if rel in TIMESTAMP_FILES:
+            continue
+        pa, pb = a / rel, b / rel
+        if rel.endswith(".npy"):
+            np.testing.assert_array_equal(np.load(pa), np.load(pb), err_msg=rel)
+        elif rel.endswith(".jsonl"):
+            assert read_rows(pa) == read_rows(pb), rel
+        elif rel == "meta/config.json":
+            assert {**orjson.loads(pa.read_bytes()), "created_at": None} == {**orjson.loads(pb.read_bytes()), "created_at": None}
+        else:
+            assert pa.read_bytes() == pb.read_bytes(), rel
+
+
+@pytest.fixture
+def docs_dir(tmp_path):
+    return tmp_path / "docs"
+
+
+def test_update_matches_full_rebuild(tmp_path, docs_dir):
+    # The update index lives in its own parent dir, so both builds see the same absolute document paths
+    before = {"keep.txt": words(1, 120), "change.md": words(2, 200), "delete.txt": words(3, 80)}
+    write_docs(docs_dir, before)
+    updated = tmp_path / "updated" / "index"
+    build(updated, docs_dir)
+
+    after = {"keep.txt": before["keep.txt"], "change.md": words(2, 150) + " new tail " + words(4, 30), "add.txt": words(5, 90)}
+    write_docs(docs_dir, after)
+    stats = build(updated, docs_dir, update=True)
+    assert (stats["documents_unchanged"], stats["documents_changed"], stats["documents_added"], stats["documents_deleted"]) == (1, 1, 1, 1)
+    assert stats["chunks_reused"] > 0
+
+    full = tmp_path / "full" / "index"
+    build(full, docs_dir)
+    assert_same_index(updated, full)
+
+
+def test_update_without_changes_reuses_everything(tmp_path, docs_dir):
+    write_docs(docs_dir, {"a.txt": words(6, 120), "b.txt": words(7, 60)})
+    index_dir = tmp_path / "index"
+    first = build(index_dir, docs_dir)
+    stats = build(index_dir, docs_dir, update=True)
+    assert stats["documents_unchanged"] == 2
+    assert stats["chunks_embedded"] == 0
+    assert stats["chunks_reused"] == first["chunks_total"]
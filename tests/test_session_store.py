@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+import time
+
+import orjson
+import pytest
+
+from session_store import MemorySessionStore, SessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    stores = []
+
+    def make(**kwargs):
+        if request.param == "memory":
+            store = MemorySessionStore(**kwargs)
+        else:
+            store = SQLiteSessionStore(tmp_path / "sessions.db", **kwargs)
+        stores.append(store)
+        return store
+
+    yield make
+    for store in stores:
+        store.close()
+
+
+def expected_bytes(contexts):
+    return sum(len(sid) + len(orjson.dumps(ctx)) for sid, ctx in contexts.items())
+
+
+def test_merge_get_delete(make_store):
+    store = make_store()
+    assert store.get("s1") == {}
+    assert store.merge_selections("s1", {"channel": "web"}) == {"selections": {"channel": "web"}}
+    assert store.merge_selections("s1", {"audience": "b2b", "channel": "sms"}) == {"selections": {"channel": "sms", "audience": "b2b"}}
+    store.merge_selections("s2", {"channel": "email"})
+    assert store.get("s1") == {"selections": {"channel": "sms", "audience": "b2b"}}
+    store.delete("s1")
+    store.delete("unknown")
+    assert store.get("s1") == {}
+    assert store.get("s2") == {"selections": {"channel": "email"}}
+
+
+def test_stats_track_sessions_and_bytes(make_store):
+    store = make_store()
+    contexts = {}
+    for i in range(5):
+        contexts[f"session-{i}"] = store.merge_selections(f"session-{i}", {"step": i})
+    contexts["session-0"] = store.merge_selections("session-0", {"extra": "x" * 100})
+    store.delete("session-3")
+    del contexts["session-3"]
+    stats = store.stats()
+    assert (stats["sessions"], stats["bytes"]) == (4, expected_bytes(contexts))
+
+
+def test_ttl_expiry(make_store):
+    store = make_store(ttl=0.05)
+    store.merge_selections("s1", {"a": 1})
+    assert store.get("s1") == {"selections": {"a": 1}}
+    time.sleep(0.1)
+    assert store.get("s1") == {}
+    # An expired session starts over on the next merge
+    assert store.merge_selections("s1", {"b": 2}) == {"selections": {"b": 2}}
+    time.sleep(0.1)
+    assert store.expire() == 1
+    assert store.stats()["sessions"] == 0
+    assert store.stats()["bytes"] == 0
+
+
+def test_max_sessions_keeps_most_recent(make_store):
+    store = make_store(max_sessions=3)
+    for i in range(5):
+        store.merge_selections(f"s{i}", {"i": i})
+        time.sleep(0.001)
+    store.expire()
+    assert [sid for sid in ("s0", "s1", "s2", "s3", "s4") if store.get(sid)] == ["s2", "s3", "s4"]
+    assert store.stats()["sessions"] == 3
+
+
+def test_incomplete_store_fails_on_creation():
+    class Incomplete(SessionStore):
+        def get(self, session_id):
+            return {}
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_sqlite_close_closes_every_thread_connection(tmp_path):
+    store = SQLiteSessionStore(tmp_path / "sessions.db")
+    conns = []
+
+    def use():
+        store.merge_selections(threading.current_thread().name, {"a": 1})
+        conns.append(store._conn())
+
+    threads = [threading.Thread(target=use) for _ in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    conns.append(store._conn())
+    store.close()
+    for conn in conns:
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+
+def test_sqlite_totals_seeded_for_existing_file(tmp_path):
+    path = tmp_path / "sessions.db"
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL)")
+    data = orjson.dumps({"selections": {"a": 1}})
+    conn.execute("INSERT INTO sessions VALUES (?, ?, ?)", ("old", data, time.time() + 60))
+    conn.commit()
+    conn.close()
+    store = SQLiteSessionStore(path)
+    assert store.stats()["sessions"] == 1
+    assert store.stats()["bytes"] == len("old") + len(data)
+    # Two stores on one file (two workers) see each other's writes in the totals
+    other = SQLiteSessionStore(path)
+    other.merge_selections("new", {"b": 2})
+    assert store.stats()["sessions"] == 2
+    store.close()
+    other.close()